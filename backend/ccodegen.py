@@ -1,4 +1,6 @@
 import backend.ir as ir
+from backend.stringpool import StringPool
+from backend.naming import signature, stable_hash
 import json
 
 BUILTINS = """
@@ -8,30 +10,70 @@ BUILTINS = """
 #include <string.h>
 #include "cedar/re.h"
 typedef unsigned char _ch_bool;
-typedef struct { unsigned length; void* data; } _ch_array;
+/* Arrays that are 'owned' have their data on the heap and can be grown in place. Arrays
+ * that aren't owned (array literals on the stack, string literals, etc) may share their
+ * data with other arrays, or have read-only data, thus they are copied to the heap the
+ * first time they are appended to or reserved, whatever their capacity. */
+typedef struct { unsigned length; unsigned capacity : 31; unsigned owned : 1; void* data; } _ch_array;
+#define ARRAY_MAX_CAPACITY 0x7fffffffLL
 
 static _ch_bool array_equals(_ch_array lhs, _ch_array rhs, int element_size) {
     return (lhs.length == rhs.length) && (memcmp(lhs.data, rhs.data, lhs.length * element_size) == 0);
 }
 
-static void array_append(_ch_array* array, int element_size, void* element) {
-    unsigned old_byte_size = array->length * element_size;
-    unsigned new_byte_size = old_byte_size + element_size;
+static void array_reserve(_ch_array* array, int element_size, long long capacity) {
     void* new_data = 0;
+    /* The capacity must fit its bit field */
+    if (capacity < 0 || capacity > ARRAY_MAX_CAPACITY) {
+        abort();
+    }
+    if (array->owned && capacity <= array->capacity) {
+        return;
+    }
+    if (capacity < array->length) {
+        capacity = array->length;
+    }
 
-    /* Check if array is on the stack (assuming stack grows towards lower addresses) */
-    int stack_test;
-    if ((void*)&stack_test < array->data) {
-        new_data = malloc(new_byte_size);
-        memcpy(new_data, array->data, old_byte_size);
+    if (array->owned) {
+        new_data = realloc(array->data, (size_t)capacity * element_size);
     } else {
-        new_data = realloc(array->data, new_byte_size);
+        new_data = malloc((size_t)capacity * element_size);
+        if (array->length > 0) {
+            memcpy(new_data, array->data, array->length * element_size);
+        }
     }
 
-    /* Copy new element to the end of the array */
-    memcpy((char*)new_data + old_byte_size, element, element_size);
-
     array->data = new_data;
+    array->capacity = capacity;
+    array->owned = 1;
+}
+
+static void array_shrink_to_fit(_ch_array* array, int element_size) {
+    if (!array->owned || array->capacity == array->length) {
+        return;
+    }
+    if (array->length == 0) {
+        free(array->data);
+        array->data = 0;
+        array->owned = 0;
+    } else {
+        array->data = realloc(array->data, array->length * element_size);
+    }
+    array->capacity = array->length;
+}
+
+static void array_append(_ch_array* array, int element_size, void* element) {
+    /* Grow geometrically, such that appending N elements is amortized O(N) */
+    if (!array->owned || array->length == array->capacity) {
+        long long capacity = array->capacity < 4 ? 4 : 2LL * array->capacity;
+        if (capacity > ARRAY_MAX_CAPACITY) {
+            capacity = array->length + 1LL;
+        }
+        array_reserve(array, element_size, capacity);
+    }
+
+    /* Copy new element to the end of the array */
+    memcpy((char*)array->data + array->length * element_size, element, element_size);
     array->length++;
 }
 
@@ -54,54 +96,76 @@ static int type_tag(void* baseptr, int* lut, int index_offset) {
 
 """
 
+# Bytes that can be written as-is inside a C string literal. Note that '?' is excluded
+# to avoid accidentally forming trigraphs.
+C_LITERAL_SAFE_BYTES = frozenset(b for b in range(0x20, 0x7f) if chr(b) not in '"\\?')
+
+def c_string_literal(data: bytes, chunk_size=64) -> str:
+    """
+    Returns data as a sequence of adjacent C string literals, one per line, with bytes
+    that can't be written as-is emitted as (three digit) octal escapes.
+    """
+    if len(data) == 0:
+        return '""'
+    chunks = []
+    for begin in range(0, len(data), chunk_size):
+        chunk = data[begin:begin + chunk_size]
+        chunks.append('"%s"' % "".join(chr(b) if b in C_LITERAL_SAFE_BYTES else "\\%03o" % b for b in chunk))
+    return "\n    ".join(chunks)
 
 class FuncCodeGen:
-    def __init__(self, machine_def, ir_modules):
+    def __init__(self, machine_def, ir_modules, string_pool_format='literal'):
+        """
+        string_pool_format is one of:
+          'literal' - the string pool is emitted as (chunked) C string literals.
+          'bytes'   - the string pool is emitted as a list of decimal byte values.
+        """
+        assert string_pool_format in ('literal', 'bytes'), string_pool_format
         self.machine_def = machine_def
         self.ir_modules = ir_modules
-        self.includes = set()
+        self.string_pool_format = string_pool_format
+        # NOTE: A dict rather than a set, to keep the order of the #includes deterministic.
+        self.includes = {}
         self.decls = []
         self.code = []
         self.indent_level = 0
         self.generated_funcs = set()
         self.generated_types = {}
         self.generated_rtti = {}
-        self.defined_symbols = {}
-        self.defined_symbol_data = []
-        self.defined_strings = {}
-        self.defined_string_data = ""
+        self.symbol_pool = StringPool()
+        self.string_pool = StringPool()
         self.function_decls = []
         self.common_member_luts = {}
+        # The functions referred to, by filename and name, see generate_units
+        self.used_functions = {}
+        self.uses_symbols = False
 
 
     def get_code(self):
-        symdefs = ['static const char* _CH_SYMBOL_VALUES = "%s";' % "".join(self.defined_symbol_data)]
-        byte_array = bytearray(self.defined_string_data.encode('utf-8'))
-        strdefs = ['static unsigned char _CH_STRING_VALUES[] = {%s};' % ",".join(str(b) for b in byte_array)]
-        return BUILTINS + "\n".join(list(self.includes) + symdefs + strdefs + self.decls + self.code)
+        return BUILTINS + "\n".join(list(self.includes) + [self.symbol_pool_definition(), self.string_pool_definition()] + self.decls + self.code)
+
+    def symbol_pool_definition(self):
+        # NOTE: Octal escapes are at most three digits, so '\000' can't merge with a following digit.
+        return 'static const char* _CH_SYMBOL_VALUES = "%s";' % self.symbol_pool.data().replace("\0", "\\000")
+
+    def string_pool_definition(self):
+        byte_array = self.string_pool.data().encode('utf-8')
+        match self.string_pool_format:
+            case 'literal':
+                return 'static unsigned char _CH_STRING_VALUES[] =\n    %s;' % c_string_literal(byte_array)
+            case 'bytes':
+                return 'static unsigned char _CH_STRING_VALUES[] = {%s};' % ",".join(str(b) for b in byte_array)
 
     def indent(self):
         return "    " * self.indent_level
     
     def internalize_symbol(self, value):
-        if value in self.defined_symbols:
-            return self.defined_symbols[value]
-        else:
-            idx = sum(len(s) - 1 for s in self.defined_symbol_data)
-            self.defined_symbols[value] = idx
-            self.defined_symbol_data.append(value + "\\0")
-            return idx
+        self.uses_symbols = True
+        # Symbols are null-terminated, as opposed to strings.
+        return self.symbol_pool.intern(value + "\0")
         
     def internalize_string(self, value):
-        if value in self.defined_strings:
-            return "&_CH_STRING_VALUES[%d]" % self.defined_strings[value]
-        else:
-            idx = self.defined_string_data.find(value)
-            if idx == -1:
-                idx = len(self.defined_string_data)
-                self.defined_string_data += value
-            self.defined_strings[value] = idx
-            return "&_CH_STRING_VALUES[%d]" % idx
+        return "&_CH_STRING_VALUES[%d]" % self.string_pool.intern(value)
 
     def function_signature(self, func_def: ir.FunctionDefinition):
         args = list(zip(func_def.argtys_implicit, func_def.argnames_implicit)) + list(zip(func_def.argtys, func_def.argnames))
@@ -126,16 +190,20 @@ class FuncCodeGen:
     def ctor_name(self, ctor):
         match ctor:
             case ir.TypeConstructor():
-                return f"ch_ctor_{ctor.name}_{abs(hash(ctor))}"
+                return f"ch_ctor_{ctor.name}_{stable_hash(signature(ctor))}"
             case ir.CStructDefinition():
-                return f"ch_cstruct_{ctor.name}_{abs(hash(ctor))}"
+                return f"ch_cstruct_{ctor.name}_{stable_hash(signature(ctor))}"
         assert False, ctor
     
     def func_name(self, func_def):
+        self.used_functions[(func_def.filename, func_def.name)] = func_def
         # Do not name-mangle the main function.
         if func_def.name == 'main' and self.ir_modules[func_def.filename].main_module:
             return 'main'
-        return f"ch_func_{func_def.name}_{abs(hash(func_def.filename))}"
+        return self.global_name(func_def.filename, func_def.name)
+
+    def global_name(self, filename, name):
+        return f"ch_func_{name}_{stable_hash(filename)}"
     
     def generate_tag_lut(self, ty):
         if (ty, '$$tag$$') in self.common_member_luts:
@@ -144,7 +212,7 @@ class FuncCodeGen:
         ctyname = self.generate_type(ty)
         lutname = f"LUT_tag_{ctyname.replace(' ', '_')}"
         values = ", ".join(str(ctor.tag_value) for ctor in ty.constructors)
-        lut_decl = f"int {lutname}[] = {{ {values} }};\n"
+        lut_decl = f"static int {lutname}[] = {{ {values} }};\n"
         self.decls.append(lut_decl)
         self.common_member_luts[(ty, '$$tag$$')] = lutname
         return lutname
@@ -156,7 +224,7 @@ class FuncCodeGen:
         ctyname = self.generate_type(ty)
         lutname = f"LUT_{ctyname.replace(' ', '_')}_{fieldname}"
         offsets = ", ".join(f"offsetof({ctyname}, ch_{ty.constructors[i].name}.ch_{fieldname})" for i in range(len(ty.constructors)))
-        lut_decl = f"unsigned char {lutname}[] = {{ {offsets} }};\n"
+        lut_decl = f"static unsigned char {lutname}[] = {{ {offsets} }};\n"
         self.decls.append(lut_decl)
         self.common_member_luts[(ty, fieldname)] = lutname
         return lutname
@@ -167,7 +235,7 @@ class FuncCodeGen:
         fnname = "get_index_array_of_" + eltyname.replace(" ", "_")
         if fnname in self.generated_funcs:
             return fnname
-        self.decls.append(f"{eltyname}* {fnname}(_ch_array array, unsigned index) {{ assert(array.length > index); return &(({eltyname}*)array.data)[index]; }}")
+        self.decls.append(f"static {eltyname}* {fnname}(_ch_array array, unsigned index) {{ assert(array.length > index); return &(({eltyname}*)array.data)[index]; }}")
         self.generated_funcs.add(fnname)
         return fnname
 
@@ -176,7 +244,7 @@ class FuncCodeGen:
         # NOTE: Since we're calling generate_type() recursively, we can't output directly to self.decls
         decls = []
         fname = ty.filename.replace("/", "_").replace(".", "_")
-        tyname = f"ch_{ty.name}_{fname}_{abs(hash(ty))}"
+        tyname = f"ch_{ty.name}_{fname}_{stable_hash(signature(ty))}"
         self.generated_types[ty] = "union " + tyname        
         self.decls.append(f"union {tyname};")
 
@@ -229,11 +297,11 @@ class FuncCodeGen:
                 return "uint%d_t" % (8 * bytes)
             case ir.RttiType():
                 return "__ch_rtti"
-            case ir.TupleType(positional, named, names, layout_types, layout_names):
+            case ir.TupleType(positional, named, names):
                 c_pos = " ".join("%s ch_%s;" % (self.generate_type(t), idx) for idx, t in enumerate(positional))
                 name_dict = dict(zip(names, named))
                 c_named = " ".join("%s ch_%s;" % (self.generate_type(name_dict[name]), name) for name in sorted(names))
-                name = "ch_tuple_%d" % abs(hash(ty))
+                name = "ch_tuple_%s" % stable_hash(signature(ty))
                 self.decls.append(f"typedef struct {{ {c_pos} {c_named} }} {name};")
                 self.generated_types[ty] = name
 
@@ -243,13 +311,14 @@ class FuncCodeGen:
 
                 all_field_names = [fname for (_fty, fname) in all_fields]
                 inits = " ".join("target.ch_%s = eval_%s;" % (fname, fname) for fname in all_field_names)
+                _layout_types, layout_names = ty.layout() or ((), ())
                 pad_inits = " ".join("target.ch_%s = 0;" % fname for fname in layout_names if fname not in all_field_names)
                 self.decls.append("#define %s_ctor(%s) do { %s %s %s } while (0)" % (name, args, evals, inits, pad_inits))
                 self.generated_types[ty] = name
                 return name
             case ir.UnionType(types):
                 mems = " ".join("%s _%s;" % (self.generate_type(t), idx) for idx, t in enumerate(types))
-                name = "ch_union_%d" % abs(hash(ty))
+                name = "ch_union_%s" % stable_hash(signature(ty))
                 self.decls.append(f"typedef struct {{ int _tag; union {{ {mems} }} value; }} {name};")
                 self.generated_types[ty] = name
                 return name
@@ -257,13 +326,13 @@ class FuncCodeGen:
                 return self.generate_type_definition(ty)
             case ir.OptionType(t):
                 cty = self.generate_type(t)
-                name = "ch_option_%d" % abs(hash(ty))
+                name = "ch_option_%s" % stable_hash(signature(ty))
                 self.decls.append(f"typedef union {{ struct {{ unsigned char _has_value; {cty} _value; }} present; struct {{ unsigned char _has_value; }} absent; }} {name};")
                 self.generated_types[ty] = name
                 return name
             case ir.FunctionType(retty, argtys):
                 arglist = ", ".join(f"{self.generate_type(arg_type)}" for arg_type in argtys)
-                name = "_ch_funcptr_%d" % abs(hash(ty))
+                name = "_ch_funcptr_%s" % stable_hash(signature(ty))
                 self.decls.append(f"typedef {self.generate_type(retty)} (*{name})({arglist});")
                 self.generated_types[ty] = name
                 return name
@@ -278,18 +347,18 @@ class FuncCodeGen:
                 # included file might name-clash with the generated code. Suggestion is to do #undef of everything
                 # that isn't used in the generated code, and the remaining #defines we rename by repeating the definition
                 # but under a different name that does not name-clash.
-                self.includes.add(f'#include "{ty.filename}"')
+                self.includes[f'#include "{ty.filename}"'] = None
                 name = f"struct {ty.name}"
                 self.generated_types[ty] = name
                 return name
             case ir.CUnionDefinition():
-                self.includes.add(f'#include "{ty.filename}"')
+                self.includes[f'#include "{ty.filename}"'] = None
                 return f"union {ty.name}"
             case ir.CEnumDefinition():
-                self.includes.add(f'#include "{ty.filename}"')
+                self.includes[f'#include "{ty.filename}"'] = None
                 return f"enum {ty.name}"
             case ir.CTypedefDefinition():
-                self.includes.add(f'#include "{ty.filename}"')
+                self.includes[f'#include "{ty.filename}"'] = None
                 return f"{ty.name}"
             case _:
                 raise ValueError(f"Unknown type: {ty}")
@@ -321,6 +390,8 @@ class FuncCodeGen:
                     for i in range(num_groups):
                         n = lut.get(i, i)
                         self.code.append(f"{self.indent()}result.present._value.ch_{n}.ch_String.ch_data.length = captures[{i}].end - captures[{i}].begin;")
+                        self.code.append(f"{self.indent()}result.present._value.ch_{n}.ch_String.ch_data.capacity = captures[{i}].end - captures[{i}].begin;")
+                        self.code.append(f"{self.indent()}result.present._value.ch_{n}.ch_String.ch_data.owned = 0;")
                         self.code.append(f"{self.indent()}result.present._value.ch_{n}.ch_String.ch_data.data = (void*)captures[{i}].begin;")
                     self.code.append(f"return result;")
             case ir.ReturnValue(value=value):
@@ -399,7 +470,7 @@ class FuncCodeGen:
             case ir.StoreLocalExpr(name=name, value=value):
                 return f"({name} = {self.generate_expression(value)})"
             case ir.LoadGlobal(filename=filename, name=name):
-                return f"ch_func_{name}_{abs(hash(filename))}"
+                return self.func_name(self.ir_modules[filename].function_index[name][0])
             case ir.LoadCGlobal(var=var):
                 return var.name
             case ir.AddressOf(_ty, expr):
@@ -440,6 +511,8 @@ class FuncCodeGen:
                 self.function_decls.append(f"    {elty_name} {temp_name}_data[{c_length}];")
                 self.function_decls.append(f"    {arrty_name} {temp_name};")
                 self.code.append(f"{self.indent()}{temp_name}.length = {real_length};")
+                self.code.append(f"{self.indent()}{temp_name}.capacity = {real_length};")
+                self.code.append(f"{self.indent()}{temp_name}.owned = 0;")
                 self.code.append(f"{self.indent()}{temp_name}.data = &{temp_name}_data;")
                 for idx, x in enumerate(exprs):
                     cexpr = self.generate_expression(x)
@@ -453,6 +526,8 @@ class FuncCodeGen:
                 self.function_decls.append(f"    {arrty_name} {temp_name};")
                 c_pointer = self.generate_expression(pointer)
                 self.code.append(f"{self.indent()}{temp_name}.length = {length};")
+                self.code.append(f"{self.indent()}{temp_name}.capacity = {length};")
+                self.code.append(f"{self.indent()}{temp_name}.owned = 0;")
                 self.code.append(f"{self.indent()}{temp_name}.data = {c_pointer};")
                 return temp_name
             case ir.MakeUnion(ty, expr):
@@ -506,7 +581,7 @@ class FuncCodeGen:
                 args = ", ".join(self.generate_expression(a) for a in args)
                 return f"{self.generate_expression(fn)}({args})"
             case ir.CallCFunction(ty, fn, args):
-                self.includes.add(f'#include "{fn.filename}"')
+                self.includes[f'#include "{fn.filename}"'] = None
                 args = ", ".join(self.generate_expression(a) for a in args)
                 return f"{fn.name}({args})"
             case ir.ArrayAppend(ty, array, value):
@@ -517,12 +592,18 @@ class FuncCodeGen:
             case ir.ArrayPop(ty , array):
                 elty = self.generate_type(ty)
                 return f"(*({elty}*)array_pop(&{self.generate_expression(array)}, sizeof({elty})))"
+            case ir.ArrayReserve(ty, array, capacity):
+                elty = self.generate_type(array.ty.elty)
+                return f"array_reserve(&{self.generate_expression(array)}, sizeof({elty}), {self.generate_expression(capacity)})"
+            case ir.ArrayShrinkToFit(ty, array):
+                elty = self.generate_type(array.ty.elty)
+                return f"array_shrink_to_fit(&{self.generate_expression(array)}, sizeof({elty}))"
             case _:
                 raise ValueError(f"Unknown expression: {expr}")
 
 
-def generate(ir_modules, machine_def):
-    gen = FuncCodeGen(machine_def, ir_modules)
+def generate(ir_modules, machine_def, string_pool_format='literal'):
+    gen = FuncCodeGen(machine_def, ir_modules, string_pool_format)
     for module in ir_modules.values():
         for d in module.functions:
             if type(d) == ir.FunctionDefinition:
@@ -531,4 +612,54 @@ def generate(ir_modules, machine_def):
         for d in module.functions:
             if type(d) == ir.FunctionDefinition:
                 gen.generate(d)
-    return gen.get_code()
\ No newline at end of file
+    return gen.get_code()
+
+
+BUILTINS_HEADER = "cedar_builtins.h"
+SYMBOLS_HEADER = "cedar_symbols.h"
+
+def unit_filename(module_filename):
+    # NOTE: The hash tells apart modules whose names only differ in the replaced characters
+    return "%s_%s.c" % (module_filename.replace("/", "_").replace(".", "_"), stable_hash(module_filename)[:8])
+
+def header_code(filename, code):
+    guard = "_CH_%s_" % filename.replace(".", "_").upper()
+    return "\n".join([f"#ifndef {guard}", f"#define {guard}", code, "#endif"])
+
+def generate_units(ir_modules, machine_def, string_pool_format='literal'):
+    """
+    Like generate(), but emits one C translation unit per module instead of a single one.
+    Returns the code of the headers shared between the units and the code of each unit,
+    both as dicts keyed by the name of the file.
+
+    A unit defines the types and declares the functions it uses itself, rather than
+    including them from a common header, such that it only changes when those do. The
+    shared headers are the builtins, which only change with the compiler, and the symbol
+    pool, as symbols are global. The latter is only included by the units that use symbols
+    or C headers (which may refer to the symbol pool). Each unit has its own string pool.
+    """
+    assert string_pool_format in ('literal', 'bytes'), string_pool_format
+    symbols = FuncCodeGen(machine_def, ir_modules, string_pool_format)
+    units = {}
+    for module in ir_modules.values():
+        funcs = [d for d in module.functions if type(d) == ir.FunctionDefinition]
+        if len(funcs) == 0:
+            continue
+        gen = FuncCodeGen(machine_def, ir_modules, string_pool_format)
+        gen.symbol_pool = symbols.symbol_pool
+        for d in funcs:
+            gen.generate(d)
+        code = gen.code
+        gen.code = []
+        # NOTE: Declaring a function can add to the used functions, thus iterate over a copy
+        for d in list(gen.used_functions.values()):
+            gen.declare_function(d)
+        includes = [f'#include "{BUILTINS_HEADER}"'] + list(gen.includes)
+        if gen.uses_symbols or len(gen.includes) > 0:
+            includes.append(f'#include "{SYMBOLS_HEADER}"')
+        strdefs = [gen.string_pool_definition()] if gen.string_pool.length > 0 else []
+        units[unit_filename(module.filename)] = "\n".join(includes + gen.decls + gen.code + strdefs + code)
+
+    headers = {BUILTINS_HEADER: header_code(BUILTINS_HEADER, BUILTINS),
+               SYMBOLS_HEADER: header_code(SYMBOLS_HEADER, symbols.symbol_pool_definition())}
+    return headers, units
@@ -1,15 +1,119 @@
-from dataclasses import dataclass, field
+import weakref
+from dataclasses import dataclass, field, fields, replace
 from typing import List, Optional
 from frontend.astnodes import Location
 
 
 @dataclass(eq=True, frozen=True)
 class Type:
-    pass
+    # See InternedType
+    placeholder = False
 
 @dataclass(eq=True, frozen=True)
 class CType:
-    pass
+    placeholder = False
+
+# The interned types by their class and interning_key. A type is forgotten once nothing
+# else refers to it, such that the types of a compilation don't outlive it.
+INTERNED = weakref.WeakValueDictionary()
+
+class Interned(type):
+    """
+    The metaclass of InternedType. Constructing a type that was constructed before
+    returns the existing instance, without constructing a new one.
+    """
+    def __call__(cls, *args, **kwargs):
+        if cls.placeholder:
+            return super().__call__(*args, **kwargs)
+        if kwargs or len(args) != len(cls.__match_args__):
+            ty = super().__call__(*args, **kwargs)
+            args = tuple(getattr(ty, name) for name in cls.__match_args__)
+        key = interning_key(args)
+        if key is None:
+            ty = super().__call__(*args)
+            # Ugly hack
+            ty.__dict__['placeholder'] = True
+            return ty
+        interned = INTERNED.get((cls, key))
+        if interned is None:
+            interned = super().__call__(*args)
+            # Ugly hack
+            interned.__dict__['cached_hash'] = hash(args)
+            INTERNED[(cls, key)] = interned
+        return interned
+
+class InternedType(metaclass=Interned):
+    """
+    A type that is defined by its structure, rather than by where it is defined like
+    TypeDefinition. There is one instance of every such type, thus two types are equal
+    when they are the same object, and the hash of a type is computed once.
+
+    UninferredType, and the types containing it, are placeholders instead: every one is
+    a new instance, compared by structure. They are never changed, rather the typechecker
+    replaces them by the interned types it infers for them (see typecheck.resolve_inferred).
+    """
+    def identity(self):
+        return tuple(getattr(self, name) for name in self.__match_args__)
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if type(other) is not type(self) or not (self.placeholder or other.placeholder):
+            return False
+        return self.identity() == other.identity()
+
+    def __hash__(self):
+        if self.placeholder:
+            return hash(self.identity())
+        return self.cached_hash
+
+    # Construct the type when unpickling, which interns it
+    def __reduce__(self):
+        return type(self), self.identity()
+
+def interning_key(values):
+    """
+    Returns the key of a type with the given identity among the interned types, or None
+    when it is a placeholder. The key holds the types it contains, which are the same when
+    they are the same object. The interned types compare that way, the others, such as
+    TypeDefinition, are compared by their id. The key holding them keeps the id from being
+    reused.
+    """
+    key = []
+    for value in values:
+        if isinstance(value, (Type, CType)):
+            if value.placeholder:
+                return None
+            if not isinstance(value, InternedType):
+                key.append(id(value))
+        elif type(value) in (tuple, list):
+            value = interning_key(value)
+            if value is None:
+                return None
+        key.append(value)
+    return tuple(key)
+
+def substitute_types(value, substitute):
+    """
+    Returns the instruction, or the list or tuple of instructions, with every type in it
+    replaced by substitute(type). The parts that keep their types are returned as they are.
+    """
+    if isinstance(value, (Type, CType)):
+        return substitute(value)
+    if type(value) in (tuple, list):
+        values = [substitute_types(v, substitute) for v in value]
+        if all(new is old for new, old in zip(values, value)):
+            return value
+        return type(value)(values)
+    if isinstance(value, Instruction):
+        changes = {}
+        for f in fields(value):
+            old = getattr(value, f.name)
+            new = substitute_types(old, substitute)
+            if new is not old:
+                changes[f.name] = new
+        return replace(value, **changes) if changes else value
+    return value
 
 @dataclass(eq=True, frozen=True)
 class Instruction:
@@ -88,8 +192,8 @@ class TypeDefinition(Type):
         return hash((self.filename, self.name))
 
 
-@dataclass(eq=True, frozen=True)
-class CConstType(CType):
+@dataclass(eq=False, frozen=True)
+class CConstType(InternedType, CType):
     target: Type
 
 @dataclass(eq=True, frozen=True)
@@ -99,10 +203,8 @@ class CStructDefinition(CType):
     field_types: List[Type]
     field_names: List[str]
 
-    # The order of the the field in memory is the same as the order given in the source,
-    # however, the lists below have padding explicit.
-    layout_types: List[Type]
-    layout_names: List[str]
+    def __hash__(self):
+        return hash((self.filename, self.name))
 
 @dataclass(eq=True, frozen=True)
 class CTypedefDefinition(CType):
@@ -110,6 +212,9 @@ class CTypedefDefinition(CType):
     name: str
     definition: 'CType'
 
+    def __hash__(self):
+        return hash((self.filename, self.name))
+
 @dataclass(eq=True, frozen=True)
 class CUnionDefinition(CType):
     filename: str
@@ -117,12 +222,18 @@ class CUnionDefinition(CType):
     field_types: List[Type]
     field_names: List[str]
 
+    def __hash__(self):
+        return hash((self.filename, self.name))
+
 @dataclass(eq=True, frozen=True)
 class CEnumDefinition(CType):
     filename: str
     name: str
     enumerators: List[str]
 
+    def __hash__(self):
+        return hash((self.filename, self.name))
+
 @dataclass(eq=True, frozen=True)
 class CFunctionDefinition:
     filename: str
@@ -155,8 +266,8 @@ class ModuleDefinition:
     main_module: bool
 
 
-@dataclass(eq=True, frozen=True)
-class PaddingType(Type):
+@dataclass(eq=False, frozen=True)
+class PaddingType(InternedType, Type):
     """
     The entire memory area where a struct instance is stored is completely
     initialized (there are no uninitialied padding bytes as in C). This enables
@@ -166,92 +277,110 @@ class PaddingType(Type):
     """
     bytes: int
 
-@dataclass(eq=True, frozen=True)
-class UninferredType(Type):
-    pass
+@dataclass(eq=False, frozen=True)
+class UninferredType(InternedType, Type):
+    placeholder = True
 
-@dataclass(eq=True, frozen=True)
-class IntegerType(Type):
+@dataclass(eq=False, frozen=True)
+class IntegerType(InternedType, Type):
     bits: int
     signed: bool
 
-@dataclass(eq=True, frozen=True)
-class FloatType(Type):
+@dataclass(eq=False, frozen=True)
+class FloatType(InternedType, Type):
     bits: int
 
-@dataclass(eq=True, frozen=True)
-class BoolType(Type):
+@dataclass(eq=False, frozen=True)
+class BoolType(InternedType, Type):
     pass
 
-@dataclass(eq=True, frozen=True)
-class VoidType(Type):
+@dataclass(eq=False, frozen=True)
+class VoidType(InternedType, Type):
     pass
 
-@dataclass(eq=True, frozen=True)
-class ExitType(Type):
+@dataclass(eq=False, frozen=True)
+class ExitType(InternedType, Type):
     """
     This type is used to communicate that a code path is exited and does not yield a value.
     For example, 'return', 'break', and 'continue', have this type.
     """
     pass
 
-@dataclass(eq=True, frozen=True)
-class PointerType(Type):
+@dataclass(eq=False, frozen=True)
+class PointerType(InternedType, Type):
     target: Type
 
-@dataclass(eq=True, frozen=True)
-class OptionType(Type):
+@dataclass(eq=False, frozen=True)
+class OptionType(InternedType, Type):
     target: Type
 
-@dataclass(eq=True, frozen=True)
-class UnionType(Type):
+@dataclass(eq=False, frozen=True)
+class UnionType(InternedType, Type):
     types: List[Type]
 
-@dataclass(eq=True, frozen=True)
-class ArrayType(Type):
+@dataclass(eq=False, frozen=True)
+class ArrayType(InternedType, Type):
     elty: 'Type'
 
-@dataclass(eq=True, frozen=True)
-class TupleType(Type):
+@dataclass(eq=False, frozen=True)
+class TupleType(InternedType, Type):
     positional: List[Type]
     named: List[Type]
     names: List[str]
 
     # The order of the fields in memory might be different than
     # the order given when the constructor is called (to reduce padding).
-    # Also, these lists might contain more elements as the padding is
-    # explicit here.
-    layout_types: List[Type]
-    layout_names: List['str|int']
-
-@dataclass(eq=True, frozen=True)
-class FunctionType(Type):
+    # Also, the layout might contain more elements as the padding is
+    # explicit there. The layout follows from the fields, thus it isn't
+    # part of the type, but kept in TUPLE_LAYOUTS.
+    def layout(self):
+        return TUPLE_LAYOUTS.get(self)
+
+    # Keep the layout when unpickling, as it is computed by the typechecker
+    def __reduce__(self):
+        return laid_out_tuple_type, self.identity() + (self.layout(),)
+
+# The layouts of the tuple types, as (layout_types, layout_names), see
+# declare.optimize_datatype_layout
+TUPLE_LAYOUTS = weakref.WeakKeyDictionary()
+
+def define_tuple_layout(ty, layout):
+    TUPLE_LAYOUTS.setdefault(ty, layout)
+
+def laid_out_tuple_type(positional, named, names, layout):
+    ty = TupleType(positional, named, names)
+    if layout is not None:
+        define_tuple_layout(ty, layout)
+    return ty
+
+@dataclass(eq=False, frozen=True)
+class FunctionType(InternedType, Type):
     retty: Type
     argtys: List[Type]
     argnames: List[str]
 
-@dataclass(eq=True, frozen=True)
-class RttiType(Type):
+@dataclass(eq=False, frozen=True)
+class RttiType(InternedType, Type):
     pass
 
-@dataclass(eq=True, frozen=True)
-class CNamedType(Type):
+@dataclass(eq=False, frozen=True)
+class CNamedType(InternedType, Type):
     name: str
     typekind: str
 
-@dataclass(eq=True, frozen=True)
-class CArrayType(Type):
+@dataclass(eq=False, frozen=True)
+class CArrayType(InternedType, Type):
     elty: 'CType'
 
-@dataclass(eq=True, frozen=True)
-class CFunctionPointerType(Type):
+@dataclass(eq=False, frozen=True)
+class CFunctionPointerType(InternedType, Type):
     retty: Type
     argtys: List[Type]
     argnames: List[str]
     varargs: bool
 
-@dataclass(eq=True, frozen=True)
-class CUnknownType(Type):
+@dataclass(eq=False, frozen=True)
+class CUnknownType(InternedType, Type):
     name: str
     typekind: str
 
@@ -383,6 +512,15 @@ class ArrayAppend(InstructionWithType):
 class ArrayPop(InstructionWithType):
     array: InstructionWithType
 
+@dataclass(eq=True, frozen=True)
+class ArrayReserve(InstructionWithType):
+    array: InstructionWithType
+    capacity: InstructionWithType
+
+@dataclass(eq=True, frozen=True)
+class ArrayShrinkToFit(InstructionWithType):
+    array: InstructionWithType
+
 @dataclass(eq=True, frozen=True)
 class LoadMember(InstructionWithType):
     target: InstructionWithType
@@ -0,0 +1,27 @@
+import hashlib
+import dataclasses
+import backend.ir as ir
+
+# Types that are identified by where they are defined rather than by their structure.
+NOMINAL_TYPES = (ir.TypeDefinition, ir.CStructDefinition, ir.CUnionDefinition, ir.CEnumDefinition, ir.CTypedefDefinition)
+
+def signature(value) -> str:
+    """
+    Returns a canonical description of an IR value (typically a type). Unlike hash(), the
+    description is the same between runs, so names derived from it make the generated code
+    reproducible.
+    """
+    match value:
+        case _ if isinstance(value, NOMINAL_TYPES):
+            return f"{type(value).__name__}({value.filename}:{value.name})"
+        case tuple() | list():
+            return "[%s]" % ",".join(signature(v) for v in value)
+        case _ if dataclasses.is_dataclass(value):
+            fields = ",".join(signature(getattr(value, f.name)) for f in dataclasses.fields(value) if f.compare)
+            return f"{type(value).__name__}({fields})"
+        case _:
+            return repr(value)
+
+def stable_hash(*parts) -> str:
+    data = "\0".join(str(p) for p in parts).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
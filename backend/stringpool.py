@@ -0,0 +1,83 @@
+class StringPool:
+    """
+    The concatenation of all string data that is emitted into the generated code. Each interned
+    value is assigned an offset into the pool. A value that already occurs somewhere in the pool,
+    including as a substring of previously interned values, is not added again.
+
+    Finding existing occurrences is done using a suffix automaton over the pool, which is
+    extended online as values are added. Thus, both looking up and adding a value takes time
+    linear in the length of the value, independent of the size of the pool.
+    """
+    def __init__(self, share_substrings=True):
+        self.share_substrings = share_substrings
+        self.offsets = {}
+        self.chunks = []
+        self.length = 0
+
+        # The suffix automaton. Each state has its outgoing transitions, its suffix link, the
+        # length of the longest string it represents and the (first) position in the pool
+        # where the strings it represents end.
+        self._next = [{}]
+        self._link = [-1]
+        self._len = [0]
+        self._endpos = [-1]
+        self._last = 0
+
+    def intern(self, value):
+        """
+        Returns the offset of value in the pool, adding it to the pool if needed.
+        """
+        offset = self.offsets.get(value)
+        if offset is not None:
+            return offset
+
+        offset = self._find(value) if self.share_substrings else -1
+        if offset == -1:
+            offset = self.length
+            self.chunks.append(value)
+            self.length += len(value)
+            if self.share_substrings:
+                for char in value:
+                    self._extend(char)
+        self.offsets[value] = offset
+        return offset
+
+    def data(self):
+        return "".join(self.chunks)
+
+    def _find(self, value):
+        state = 0
+        for char in value:
+            state = self._next[state].get(char)
+            if state is None:
+                return -1
+        return self._endpos[state] - len(value) + 1
+
+    def _extend(self, char):
+        cur = len(self._len)
+        self._next.append({})
+        self._link.append(0)
+        self._len.append(self._len[self._last] + 1)
+        self._endpos.append(self._len[cur] - 1)
+
+        p = self._last
+        while p != -1 and char not in self._next[p]:
+            self._next[p][char] = cur
+            p = self._link[p]
+
+        if p != -1:
+            q = self._next[p][char]
+            if self._len[p] + 1 == self._len[q]:
+                self._link[cur] = q
+            else:
+                clone = len(self._len)
+                self._next.append(self._next[q].copy())
+                self._link.append(self._link[q])
+                self._len.append(self._len[p] + 1)
+                self._endpos.append(self._endpos[q])
+                while p != -1 and self._next[p].get(char) == q:
+                    self._next[p][char] = clone
+                    p = self._link[p]
+                self._link[q] = clone
+                self._link[cur] = clone
+        self._last = cur
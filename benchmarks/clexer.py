@@ -0,0 +1,80 @@
+"""
+Measures how many tokens per second the C header lexer (see frontend/clexer.py)
+produces on real system headers, for both lex and the character-at-a-time lex_by_char
+it replaced. Also checks that both produce the same tokens.
+
+Usage: python3 benchmarks/clexer.py [--repeat 3] [header ...]
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import frontend.clexer as clexer
+
+DEFAULT_HEADERS = ['/usr/include/stdio.h', '/usr/include/stdlib.h', '/usr/include/string.h',
+                   '/usr/include/math.h', '/usr/include/unistd.h', '/usr/include/signal.h',
+                   '/usr/include/pthread.h', '/usr/include/time.h', '/usr/include/wchar.h']
+
+# What cparser.parse_file ignores, plus attributes, to also exercise skipping their arguments
+IGNORE_TOKENS = {'inline', 'extern', 'static', '__attribute__', '__asm__', '__THROW'}
+
+LEXERS = {'by char': clexer.lex_by_char, 'regex': clexer.lex}
+
+
+def lex_all(filename, text, lex):
+    state = clexer.LexerState(filename, text, IGNORE_TOKENS)
+    tokens = []
+    while True:
+        token = lex(state)
+        tokens.append(token)
+        if token.type == clexer.TokenType.EOF:
+            return tokens
+
+
+def lex_headers(sources, lex):
+    return [lex_all(filename, text, lex) for filename, text in sources]
+
+
+def best_time(repeat, fn, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--repeat", type=int, default=3)
+    argparser.add_argument("--all", action="store_true", help="lex every header in /usr/include")
+    argparser.add_argument("headers", nargs="*")
+    args = argparser.parse_args()
+
+    headers = args.headers or (sorted(glob.glob('/usr/include/**/*.h', recursive=True)) if args.all else DEFAULT_HEADERS)
+    sources = []
+    for filename in headers:
+        if os.path.exists(filename):
+            with open(filename, encoding='utf-8', errors='replace') as f:
+                sources.append((filename, f.read()))
+    assert sources, "none of the headers exist"
+
+    results = {}
+    print(f"input: {len(sources)} headers, {sum(len(text) for _filename, text in sources)} characters")
+    print(f"{'lexer':<10} {'tokens':>10} {'tokens/s':>12}")
+    for name, lex in LEXERS.items():
+        seconds, tokens = best_time(args.repeat, lex_headers, sources, lex)
+        results[name] = tokens
+        num_tokens = sum(len(file_tokens) for file_tokens in tokens)
+        print(f"{name:<10} {num_tokens:>10} {num_tokens / seconds:>12.0f}")
+
+    for (filename, _text), expected, actual in zip(sources, results['by char'], results['regex']):
+        assert expected == actual, f"the lexers disagree on {filename}"
+
+
+if __name__ == '__main__':
+    main()
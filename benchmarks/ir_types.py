@@ -0,0 +1,56 @@
+"""
+Measures constructing, hashing and comparing IR types (see backend/ir.py), for a type
+nested --depth levels deep. The types are interned, so hashing and comparing should not
+depend on the depth. Also checks that constructing the same type twice gives the same
+object.
+
+Usage: python3 benchmarks/ir_types.py [--depth 6] [--number 20000]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backend.ir as ir
+
+I32 = ir.IntegerType(32, True)
+
+
+def nested_type(depth):
+    ty = I32
+    for _ in range(depth):
+        ty = ir.OptionType(ir.FunctionType(ty, (ty, ir.PointerType(ty)), ('a', 'b')))
+    return ty
+
+
+def seconds_per_call(number, fn, *args):
+    start = time.perf_counter()
+    for _ in range(number):
+        fn(*args)
+    return (time.perf_counter() - start) / number
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--depth", type=int, default=6)
+    argparser.add_argument("--number", type=int, default=20000)
+    args = argparser.parse_args()
+
+    a = nested_type(args.depth)
+    b = nested_type(args.depth)
+    assert a is b, "constructing the same type twice gave different objects"
+    types = {a: None}
+
+    print(f"{'operation':<24} {'ns/call':>10}")
+    for name, fn, fn_args in [('construct pointer', ir.PointerType, (I32,)),
+                              (f'construct depth {args.depth}', nested_type, (args.depth,)),
+                              ('hash', hash, (b,)),
+                              ('eq', a.__eq__, (b,)),
+                              ('dict lookup', types.__getitem__, (b,))]:
+        number = max(1, args.number // 100) if fn is nested_type else args.number
+        print(f"{name:<24} {seconds_per_call(number, fn, *fn_args) * 1e9:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
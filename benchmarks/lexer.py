@@ -0,0 +1,84 @@
+"""
+Measures how many tokens per second the Cedar lexer produces with each of its scanner
+engines (see frontend/lexer.py), on a large input generated by repeating the .ce files
+in the repository. Also checks that the engines produce the same tokens.
+
+Usage: python3 benchmarks/lexer.py [--size 2000000] [--repeat 3]
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import frontend.lexer as lexer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCANNERS = {'regex': lexer.scan_regex, 'table': lexer.scan_table}
+
+
+def make_input(size):
+    sources = []
+    for filename in sorted(glob.glob(os.path.join(ROOT, '**', '*.ce'), recursive=True)):
+        with open(filename) as f:
+            sources.append(f.read())
+    text = "\n".join(sources)
+    return (text + "\n") * max(1, size // len(text))
+
+
+def lex_all(text, scan):
+    state = lexer.LexerState("bench.ce", text, scan)
+    tokens = []
+    while True:
+        token = lexer.lex(state)
+        tokens.append(token)
+        if token.type == lexer.TokenType.EOF:
+            return tokens
+
+
+def scan_all(text, scan):
+    """
+    Runs just the scanner over the text, without the bookkeeping done by lex. Returns
+    the number of raw tokens, including whitespace and newlines.
+    """
+    index = 0
+    num_tokens = 0
+    while index < len(text):
+        _kind, index = scan(text, index)
+        num_tokens += 1
+    return num_tokens
+
+
+def best_time(repeat, fn, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--size", type=int, default=2000000, help="approximate size of the input in characters")
+    argparser.add_argument("--repeat", type=int, default=3)
+    args = argparser.parse_args()
+
+    text = make_input(args.size)
+    results = {}
+    print(f"input: {len(text)} characters")
+    print(f"{'scanner':<10} {'tokens':>10} {'lex tokens/s':>14} {'scan tokens/s':>14}")
+    for name, scan in SCANNERS.items():
+        lex_seconds, tokens = best_time(args.repeat, lex_all, text, scan)
+        scan_seconds, num_raw_tokens = best_time(args.repeat, scan_all, text, scan)
+        results[name] = tokens
+        print(f"{name:<10} {len(tokens):>10} {len(tokens) / lex_seconds:>14.0f} {num_raw_tokens / scan_seconds:>14.0f}")
+
+    assert results['regex'] == results['table'], "the scanners disagree"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Measures how parsing a program scales with the number of processes that parse its
+modules in parallel (see Compilation.parse in cedar.py). The program is generated: a
+main module importing a tree of modules, each with a number of functions. Also checks
+that the parsed modules are the same for any number of processes.
+
+Usage: python3 benchmarks/parse_modules.py [--modules 200] [--functions 20] [--jobs 1 2 4]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cedar
+
+
+def make_program(directory, num_modules, num_functions):
+    for i in range(num_modules):
+        lines = []
+        # Each module imports two others, such that the imports form a tree
+        for child in (2 * i + 1, 2 * i + 2):
+            if child < num_modules:
+                lines.append(f"import module{child}.ce")
+        for j in range(num_functions):
+            lines.append(f"i32 function{j}(i32 a, i32 b) {{")
+            lines.append(f"    let x = (a + {j}) * b - a / (b + 1)")
+            lines.append(f"    if x > {j} {{")
+            lines.append(f"        return x % 7 + a * a")
+            lines.append(f"    }}")
+            lines.append(f"    return x")
+            lines.append(f"}}")
+        with open(os.path.join(directory, f"module{i}.ce"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def parse(directory, jobs):
+    session = cedar.Session(cedar.BuildCache(None))
+    compilation = cedar.Compilation("module0.ce", [directory] + cedar.LANG_LIBS, {}, session)
+    start = time.perf_counter()
+    compilation.parse(jobs)
+    return time.perf_counter() - start, compilation.asts
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--modules", type=int, default=200)
+    argparser.add_argument("--functions", type=int, default=20, help="number of functions per module")
+    argparser.add_argument("--jobs", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()])
+    args = argparser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_program(directory, args.modules, args.functions)
+        print(f"{args.modules} modules, {os.cpu_count()} CPUs")
+        print(f"{'jobs':>5} {'seconds':>8} {'speedup':>8}")
+        baseline = None
+        expected = None
+        for jobs in sorted(set(args.jobs)):
+            seconds, asts = parse(directory, jobs)
+            baseline = baseline or seconds
+            print(f"{jobs:>5} {seconds:>8.2f} {baseline / seconds:>8.2f}")
+            if expected is None:
+                expected = asts
+            assert list(asts) == list(expected) and asts == expected, "the parsed modules differ"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Measures the Cedar expression parser (see frontend/parser.py) on generated,
+expression-heavy code: the time to parse, the number of Python function calls and the
+deepest Python stack reached. The same input is also parsed with the previous parser,
+which recursed once per precedence level before reaching an atom, and the resulting
+ASTs are checked to be equal.
+
+Usage: python3 benchmarks/parser.py [--functions 500] [--repeat 3]
+"""
+import gc
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import frontend.astnodes as ast
+import frontend.parser as parser
+
+BINARY_OPERATORS = ['or', 'and', '==', '<', '>=', '|', '^', '&', '<<', '+', '-', '*', '/', '%', '**']
+PREFIX_OPERATORS = ['-', '~', '&', '*']
+
+
+def make_expr(rng, depth):
+    if depth == 0 or rng.random() < 0.2:
+        atom = rng.choice(['a', 'b', 'c', str(rng.randint(0, 99)), 'f(a, b)', 'x.y', 'v[a]'])
+        return rng.choice(PREFIX_OPERATORS + [''] * 8) + atom
+    left = make_expr(rng, depth - 1)
+    right = make_expr(rng, depth - 1)
+    expr = f"{left} {rng.choice(BINARY_OPERATORS)} {right}"
+    return f"({expr})" if rng.random() < 0.3 else expr
+
+
+def make_input(num_functions, seed=0):
+    rng = random.Random(seed)
+    functions = []
+    for i in range(num_functions):
+        lines = [f"    let x{j} = {make_expr(rng, 4)}" for j in range(4)]
+        lines.append(f"    let y = not {make_expr(rng, 0)} and a else {make_expr(rng, 2)}")
+        lines.append(f"    return {make_expr(rng, 4)}")
+        body = "\n".join(lines)
+        functions.append(f"i32 function{i}(i32 a, i32 b, i32 c) {{\n{body}\n}}\n")
+    return "\n".join(functions)
+
+
+def parse_expr_unary_by_level(p, precedence, trailing_block_permitted):
+    """
+    The previous unary expression parser, which recursed through every precedence level.
+    """
+    location = p.token.location
+    max_prec = 12
+    table = {2: ['not'], 12: ["+", "-", "~", '&', '*']}
+
+    if p.token.value in table.get(precedence, []):
+        op = p.token.value
+        parser.advance(p)
+        operand = parse_expr_unary_by_level(p, precedence, trailing_block_permitted)
+        return ast.UnaryOpExpr(op, operand, location=location)
+    elif precedence < max_prec:
+        return parse_expr_unary_by_level(p, precedence + 1, trailing_block_permitted)
+    return parser.parse_expr_primary(p, trailing_block_permitted)
+
+
+def parse(text):
+    state = parser.ParserState("bench.ce", text)
+    module = parser.parse_module(state, "bench.ce", True)
+    assert not state.errors, state.errors[:3]
+    return module, len(state.tokens)
+
+
+def count_calls(text):
+    """
+    Returns the number of Python function calls, how many of them are calls to the
+    expression parser, and the deepest stack reached while parsing the text.
+    """
+    calls = expr_calls = depth = max_depth = 0
+
+    def profile(frame, event, arg):
+        nonlocal calls, expr_calls, depth, max_depth
+        if event == 'call':
+            calls += 1
+            expr_calls += frame.f_code.co_name.startswith('parse_expr')
+            depth += 1
+            max_depth = max(max_depth, depth)
+        elif event == 'return':
+            depth -= 1
+
+    sys.setprofile(profile)
+    try:
+        parse(text)
+    finally:
+        sys.setprofile(None)
+    return calls, expr_calls, max_depth
+
+
+def best_time(repeat, fn, *args):
+    # Like timeit, keep the garbage collector out of the measurement, as the ASTs kept
+    # alive for the comparison would otherwise slow down the parsers measured later
+    best = None
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn(*args)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        gc.enable()
+    return best, result
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--functions", type=int, default=500, help="number of generated functions")
+    argparser.add_argument("--repeat", type=int, default=3)
+    args = argparser.parse_args()
+
+    text = make_input(args.functions)
+    parse_expr_unary = parser.parse_expr_unary
+    results = {}
+    print(f"input: {len(text)} characters")
+    print(f"{'parser':<12} {'tokens/s':>10} {'calls/token':>12} {'expr calls/token':>17} {'max depth':>10}")
+    for name, unary in [('by level', parse_expr_unary_by_level), ('precedence', parse_expr_unary)]:
+        parser.parse_expr_unary = unary
+        try:
+            seconds, (module, num_tokens) = best_time(args.repeat, parse, text)
+            calls, expr_calls, max_depth = count_calls(text)
+        finally:
+            parser.parse_expr_unary = parse_expr_unary
+        results[name] = module
+        print(f"{name:<12} {num_tokens / seconds:>10.0f} {calls / num_tokens:>12.1f} {expr_calls / num_tokens:>17.1f} {max_depth:>10}")
+
+    assert results['by level'] == results['precedence'], "the parsers disagree"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Compares the size of the generated C file and the time gcc takes to compile it, for
+the different ways the string pool can be emitted (see FuncCodeGen.string_pool_format).
+
+Usage: python3 benchmarks/string_pool.py [--cc gcc] [--strings 20000] [--repeat 3]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.ccodegen import FuncCodeGen
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_strings(num_strings, seed=0):
+    rng = random.Random(seed)
+    words = ["error", "warning", "value", "record", "field", "missing", "invalid", "user", "file", "line", "\n", "\t", "\"", "å"]
+    return ["%d: %s" % (i, " ".join(rng.choice(words) for _ in range(rng.randint(1, 12)))) for i in range(num_strings)]
+
+
+def generate(strings, string_pool_format):
+    gen = FuncCodeGen(None, {}, string_pool_format)
+    refs = [gen.internalize_string(s) for s in strings]
+    gen.code.append("unsigned char* ch_bench_strings[] = {%s};" % ", ".join(refs))
+    return gen.get_code()
+
+
+def compile_time(cc, c_filename, obj_filename, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([cc, "-c", "-I", ROOT, c_filename, "-o", obj_filename], check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--cc", default="gcc")
+    argparser.add_argument("--strings", type=int, default=20000)
+    argparser.add_argument("--repeat", type=int, default=3)
+    args = argparser.parse_args()
+
+    strings = make_strings(args.strings)
+    print(f"{'format':<10} {'C file size':>14} {'compile time':>14}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for string_pool_format in ('bytes', 'literal'):
+            c_filename = os.path.join(tmpdir, f"bench_{string_pool_format}.c")
+            code = generate(strings, string_pool_format)
+            with open(c_filename, "w") as f:
+                f.write(code)
+            seconds = compile_time(args.cc, c_filename, os.path.join(tmpdir, "bench.o"), args.repeat)
+            print(f"{string_pool_format:<10} {len(code):>14} {seconds:>13.3f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Measures declaring and typechecking (see typecheck/) generated programs:
+
+- A main module that calls functions of an imported library module, for libraries of
+  different sizes. The time per call, measured as the difference to typechecking the
+  same library without the calls, should not grow with the number of declarations in
+  scope.
+- A single long function, with nested loops whose bodies define locals and temporaries,
+  for different nesting depths. The time per statement should not grow with the depth
+  of the scopes the statements are in.
+- The calls program with a large library, typechecked by different numbers of
+  processes (see Compilation.typecheck_parallel in cedar.py), checking that the
+  generated code is the same for any number of processes.
+- The same program rebuilt with a cache after changing the body of one function, which
+  only typechecks that function again (see Compilation.typecheck_functions in cedar.py),
+  checking that the generated code is the same as without the cache.
+
+Usage: python3 benchmarks/typecheck_program.py [--calls 2000] [--library-functions 100 1000 5000]
+                                               [--statements 4000] [--depths 1 10 100] [--jobs 1 2 4]
+"""
+import gc
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cedar
+
+
+def make_program(directory, num_calls, num_library_functions):
+    lines = []
+    for i in range(num_library_functions):
+        lines.append(f"export type Value{i}(i32 value)")
+        lines.append(f"export i32 function{i}(i32 a, i32 b) {{")
+        lines.append(f"    return a * {i} + b")
+        lines.append(f"}}")
+    with open(os.path.join(directory, "library.ce"), "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+    lines = ["import library.ce"]
+    functions_per_caller = 20
+    for i in range(0, num_calls, functions_per_caller):
+        lines.append(f"i32 caller{i}(i32 a) {{")
+        lines.append(f"    let x = 0")
+        for j in range(i, min(i + functions_per_caller, num_calls)):
+            callee = j * 7919 % num_library_functions
+            lines.append(f"    let v{j} = library.Value{callee}(a)")
+            lines.append(f"    x = x + library.function{callee}(v{j}.value, x)")
+        lines.append(f"    return x")
+        lines.append(f"}}")
+    with open(os.path.join(directory, "main.ce"), "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def make_long_function(directory, num_statements, depth):
+    lines = ["i32 long_function(i32 a) {", "    let x = a"]
+    # Every few statements, open a loop until the depth is reached, then close loops
+    # until none are open, and so on
+    level = 0
+    opening = True
+    for i in range(num_statements):
+        indent = "    " * (level + 1)
+        if i % 5 == 0 and opening:
+            lines.append(f"{indent}while x > {i} {{")
+            level += 1
+            opening = level < depth
+        elif i % 5 == 0:
+            lines.append(f"{indent[4:]}}}")
+            level -= 1
+            opening = level == 0
+        else:
+            lines.append(f"{indent}let t{i} = (x, a + {i})")
+            lines.append(f"{indent}x = x + t{i}[0]")
+    lines.extend("    " * (level - i) + "}" for i in range(level))
+    lines.extend(["    return x", "}"])
+    with open(os.path.join(directory, "main.ce"), "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def edit_first_caller(directory, value):
+    filename = os.path.join(directory, "main.ce")
+    with open(filename) as f:
+        lines = f.read().split("\n")
+    lines[2] = f"    let x = {value}"
+    with open(filename, "w") as f:
+        f.write("\n".join(lines))
+
+
+def typecheck(directory, jobs=1, result=None, cache_directory=None):
+    session = cedar.Session(cedar.BuildCache(cache_directory))
+    compilation = cedar.Compilation("main.ce", [directory] + cedar.LANG_LIBS, {}, session)
+    compilation.parse(1)
+    machine_def = cedar.load_machine_def(os.path.join(cedar.ROOT, 'datatypes.json'))
+    if result is not None:
+        result.append(cedar.ccodegen.generate(compilation.declare_and_typecheck(machine_def, jobs), machine_def))
+        return
+    # Keep the garbage collector out of the measurement, as its full collections take
+    # longer the more declarations there are
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        compilation.declare_and_typecheck(machine_def, jobs)
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--calls", type=int, default=2000, help="number of calls in the main module")
+    argparser.add_argument("--library-functions", type=int, nargs="+", default=[100, 1000, 5000])
+    argparser.add_argument("--statements", type=int, default=4000, help="number of statements in the long function")
+    argparser.add_argument("--depths", type=int, nargs="+", default=[1, 10, 100], help="how deeply the loops of the long function nest")
+    argparser.add_argument("--jobs", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()])
+    args = argparser.parse_args()
+
+    print(f"{'library functions':>17} {'seconds':>8} {'us/call':>8}")
+    for num_library_functions in args.library_functions:
+        seconds = {}
+        for num_calls in (0, args.calls):
+            with tempfile.TemporaryDirectory() as directory:
+                make_program(directory, num_calls, num_library_functions)
+                seconds[num_calls] = typecheck(directory)
+        per_call = (seconds[args.calls] - seconds[0]) / args.calls
+        print(f"{num_library_functions:>17} {seconds[args.calls]:>8.2f} {per_call * 1e6:>8.0f}")
+
+    print()
+    print(f"{'depth':>17} {'seconds':>8} {'us/stmt':>8}")
+    for depth in args.depths:
+        with tempfile.TemporaryDirectory() as directory:
+            make_long_function(directory, args.statements, depth)
+            seconds = typecheck(directory)
+        print(f"{depth:>17} {seconds:>8.2f} {seconds / args.statements * 1e6:>8.0f}")
+
+    print()
+    print(f"{'jobs':>17} {'seconds':>8} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        make_program(directory, 10 * args.calls, max(args.library_functions))
+        baseline = None
+        codes = []
+        for jobs in sorted(set(args.jobs)):
+            seconds = typecheck(directory, jobs)
+            baseline = baseline or seconds
+            print(f"{jobs:>17} {seconds:>8.2f} {baseline / seconds:>8.2f}")
+            typecheck(directory, jobs, codes)
+        assert all(code == codes[0] for code in codes), "the generated code depends on the number of processes"
+
+    print()
+    print(f"{'build':>17} {'seconds':>8}")
+    with tempfile.TemporaryDirectory() as directory, tempfile.TemporaryDirectory() as cache_directory:
+        make_program(directory, 10 * args.calls, max(args.library_functions))
+        print(f"{'without cache':>17} {typecheck(directory):>8.2f}")
+        print(f"{'cold cache':>17} {typecheck(directory, cache_directory=cache_directory):>8.2f}")
+        edit_first_caller(directory, 1)
+        print(f"{'one body changed':>17} {typecheck(directory, cache_directory=cache_directory):>8.2f}")
+        edit_first_caller(directory, 2)
+        codes = []
+        typecheck(directory, 1, codes, cache_directory)
+        typecheck(directory, 1, codes)
+        assert codes[0] == codes[1], "the generated code depends on which function bodies are cached"
+
+
+if __name__ == '__main__':
+    main()
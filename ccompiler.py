@@ -1,9 +1,15 @@
+import os
+import json
+import shutil
+import tempfile
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 class Gcc:
     def __init__(self, executable_path):
         self.executable_path = executable_path
         self._default_include_paths = None
+        self._default_macros = None
 
     def default_include_paths(self):
         if self._default_include_paths is not None:
@@ -42,6 +48,8 @@ class Gcc:
         return include_paths
 
     def default_macros(self):
+        if self._default_macros is not None:
+            return self._default_macros
         # Run the gcc command to get the default macros
         process = subprocess.Popen(
             [self.executable_path, '-dM', '-E', '-'],
@@ -64,14 +72,23 @@ class Gcc:
                 macro_value = parts[2] if len(parts) > 2 else ""
                 macros[macro_name] = macro_value.strip()
         
+        self._default_macros = macros
         return macros
 
+    def compile(self, c_filename, obj_filename, include_paths=(), flags=()):
+        # Also write the headers the unit depends on, see is_up_to_date
+        command = [self.executable_path, '-c', c_filename, '-o', obj_filename, '-MD', '-MF', obj_filename + '.d'] + ['-I' + p for p in include_paths] + list(flags)
+        return run_compiler(command)
 
+    def link(self, obj_filenames, output_filename, flags=()):
+        command = [self.executable_path] + list(obj_filenames) + ['-o', output_filename] + list(flags)
+        return run_compiler(command)
 
 class Tcc:
     def __init__(self, executable_path):
         self.executable_path = executable_path
         self._default_include_paths = None
+        self._default_macros = None
 
     def default_include_paths(self):
         if self._default_include_paths is not None:
@@ -107,6 +124,8 @@ class Tcc:
         return include_paths
 
     def default_macros(self):
+        if self._default_macros is not None:
+            return self._default_macros
         # Run the tcc command to get the default macros
         process = subprocess.Popen(
             [self.executable_path, '-dM', '-E', '-'],
@@ -129,8 +148,81 @@ class Tcc:
                 macro_value = parts[2] if len(parts) > 2 else ""
                 macros[macro_name] = macro_value.strip()
         
+        self._default_macros = macros
         return macros
 
+    def compile(self, c_filename, obj_filename, include_paths=(), flags=()):
+        # Also write the headers the unit depends on, see is_up_to_date
+        command = [self.executable_path, '-c', c_filename, '-o', obj_filename, '-MD', '-MF', obj_filename + '.d'] + ['-I' + p for p in include_paths] + list(flags)
+        return run_compiler(command)
+
+    def link(self, obj_filenames, output_filename, flags=()):
+        command = [self.executable_path] + list(obj_filenames) + ['-o', output_filename] + list(flags)
+        return run_compiler(command)
+
+def run_compiler(command):
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    assert process.returncode == 0, "%s failed:\n%s" % (" ".join(command), process.stdout.decode('utf-8'))
+
+def write_if_changed(filename, content):
+    """
+    Writes content to filename, unless the file already has that content. Unchanged files keep
+    their modification time, so that build_units doesn't recompile them.
+    """
+    if os.path.exists(filename):
+        with open(filename) as f:
+            if f.read() == content:
+                return False
+    with open(filename, "w") as f:
+        f.write(content)
+    return True
+
+def is_up_to_date(obj_filename):
+    """
+    Checks if an object file is newer than the files listed in the dependency file the
+    compiler wrote alongside it, i.e., the C file and all headers it included.
+    """
+    dep_filename = obj_filename + '.d'
+    if not os.path.exists(obj_filename) or not os.path.exists(dep_filename):
+        return False
+    with open(dep_filename) as f:
+        rules = f.read().replace("\\\n", " ")
+    obj_mtime = os.path.getmtime(obj_filename)
+    for line in rules.splitlines():
+        if ":" not in line:
+            continue
+        for dependency in line.split(":", 1)[1].split():
+            if not os.path.exists(dependency) or os.path.getmtime(dependency) > obj_mtime:
+                return False
+    return True
+
+def build_units(compiler, build_dir, headers, units, output_filename, include_paths=(), flags=(), jobs=None):
+    """
+    Builds an executable from the output of ccodegen.generate_units. The units are compiled in
+    parallel, and a unit is only recompiled if it or a header it includes changed since its
+    object file was built. Returns the C files that were compiled.
+    """
+    os.makedirs(build_dir, exist_ok=True)
+    for header_filename, header in headers.items():
+        write_if_changed(os.path.join(build_dir, header_filename), header)
+    include_paths = [build_dir] + list(include_paths)
+
+    jobs_to_run = []
+    obj_filenames = []
+    for c_filename, code in units.items():
+        c_path = os.path.join(build_dir, c_filename)
+        obj_path = os.path.splitext(c_path)[0] + ".o"
+        write_if_changed(c_path, code)
+        obj_filenames.append(obj_path)
+        if not is_up_to_date(obj_path):
+            jobs_to_run.append((c_path, obj_path))
+
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        # Consume the results, such that a failing compilation is reported
+        list(executor.map(lambda job: compiler.compile(job[0], job[1], include_paths, flags), jobs_to_run))
+    compiler.link(obj_filenames, output_filename, flags)
+    return [c_path for c_path, _ in jobs_to_run]
+
 def identify_c_compiler(executable_path):
     # List of commands to try, starting with the most specific
     version_flags = ['-v', '-V', '--version']
@@ -169,3 +261,90 @@ def identify_c_compiler(executable_path):
 
     # If no known compiler was identified, return unknown
     return 'Unknown Compiler'
+
+
+COMPILER_KINDS = {'gcc': Gcc, 'tcc': Tcc}
+
+def probe_toolchain(executable_path):
+    """
+    Runs the compiler to find out what it is, its include paths and its predefined
+    macros. This takes several processes, see ToolchainCache.
+    """
+    compiler = identify_c_compiler(executable_path)
+    assert type(compiler) in COMPILER_KINDS.values(), "unknown C compiler: %s" % executable_path
+    kind = next(kind for kind, cls in COMPILER_KINDS.items() if type(compiler) == cls)
+    return {'kind': kind, 'include_paths': compiler.default_include_paths(), 'macros': compiler.default_macros()}
+
+class ToolchainCache:
+    """
+    The probed information about C compilers, stored in a file such that it is shared
+    between runs. An entry is keyed by the compiler's path and is used for as long as
+    the executable it resolves to, and its size and modification time, stay the same.
+    The compiler is run by the path it was found at rather than the resolved one, as
+    wrappers such as ccache behave differently depending on the name they are run by.
+    A filename of None keeps the entries in memory only.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = self.load()
+
+    def load(self):
+        if self.filename is None:
+            return {}
+        # A missing, truncated or otherwise unreadable file is just a cache miss
+        try:
+            with open(self.filename) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def get(self, executable):
+        return self.get_many([executable])[0]
+
+    def get_many(self, executables, jobs=None):
+        """
+        Returns a compiler object for each executable. Compilers that aren't cached
+        are probed in parallel.
+        """
+        paths = []
+        for executable in executables:
+            executable_path = shutil.which(executable)
+            assert executable_path is not None, "cannot find C compiler '%s'" % executable
+            paths.append(executable_path)
+
+        stamps = {path: self.stamp(path) for path in paths}
+        missing = sorted(set(path for path in paths if self.entries.get(path, {}).get('stamp') != stamps[path]))
+        if missing:
+            with ThreadPoolExecutor(max_workers=jobs or len(missing)) as executor:
+                for path, info in zip(missing, executor.map(probe_toolchain, missing)):
+                    self.entries[path] = dict(info, stamp=stamps[path])
+            self.save()
+
+        compilers = []
+        for path in paths:
+            entry = self.entries[path]
+            compiler = COMPILER_KINDS[entry['kind']](path)
+            compiler._default_include_paths = entry['include_paths']
+            compiler._default_macros = entry['macros']
+            compilers.append(compiler)
+        return compilers
+
+    def stamp(self, executable_path):
+        real_path = os.path.realpath(executable_path)
+        stat = os.stat(real_path)
+        return [real_path, stat.st_size, stat.st_mtime_ns]
+
+    def save(self):
+        if self.filename is None:
+            return
+        directory = os.path.dirname(self.filename) or '.'
+        os.makedirs(directory, exist_ok=True)
+        # Keep the compilers that concurrent builds probed in the meantime
+        entries = dict(self.load(), **self.entries)
+        # Write to a temporary file of its own first, such that concurrent builds never
+        # read a partially written file.
+        fd, tmp_filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_filename, self.filename)
@@ -0,0 +1,705 @@
+"""
+Compiles a Cedar program to C.
+
+Usage: python3 cedar.py main.ce [-o main.c] [--cc gcc] [-I path ...] [-j jobs]
+
+Every module the program imports, including the implicitly imported builtins and
+C headers, is parsed, declared and typechecked. The results are cached per module
+under the cache directory, keyed by a hash of the module's source (for parsing) or
+of the sources of the module and everything it transitively imports (for declaring
+and typechecking). Unchanged modules are loaded from the cache instead. Of the other
+modules, a function is only typechecked again when its source, or a declaration it
+looked up while being typechecked, has changed.
+"""
+import os
+import io
+import sys
+import json
+import pickle
+import hashlib
+import argparse
+import functools
+import collections
+import threading
+import multiprocessing
+import concurrent.futures
+import frontend.parser as parser
+import frontend.cparser as cparser
+import frontend.astnodes as ast
+import frontend.picklecache as picklecache
+import backend.ir as ir
+import backend.ccodegen as ccodegen
+from backend.naming import stable_hash
+from typecheck import declare, typecheck
+import ccompiler
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+LANG_LIBS = [os.path.join(ROOT, 'lang-libs'), os.path.join(ROOT, 'lang-libs', 'cstdlib')]
+
+# The packages and files whose source is part of every cache key, such that changing the
+# compiler invalidates everything it has cached. This includes cedar.py itself, which
+# defines how the cached IR and function bodies are pickled and how the keys are made.
+COMPILER_SOURCES = ['frontend', 'typecheck', 'backend', 'cedar.py', 'ccompiler.py']
+
+
+def load_machine_def(filename):
+    with open(filename) as f:
+        datatypes = json.load(f)
+    types = {}
+    for entry in datatypes:
+        ctype = entry['ctype']
+        info = {'typename': ctype, 'alignment': entry['alignment'], 'size': entry['size']}
+        if ctype.endswith('*'):
+            types[ctype] = info
+        elif ctype in ('float', 'double'):
+            types[ir.FloatType(8 * entry['size'])] = info
+        else:
+            types[ir.IntegerType(8 * entry['size'], entry['signed'] == 'true')] = info
+    types['void*'] = types['char*']
+    return {'types': types}
+
+
+def find_file(filename, search_paths):
+    for path in search_paths:
+        full_filename = os.path.join(path, filename)
+        if os.path.exists(full_filename):
+            return full_filename
+    assert False, "cannot find '%s' in %s" % (filename, search_paths)
+
+
+@functools.cache
+def compiler_fingerprint():
+    parts = []
+    for source in COMPILER_SOURCES:
+        path = os.path.join(ROOT, source)
+        if os.path.isdir(path):
+            filenames = [os.path.join(path, filename) for filename in sorted(os.listdir(path)) if filename.endswith('.py')]
+        else:
+            filenames = [path]
+        for filename in filenames:
+            with open(filename, 'rb') as f:
+                parts.append(hashlib.blake2b(f.read(), digest_size=16).hexdigest())
+    return stable_hash(*parts)
+
+
+class BuildCache(picklecache.PickleCache):
+    """
+    Pickled compilation results stored as one file per entry, including the parsed
+    modules that the parsers cache themselves (see parse_key). A directory of None
+    disables the cache.
+    """
+
+
+class MemoryCache(BuildCache):
+    """
+    A BuildCache that also keeps the entries it has seen in memory, for long-running
+    processes such as compileserver.py. Entries are kept pickled, as the compiler
+    mutates the objects it works on. The least recently used entries are dropped from
+    memory once they take more than max_bytes. A directory of None disables the cache,
+    in memory too.
+    """
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        super().__init__(directory)
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.entries = collections.OrderedDict()
+
+    def load_bytes(self, kind, key):
+        data = self.entries.get((kind, key))
+        if data is not None:
+            self.entries.move_to_end((kind, key))
+            return data
+        data = super().load_bytes(kind, key)
+        if data is not None:
+            self.remember(kind, key, data)
+        return data
+
+    def store_bytes(self, kind, key, data):
+        if self.directory is None:
+            return
+        self.remember(kind, key, data)
+        super().store_bytes(kind, key, data)
+
+    def remember(self, kind, key, data):
+        old_data = self.entries.pop((kind, key), None)
+        if old_data is not None:
+            self.num_bytes -= len(old_data)
+        if len(data) > self.max_bytes:
+            return
+        self.entries[(kind, key)] = data
+        self.num_bytes += len(data)
+        while self.num_bytes > self.max_bytes:
+            _key, old_data = self.entries.popitem(last=False)
+            self.num_bytes -= len(old_data)
+
+
+class FileHashes:
+    """
+    The hashes of source files. A file is only read and hashed again when its size or
+    modification time changed since it was last hashed.
+    """
+    def __init__(self):
+        self.hashes = {}
+
+    def get(self, full_filename):
+        stat = os.stat(full_filename)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        entry = self.hashes.get(full_filename)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        with open(full_filename, 'rb') as f:
+            source_hash = picklecache.source_hash(f.read())
+        self.hashes[full_filename] = (stamp, source_hash)
+        return source_hash
+
+
+class Session:
+    """
+    What is reused between compilations: the cache, the hashes of the source files and
+    the probed C compilers (which are also kept in the cache directory, see
+    ccompiler.ToolchainCache). The command line compiles once per session, whereas
+    compileserver.py keeps its sessions alive between requests.
+    """
+    def __init__(self, cache):
+        self.cache = cache
+        self.file_hashes = FileHashes()
+        toolchains_filename = os.path.join(cache.directory, 'toolchains.json') if cache.directory is not None else None
+        self.toolchains = ccompiler.ToolchainCache(toolchains_filename)
+
+    def c_compiler(self, executable):
+        """
+        Returns the compiler and its predefined macros.
+        """
+        compiler = self.toolchains.get(executable)
+        return compiler, compiler.default_macros()
+
+
+class ModulePickler(pickle.Pickler):
+    """
+    Pickles the IR of a single module. The IR of a module refers to the types, functions
+    and modules defined by the modules it imports; those are stored as references
+    (filename, list, index) to be resolved by ModuleUnpickler.
+    """
+    def __init__(self, file, protocol, filename, owners):
+        super().__init__(file, protocol)
+        self.filename = filename
+        self.owners = owners
+
+    # Unlike persistent_id, this isn't called for strings, numbers and containers, which
+    # are most of the objects pickled
+    def reducer_override(self, obj):
+        owner = self.owners.get(id(obj))
+        if owner is not None and owner[0] != self.filename:
+            return load_declaration, owner
+        return NotImplemented
+
+
+def load_declaration(filename, attr, idx):
+    assert False, "declarations are only loaded by ModuleUnpickler"
+
+
+class ModuleUnpickler(pickle.Unpickler):
+    def __init__(self, file, ir_modules):
+        super().__init__(file)
+        self.ir_modules = ir_modules
+
+    def find_class(self, module, name):
+        # The module is __main__ when the pickle was written by cedar.py run as a script
+        if name == 'load_declaration' and module in ('cedar', '__main__'):
+            return self.load_declaration
+        return super().find_class(module, name)
+
+    def load_declaration(self, filename, attr, idx):
+        ir_module = self.ir_modules[filename]
+        return ir_module if attr is None else getattr(ir_module, attr)[idx]
+
+
+class FunctionPickler(pickle.Pickler):
+    """
+    Pickles the typechecked body of a function, to be reused by later compilations in
+    which the declarations may be at other indices. Hence, declarations are stored as
+    references by name (see declaration_names). Line numbers are stored relative to the
+    function's, such that the body can be reused when the function has moved.
+    """
+    def __init__(self, file, protocol, names, location):
+        super().__init__(file, protocol)
+        self.names = names
+        self.location = location
+
+    def reducer_override(self, obj):
+        if type(obj) == ast.Location:
+            if obj.filename != self.location.filename:
+                return NotImplemented
+            return load_relative_location, (obj.line - self.location.line, obj.column)
+        name = self.names.get(id(obj))
+        if name is not None:
+            return load_declaration_by_name, name
+        return NotImplemented
+
+
+def load_relative_location(line, column):
+    assert False, "locations are only loaded by FunctionUnpickler"
+
+def load_declaration_by_name(filename, attr, name, position):
+    assert False, "declarations are only loaded by FunctionUnpickler"
+
+
+class FunctionUnpickler(pickle.Unpickler):
+    def __init__(self, file, ir_modules, location):
+        super().__init__(file)
+        self.ir_modules = ir_modules
+        self.location = location
+
+    def find_class(self, module, name):
+        if name in ('load_relative_location', 'load_declaration_by_name') and module in ('cedar', '__main__'):
+            return getattr(self, name)
+        return super().find_class(module, name)
+
+    def load_relative_location(self, line, column):
+        return ast.Location(self.location.filename, self.location.line + line, column)
+
+    def load_declaration_by_name(self, filename, attr, name, position):
+        ir_module = self.ir_modules[filename]
+        return ir_module if attr is None else getattr(ir_module, attr)[name][position]
+
+
+def declaration_names(ir_modules):
+    names = {}
+    for filename, ir_module in ir_modules.items():
+        names[id(ir_module)] = (filename, None, None, None)
+        for attr in ('type_index', 'function_index', 'variable_index'):
+            for name, definitions in getattr(ir_module, attr).items():
+                for position, obj in enumerate(definitions):
+                    names[id(obj)] = (filename, attr, name, position)
+    return names
+
+
+def module_owners(ir_modules):
+    owners = {}
+    for filename, ir_module in ir_modules.items():
+        owners[id(ir_module)] = (filename, None, None)
+        for attr in ('types', 'functions', 'variables'):
+            for idx, obj in enumerate(getattr(ir_module, attr)):
+                owners[id(obj)] = (filename, attr, idx)
+    return owners
+
+
+def module_dependencies(ast_module):
+    deps = []
+    for node in ast_module.defs:
+        match node:
+            case ast.ImportDef():
+                deps.append(node.filename)
+            case ast.CInclude():
+                deps.append(node.filename)
+    return deps
+
+
+# Cedar modules of at least this many bytes are lexed from a memory map rather than read
+# into a string (see parser.parse_file).
+MAPPED_PARSE_MIN_BYTES = 1024 * 1024
+
+def parse_key(filename, full_filename, is_main, default_macros, source_hash):
+    """
+    Returns the kind and key of a parsed module in the build cache. These are what the
+    parsers use (see parser.parse_file and cparser.parse_file), which only depend on the
+    parser, rather than on the whole compiler. Thus, a module parsed once is stored
+    once, whether parsed by cedar.py or by the parser.
+    """
+    if filename.endswith('.h'):
+        return 'headers', cparser.header_key(full_filename, filename, source_hash, set(), default_macros)
+    return 'modules', parser.module_key(full_filename, filename, source_hash, is_main)
+
+def parse_source(filename, full_filename, is_main, default_macros):
+    if filename.endswith('.h'):
+        return cparser.parse_file(full_filename, filename, set(), default_macros)
+    mapped = os.path.getsize(full_filename) >= MAPPED_PARSE_MIN_BYTES
+    return parser.parse_file(full_filename, filename, is_main, mapped=mapped)
+
+def parse_source_pickled(filename, full_filename, is_main, default_macros):
+    """
+    Parses a module in a worker process of Compilation.parse. Returns the AST pickled,
+    which is cheap to send back and is what the cache stores.
+    """
+    ast_module = parse_source(filename, full_filename, is_main, default_macros)
+    return pickle.dumps(ast_module, pickle.HIGHEST_PROTOCOL)
+
+
+# Typechecking functions in parallel only pays off for programs with at least this many
+# functions to typecheck, as starting the worker processes takes a while.
+PARALLEL_TYPECHECK_MIN_FUNCTIONS = 500
+
+def can_fork_workers():
+    """
+    Whether the worker processes of Compilation.typecheck_parallel can be forked. Forking
+    isn't available on Windows and is unsafe on macOS. It is also unsafe while other
+    threads are running, as only the forking thread exists in the worker.
+    """
+    return sys.platform != 'darwin' and 'fork' in multiprocessing.get_all_start_methods() and threading.active_count() == 1
+
+# The IR, ASTs and owners (see module_owners) typecheck_functions_pickled works on. Set
+# before the worker processes are forked, which thus inherit them rather than having
+# them pickled.
+TYPECHECK_INPUT = None
+
+def typecheck_functions_pickled(filename, indices):
+    """
+    Typechecks the functions at the given indices of a module's definitions in a worker
+    process of Compilation.typecheck_parallel. Returns their bodies, regex functions and
+    lookups pickled, with the declarations they refer to stored as references.
+    """
+    ir_modules, asts, owners = TYPECHECK_INPUT
+    ir_module = ir_modules[filename]
+    results = []
+    for index in indices:
+        fn = asts[filename].defs[index]
+        ir_function = ir_module.function_index[fn.name][0]
+        results.append(typecheck.typecheck_function_body(ir_modules, ir_module, ir_function, fn))
+    f = io.BytesIO()
+    ModulePickler(f, pickle.HIGHEST_PROTOCOL, None, owners).dump(results)
+    return f.getvalue()
+
+
+class Compilation:
+    """
+    The state of compiling one program: the modules it consists of, the import graph
+    between them and the cache keys of each module.
+    """
+    def __init__(self, main_filename, search_paths, default_macros, session):
+        self.main_filename = main_filename
+        self.search_paths = search_paths
+        self.default_macros = default_macros
+        self.cache = session.cache
+        self.file_hashes = session.file_hashes
+        self.fingerprint = compiler_fingerprint()
+        self.macros_key = stable_hash(*sorted(default_macros.items()))
+        self.asts = {}
+        self.deps = {}
+        self.sources = {}
+        self.source_keys = {}
+        self.parse_keys = {}
+        self.closure_keys = {}
+
+    def parse(self, jobs=None):
+        """
+        Parses the main module and everything it (transitively) imports. The modules that
+        aren't cached are parsed by a pool of jobs processes (by default, one per CPU), each
+        as soon as a module importing it has been parsed. With a single process, they are
+        parsed in this one instead.
+        """
+        asts = {}
+        seen = set()
+        pending = {}
+        pool = None
+        num_workers = jobs or os.cpu_count()
+
+        def visit(filename):
+            nonlocal pool
+            if filename in seen:
+                return
+            seen.add(filename)
+            full_filename = find_file(filename, self.search_paths)
+            source_hash = self.file_hashes.get(full_filename)
+            self.sources[filename] = (full_filename, source_hash)
+            is_main = filename == self.main_filename
+            key = stable_hash(self.fingerprint, filename, full_filename, is_main, source_hash, self.macros_key if filename.endswith('.h') else '')
+            self.source_keys[filename] = key
+            self.parse_keys[filename] = parse_key(filename, full_filename, is_main, self.default_macros, source_hash)
+
+            ast_module = self.cache.load(*self.parse_keys[filename])
+            if ast_module is not None:
+                parsed(filename, ast_module)
+            elif num_workers == 1:
+                ast_module = parse_source(filename, full_filename, is_main, self.default_macros)
+                self.cache.store(*self.parse_keys[filename], ast_module)
+                parsed(filename, ast_module)
+            else:
+                if pool is None:
+                    pool = concurrent.futures.ProcessPoolExecutor(num_workers)
+                future = pool.submit(parse_source_pickled, filename, full_filename, is_main, self.default_macros)
+                pending[future] = filename
+
+        def parsed(filename, ast_module):
+            asts[filename] = ast_module
+            self.deps[filename] = module_dependencies(ast_module)
+            for dep in self.deps[filename]:
+                visit(dep)
+
+        try:
+            visit(self.main_filename)
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    filename = pending.pop(future)
+                    data = future.result()
+                    self.cache.store_bytes(*self.parse_keys[filename], data)
+                    parsed(filename, pickle.loads(data))
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        # Order the modules like a depth-first search of the imports would, regardless of
+        # the order they were parsed in, as the generated code follows this order.
+        worklist = [self.main_filename]
+        while worklist:
+            filename = worklist.pop()
+            if filename in self.asts:
+                continue
+            self.asts[filename] = asts[filename]
+            worklist.extend(reversed(self.deps[filename]))
+
+        for filename in self.asts:
+            closure = self.reachable(filename)
+            self.closure_keys[filename] = stable_hash(*sorted(self.source_keys[f] for f in closure))
+
+    def reachable(self, filename):
+        seen = {filename}
+        worklist = [filename]
+        while worklist:
+            for dep in self.deps[worklist.pop()]:
+                if dep not in seen:
+                    seen.add(dep)
+                    worklist.append(dep)
+        return seen
+
+    def dependency_order(self):
+        """
+        The modules ordered such that a module comes after the modules it imports,
+        except for modules that are part of an import cycle.
+        """
+        order = []
+        visited = set()
+        def visit(filename):
+            if filename in visited:
+                return
+            visited.add(filename)
+            for dep in self.deps[filename]:
+                visit(dep)
+            order.append(filename)
+        for filename in self.asts:
+            visit(filename)
+        return order
+
+    def typecheck_parallel(self, ir_modules, functions, num_workers):
+        """
+        Typechecks the functions, given as (filename, index in the module's definitions),
+        by a pool of num_workers processes, in chunks of functions of the same module.
+        Returns the results of typecheck.typecheck_function_body in the same order.
+        """
+        global TYPECHECK_INPUT
+        tasks = []
+        for filename, index in functions:
+            if not tasks or tasks[-1][0] != filename:
+                tasks.append((filename, []))
+            tasks[-1][1].append(index)
+        chunk_size = max(1, sum(len(indices) for _filename, indices in tasks) // (4 * num_workers))
+        chunks = [(filename, indices[i:i + chunk_size]) for filename, indices in tasks for i in range(0, len(indices), chunk_size)]
+
+        TYPECHECK_INPUT = (ir_modules, self.asts, module_owners(ir_modules))
+        try:
+            with concurrent.futures.ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context('fork')) as pool:
+                # All chunks are submitted, and thus all workers forked, before any result
+                # is added to the declarations
+                futures = [pool.submit(typecheck_functions_pickled, filename, indices) for filename, indices in chunks]
+                results = []
+                for future in futures:
+                    results.extend(ModuleUnpickler(io.BytesIO(future.result()), ir_modules).load())
+                return results
+        finally:
+            TYPECHECK_INPUT = None
+
+    def function_sources(self, filename):
+        """
+        Returns the source of each function of a module by the index of its definition,
+        from the line the function starts on up to the line the next definition starts
+        on. Returns None when the file has changed since it was parsed.
+        """
+        full_filename, source_hash = self.sources[filename]
+        with open(full_filename, 'rb') as f:
+            data = f.read()
+        if picklecache.source_hash(data) != source_hash:
+            return None
+        lines = data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        defs = self.asts[filename].defs
+        starts = [(idx, node.location.line) for idx, node in enumerate(defs) if node.location is not None]
+        sources = {}
+        for (idx, start), (_next_idx, end) in zip(starts, starts[1:] + [(None, len(lines))]):
+            if type(defs[idx]) == ast.FunctionDef:
+                sources[idx] = '\n'.join(lines[start - 1:end])
+        return sources
+
+    def load_function(self, key, ir_modules, location, signature):
+        entry = self.cache.load('function', key)
+        if entry is None:
+            return None
+        lookups, data = entry
+        if any(signature(lookup) != lookup_signature for lookup, lookup_signature in lookups):
+            return None
+        return FunctionUnpickler(io.BytesIO(data), ir_modules, location).load()
+
+    def typecheck_functions(self, ir_modules, modules, jobs):
+        """
+        Typechecks the functions of the modules. The cached body of a function is reused
+        when neither the function nor what its lookups find (see declare.lookup_signature)
+        has changed. The bodies are added to the declarations in the order
+        typecheck.typecheck_module would, which keeps the generated code the same.
+        """
+        functions = [(filename, idx) for filename in modules for idx, node in enumerate(self.asts[filename].defs) if type(node) == ast.FunctionDef]
+        names = declaration_names(ir_modules)
+        signatures = {}
+        def signature(lookup):
+            if lookup not in signatures:
+                signatures[lookup] = declare.lookup_signature(ir_modules, *lookup)
+            return signatures[lookup]
+
+        # A function is keyed by its source, which leaves out where in the file it is
+        keys = {}
+        results = {}
+        if self.cache.directory is not None:
+            for filename in modules:
+                for index, source in (self.function_sources(filename) or {}).items():
+                    keys[filename, index] = stable_hash(self.fingerprint, filename, source)
+        for filename, index in functions:
+            if (filename, index) in keys:
+                result = self.load_function(keys[filename, index], ir_modules, self.asts[filename].defs[index].location, signature)
+                if result is not None:
+                    results[filename, index] = result
+
+        todo = [function for function in functions if function not in results]
+        num_workers = jobs or os.cpu_count()
+        if num_workers > 1 and len(todo) >= PARALLEL_TYPECHECK_MIN_FUNCTIONS and can_fork_workers():
+            typechecked = self.typecheck_parallel(ir_modules, todo, num_workers)
+        else:
+            typechecked = []
+            for filename, index in todo:
+                fn = self.asts[filename].defs[index]
+                ir_function = ir_modules[filename].function_index[fn.name][0]
+                typechecked.append(typecheck.typecheck_function_body(ir_modules, ir_modules[filename], ir_function, fn))
+
+        for (filename, index), (body, regexs, lookups) in zip(todo, typechecked):
+            results[filename, index] = body, regexs
+            if (filename, index) in keys:
+                f = io.BytesIO()
+                FunctionPickler(f, pickle.HIGHEST_PROTOCOL, names, self.asts[filename].defs[index].location).dump((body, regexs))
+                entry = ([(lookup, signature(lookup)) for lookup in lookups], f.getvalue())
+                self.cache.store('function', keys[filename, index], entry)
+
+        for filename, index in functions:
+            fn = self.asts[filename].defs[index]
+            body, regexs = results[filename, index]
+            typecheck.define_function_body(ir_modules[filename], ir_modules[filename].function_index[fn.name][0], body, regexs)
+
+    def program_key(self, *options):
+        return stable_hash(self.fingerprint, self.main_filename, *sorted(self.closure_keys.values()), *options)
+
+    def declare_and_typecheck(self, machine_def, jobs=None):
+        declare.LAYOUT_CACHE.clear()
+        declare.load_machine_def(machine_def)
+
+        # A module is only loaded from the cache when all its imports are, as the
+        # cached IR refers to the IR of the imported modules.
+        ir_modules = {}
+        recompute = []
+        for filename in self.dependency_order():
+            ir_module = None
+            if all(dep in ir_modules for dep in self.deps[filename]):
+                ir_module = self.cache.load('ir', self.closure_keys[filename], lambda f: ModuleUnpickler(f, ir_modules))
+            if ir_module is None:
+                recompute.append(filename)
+            else:
+                ir_modules[filename] = ir_module
+
+        for filename in recompute:
+            ir_modules[filename] = declare.declare_module_types(self.asts[filename])
+        for filename in recompute:
+            declare.declare_module_rest(self.asts[filename], ir_modules)
+
+        declare.declare_datatype_layout(ir_modules)
+
+        modules = [filename for filename in recompute if type(self.asts[filename]) == ast.ModuleDef]
+        self.typecheck_functions(ir_modules, modules, jobs)
+
+        if recompute and self.cache.directory is not None:
+            owners = module_owners(ir_modules)
+            for filename in recompute:
+                pickler = lambda f, protocol: ModulePickler(f, protocol, filename, owners)
+                self.cache.store('ir', self.closure_keys[filename], ir_modules[filename], pickler)
+
+        # Keep the order in which the modules were discovered, which is the order
+        # the generated code is emitted in.
+        return {filename: ir_modules[filename] for filename in self.asts}
+
+
+def compile_to_c(main_filename, search_paths, machine_def, default_macros, session, string_pool_format='literal', jobs=None):
+    compilation = Compilation(main_filename, search_paths, default_macros, session)
+    compilation.parse(jobs)
+    key = compilation.program_key('c', string_pool_format)
+    code = session.cache.load('codegen', key)
+    if code is None:
+        ir_modules = compilation.declare_and_typecheck(machine_def, jobs)
+        code = ccodegen.generate(ir_modules, machine_def, string_pool_format)
+        session.cache.store('codegen', key, code)
+    return code
+
+
+def compile_to_units(main_filename, search_paths, machine_def, default_macros, session, string_pool_format='literal', jobs=None):
+    compilation = Compilation(main_filename, search_paths, default_macros, session)
+    compilation.parse(jobs)
+    key = compilation.program_key('units', string_pool_format)
+    result = session.cache.load('codegen', key)
+    if result is None:
+        ir_modules = compilation.declare_and_typecheck(machine_def, jobs)
+        result = ccodegen.generate_units(ir_modules, machine_def, string_pool_format)
+        session.cache.store('codegen', key, result)
+    return result
+
+
+def build_argparser():
+    argparser = argparse.ArgumentParser(description="Cedar compiler")
+    argparser.add_argument("filename")
+    argparser.add_argument("-o", "--output", help="the C file to write, or the executable when using --build-dir")
+    argparser.add_argument("--cc", help="the C compiler whose predefined macros are used when parsing C headers")
+    argparser.add_argument("-I", dest="include_paths", action="append", default=[])
+    argparser.add_argument("--machine-def", default=os.path.join(ROOT, 'datatypes.json'))
+    argparser.add_argument("--cache-dir", default=".cedar-cache")
+    argparser.add_argument("--no-cache", action="store_true")
+    argparser.add_argument("--string-pool-format", default='literal', choices=['literal', 'bytes'])
+    argparser.add_argument("--build-dir", help="generate one C file per module into this directory and build an executable")
+    argparser.add_argument("-j", "--jobs", type=int, help="how many modules to parse, functions to typecheck and C files to compile in parallel (default: the number of CPUs)")
+    return argparser
+
+
+def run(args, session=None):
+    """
+    Compiles as instructed by the parsed command line. Returns the message to show.
+    """
+    if session is None:
+        session = Session(BuildCache(None if args.no_cache else args.cache_dir))
+    search_paths = [os.path.dirname(args.filename) or '.'] + args.include_paths + LANG_LIBS
+    main_filename = os.path.basename(args.filename)
+    machine_def = load_machine_def(args.machine_def)
+    compiler, default_macros = session.c_compiler(args.cc) if args.cc else (None, {})
+
+    if args.build_dir:
+        assert compiler is not None, "--build-dir requires --cc"
+        headers, units = compile_to_units(main_filename, search_paths, machine_def, default_macros, session, args.string_pool_format, args.jobs)
+        output = args.output or os.path.splitext(main_filename)[0]
+        # NOTE: lang-libs/cstdlib only describes the C library to the compiler, the C compiler
+        #       must use its own headers.
+        include_paths = [ROOT] + [os.path.abspath(p) for p in search_paths if p not in LANG_LIBS]
+        ccompiler.build_units(compiler, args.build_dir, headers, units, output, include_paths, jobs=args.jobs)
+        return f"Compilation complete. Executable written to {output}"
+    else:
+        code = compile_to_c(main_filename, search_paths, machine_def, default_macros, session, args.string_pool_format, args.jobs)
+        output = args.output or os.path.splitext(main_filename)[0] + '.c'
+        with open(output, 'w') as f:
+            f.write(code)
+        return f"Compilation complete. C code written to {output}"
+
+
+def main():
+    print(run(build_argparser().parse_args()))
+
+
+if __name__ == '__main__':
+    main()
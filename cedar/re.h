@@ -27,18 +27,18 @@ struct MatchResult {
     int groups; // bitmask of assigned groups
 };
 
-int bc_is_word_char(char s) {
+static int bc_is_word_char(char s) {
     return ('a' <= s && s <= 'z') || ('A' <= s && s <= 'Z') || ('0' <= s && s <= '9') || s == '_';
 }
 
-struct MatchResult _bc_match(const char* bytecode, size_t bytecode_len, const char* string, size_t string_len, size_t pc, size_t sp, struct Capture* captures, size_t captures_count);
+static struct MatchResult _bc_match(const char* bytecode, size_t bytecode_len, const char* string, size_t string_len, size_t pc, size_t sp, struct Capture* captures, size_t captures_count);
 
-int bc_match(const char* bytecode, size_t bytecode_len, const char* string, size_t string_len, struct Capture* captures, size_t captures_count) {
+static int bc_match(const char* bytecode, size_t bytecode_len, const char* string, size_t string_len, struct Capture* captures, size_t captures_count) {
     struct MatchResult final_s = _bc_match(bytecode, bytecode_len, string, string_len, 0, 0, captures, captures_count);
     return final_s.matched;
 }
 
-struct MatchResult _bc_match(const char* bytecode, size_t bytecode_len, const char* string, size_t string_len, size_t pc, size_t sp, struct Capture* captures, size_t captures_count) {
+static struct MatchResult _bc_match(const char* bytecode, size_t bytecode_len, const char* string, size_t string_len, size_t pc, size_t sp, struct Capture* captures, size_t captures_count) {
     if (pc >= bytecode_len) return (struct MatchResult){pc, sp, /*false*/0, 0};
 
     unsigned char instr = bytecode[pc];
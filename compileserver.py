@@ -0,0 +1,145 @@
+"""
+A compile server that keeps the compiler loaded between compilations, together with
+what it has already computed: parsed and typechecked modules, hashes of source files
+and the probed C compilers. This saves the interpreter startup, importing the compiler
+and probing the C compiler on every compile.
+
+Start the server:
+
+$ python3 compileserver.py --serve
+
+Then compile by passing the usual arguments of cedar.py:
+
+$ python3 compileserver.py main.ce --cc gcc -I test
+
+The client falls back to compiling in-process if the server isn't running. Requests
+are handled one at a time, in the working directory of the client.
+"""
+import os
+import io
+import sys
+import json
+import signal
+import socket
+import argparse
+import tempfile
+import traceback
+import contextlib
+import socketserver
+
+# NOTE: The compiler is only imported by the server and by the client's fallback, such
+#       that the client starts quickly.
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), "cedar-%d.sock" % os.getuid())
+DEFAULT_MEMORY_CACHE_BYTES = 256 * 1024 * 1024
+
+
+def compile_request(sessions, cwd, argv, memory_cache_bytes=DEFAULT_MEMORY_CACHE_BYTES):
+    """
+    Runs cedar.py with argv in cwd, reusing the session for the requested cache
+    directory, which keeps up to memory_cache_bytes of cache entries in memory.
+    Returns the exit code and the output.
+    """
+    import cedar
+    output = io.StringIO()
+    returncode = 0
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            os.chdir(cwd)
+            args = cedar.build_argparser().parse_args(argv)
+            cache_dir = None if args.no_cache else os.path.abspath(args.cache_dir)
+            if cache_dir not in sessions:
+                sessions[cache_dir] = cedar.Session(cedar.MemoryCache(cache_dir, memory_cache_bytes))
+            print(cedar.run(args, sessions[cache_dir]))
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            traceback.print_exc()
+            returncode = 1
+    return returncode, output.getvalue()
+
+
+class CompileRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        returncode, output = compile_request(self.server.sessions, request['cwd'], request['argv'], self.server.memory_cache_bytes)
+        response = {'returncode': returncode, 'output': output}
+        self.wfile.write(json.dumps(response).encode('utf-8') + b"\n")
+
+
+class CompileServer(socketserver.UnixStreamServer):
+    def __init__(self, socket_path, memory_cache_bytes):
+        super().__init__(socket_path, CompileRequestHandler)
+        self.sessions = {}
+        self.memory_cache_bytes = memory_cache_bytes
+
+
+def serve(socket_path, memory_cache_bytes):
+    if os.path.exists(socket_path):
+        # Only reuse the socket of a server that has exited
+        assert not is_server_running(socket_path), "a compile server is already running at %s" % socket_path
+        os.unlink(socket_path)
+    # Import the compiler up front rather than on the first request
+    import cedar
+    server = CompileServer(socket_path, memory_cache_bytes)
+    print(f"Compile server listening on {socket_path}")
+    # Also clean up when terminated, rather than interrupted
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+def is_server_running(socket_path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+            return True
+        except (FileNotFoundError, ConnectionRefusedError):
+            return False
+
+
+def request_compile(socket_path, argv):
+    """
+    Sends a compile request to the server. Returns the exit code and the output, or
+    None if no server is running.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+        request = {'cwd': os.getcwd(), 'argv': argv}
+        sock.sendall(json.dumps(request).encode('utf-8') + b"\n")
+        with sock.makefile('rb') as f:
+            response = json.loads(f.readline())
+    return response['returncode'], response['output']
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--socket", default=DEFAULT_SOCKET)
+    argparser.add_argument("--serve", action="store_true", help="run the server instead of sending a request to it")
+    argparser.add_argument("--memory-cache-mb", type=int, default=DEFAULT_MEMORY_CACHE_BYTES // (1024 * 1024),
+                           help="how much of the cache the server keeps in memory, per cache directory")
+    args, argv = argparser.parse_known_args()
+
+    if args.serve:
+        serve(args.socket, args.memory_cache_mb * 1024 * 1024)
+        return
+
+    result = request_compile(args.socket, argv)
+    if result is None:
+        print(f"No compile server at {args.socket}, compiling in-process", file=sys.stderr)
+        result = compile_request({}, os.getcwd(), argv)
+    returncode, output = result
+    sys.stdout.write(output)
+    sys.exit(returncode)
+
+
+if __name__ == '__main__':
+    main()
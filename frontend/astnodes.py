@@ -1,90 +1,102 @@
 from dataclasses import dataclass, field
 from typing import List, Optional
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class Location:
     filename: str
     line: int
     column: int
 
-@dataclass
+    def __reduce__(self):
+        # Pickle as a tuple rather than as a dict of fields, as ASTs have many locations
+        return Location, (self.filename, self.line, self.column)
+
+@dataclass(slots=True)
 class SyntaxError:
     location: Location
     msg: str
     got: str
 
-@dataclass
+@dataclass(slots=True)
 class ASTNode:
     location: Location = field(compare=False, repr=False, kw_only=True, default=None)
 
-@dataclass
+    # Pickle the fields as a tuple, rather than as a dict keyed by their names
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__match_args__) + (self.location,)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__match_args__ + ('location',), state):
+            setattr(self, name, value)
+
+@dataclass(slots=True)
 class TypeExpr(ASTNode):
     pass
 
-@dataclass
+@dataclass(slots=True)
 class Definition(ASTNode):
     pass
 
-@dataclass
+@dataclass(slots=True)
 class Expr(ASTNode):
     pass
 
-@dataclass
+@dataclass(slots=True)
 class Stmt(ASTNode):
     pass
 
     
-@dataclass
+@dataclass(slots=True)
 class NamedType(TypeExpr):
     namespace: str
     name: str
 
-@dataclass
+@dataclass(slots=True)
 class ArrayType(TypeExpr):
     elty: TypeExpr
 
-@dataclass
+@dataclass(slots=True)
 class TupleType(TypeExpr):
     positional: List[TypeExpr]
     named: List[TypeExpr]
     names: List[str]
 
-@dataclass
+@dataclass(slots=True)
 class UnionType(TypeExpr):
     types: List[TypeExpr]
     
-@dataclass
+@dataclass(slots=True)
 class PointerType(TypeExpr):
     target: TypeExpr
 
-@dataclass
+@dataclass(slots=True)
 class OptionType(TypeExpr):
     target: TypeExpr
 
-@dataclass
+@dataclass(slots=True)
 class ErrorType(TypeExpr):
     target: TypeExpr
 
-@dataclass
+@dataclass(slots=True)
 class FunctionType(TypeExpr):
     retty: TypeExpr
     argtys: List[TypeExpr]
     argnames: List[str]
 
 
-@dataclass
+@dataclass(slots=True)
 class ModuleDef(Definition):
     filename: str
     defs: List[Definition]
     main_module: bool
 
-@dataclass
+@dataclass(slots=True)
 class ImportDef(Definition):
     filename: str
     namespace: str
     parameters: 'TupleExpr'
 
-@dataclass
+@dataclass(slots=True)
 class FunctionDef(Definition):
     export: bool
     retty: TypeExpr
@@ -95,20 +107,20 @@ class FunctionDef(Definition):
     argnames: List[str]
     body: List[Stmt]
 
-@dataclass
+@dataclass(slots=True)
 class TypeConstructor(ASTNode):
     name: str
     field_types: List[TypeExpr]
     field_names: List[str]
     tag_value: Expr
 
-@dataclass
+@dataclass(slots=True)
 class TypeDef(Definition):
     export: bool
     name: str
     constructors: List[TypeConstructor]
 
-@dataclass
+@dataclass(slots=True)
 class VariableDef(Definition):
     export: bool
     ty: TypeExpr
@@ -116,47 +128,47 @@ class VariableDef(Definition):
     value: Expr
 
 
-@dataclass
+@dataclass(slots=True)
 class CTypeExpr(TypeExpr):
     pass
 
-@dataclass
+@dataclass(slots=True)
 class CDefinition(Definition):
     pass
 
-@dataclass
+@dataclass(slots=True)
 class CModuleDef(Definition):
     filename: str
     defs: List[CDefinition]
 
-@dataclass
+@dataclass(slots=True)
 class CVariableDef(CDefinition):
     ty: CTypeExpr
     name: str
 
-@dataclass
+@dataclass(slots=True)
 class CUnionDef(CDefinition):
     name: str
     field_types: List[CTypeExpr]
     field_names: List[str]
 
-@dataclass
+@dataclass(slots=True)
 class CStructDef(CDefinition):
     name: str
     field_types: List[CTypeExpr]
     field_names: List[str]
 
-@dataclass
+@dataclass(slots=True)
 class CEnumDef(CDefinition):
     name: str
     enumerators: List[str]
 
-@dataclass
+@dataclass(slots=True)
 class CTypedefDef(CDefinition):
     name: str
     definition: CTypeExpr
 
-@dataclass
+@dataclass(slots=True)
 class CFunctionDef(CDefinition):
     retty: CTypeExpr
     name: str
@@ -164,210 +176,214 @@ class CFunctionDef(CDefinition):
     argnames: List[str]
     varargs: bool
 
-@dataclass
+@dataclass(slots=True)
 class CGlobalVarDef(CDefinition):
     ty: CTypeExpr
     name: str
 
-@dataclass
+@dataclass(slots=True)
 class CConstDefine(CDefinition):
     ty: CTypeExpr
     name: str
     undefined: bool
 
-@dataclass
+@dataclass(slots=True)
 class CInclude(CDefinition):
     filename: str
 
-@dataclass
+@dataclass(slots=True)
 class CNamedType(CTypeExpr):
     name: str
     typekind: str = None # 'struct', 'union', 'union'
 
-@dataclass
+@dataclass(slots=True)
 class CPointerType(CTypeExpr):
     target: CTypeExpr
 
-@dataclass
+@dataclass(slots=True)
 class CConstType(CTypeExpr):
     target: CTypeExpr
 
-@dataclass
+@dataclass(slots=True)
 class CFunctionPointerType(CTypeExpr):
     retty: CTypeExpr
     argtys: List[CTypeExpr]
     argnames: List[str]
 
-@dataclass
+@dataclass(slots=True)
 class CArrayType(CTypeExpr):
     elty: CTypeExpr
 
-@dataclass
+@dataclass(slots=True)
 class CAnonymousType(CTypeExpr):
     tydef: CDefinition
 
-@dataclass
+@dataclass(slots=True)
 class IntegerExpr(Expr):
     value: int
 
-@dataclass
+@dataclass(slots=True)
 class StringExpr(Expr):
     value: str
 
-@dataclass
+@dataclass(slots=True)
 class RegexExpr(Expr):
     value: 'RENode'
 
-@dataclass
+@dataclass(slots=True)
 class SymbolExpr(Expr):
     value: str
 
-@dataclass
+@dataclass(slots=True)
 class FloatExpr(Expr):
     value: str # NOTE: Keep float as string, because we don't yet know how it should be represented
 
-@dataclass
+@dataclass(slots=True)
 class IndexExpr(Expr):
     target: Expr
     indices: List[Expr]
 
-@dataclass
+@dataclass(slots=True)
 class MemberExpr(Expr):
     target: Expr
     member: str
 
-@dataclass
+@dataclass(slots=True)
 class BoolExpr(Expr):
     value: bool
 
-@dataclass
+@dataclass(slots=True)
 class NullExpr(Expr):
     pass
 
-@dataclass
+@dataclass(slots=True)
 class IdentifierExpr(Expr):
     name: str
 
-@dataclass
+@dataclass(slots=True)
 class NewIdentifierExpr(Expr):
     name: str
     implicit: bool
 
-@dataclass
+@dataclass(slots=True)
 class WhereExpr(Expr):
     expr: Expr
     stmts: List[Stmt]
 
-@dataclass
+@dataclass(slots=True)
 class TupleExpr(Expr):
     positional: List[Expr]
     named: List[Expr]
     names: List[str]
     
-@dataclass
+@dataclass(slots=True)
 class ArrayExpr(Expr):
     elems: List[Expr]
     
-@dataclass
+@dataclass(slots=True)
 class ForExpr(Expr):
     iterator: Expr
     iterable: Expr
     body: Stmt
 
-@dataclass
+@dataclass(slots=True)
 class WhileExpr(Expr):
     cond: Expr
     body: Stmt
 
-@dataclass
+@dataclass(slots=True)
 class IfExpr(Expr):
     cond: Expr
     true_body: Stmt
     false_body: Stmt
 
-@dataclass
+@dataclass(slots=True)
 class IfCaseExpr(Expr):
     cond: Expr
     pattern: Expr
     true_body: Stmt
     false_body: Stmt
 
-@dataclass
+@dataclass(slots=True)
 class CallExpr(Expr):
     func: Expr
     args: TupleExpr
     block: 'BlockStmt'
 
-@dataclass
+@dataclass(slots=True)
 class TypeOfExpr(Expr):
     expr: Expr
 
-@dataclass
+@dataclass(slots=True)
 class AllocateExpr(Expr):
     allocator: Expr
     data: Expr
 
-@dataclass
+@dataclass(slots=True)
 class BinaryOpExpr(Expr):
     lhs: Expr
     op: str
     rhs: Expr
 
-@dataclass
+@dataclass(slots=True)
 class CastExpr(Expr):
     type: Expr
     expr: Expr
 
 
-@dataclass
+@dataclass(slots=True)
 class BinaryElseExpr(Expr):
     lhs: Expr
     stmt: 'BlockStmt'
 
-@dataclass
+@dataclass(slots=True)
 class UnaryOpExpr(Expr):
     op: str
     expr: Expr
 
-@dataclass
+@dataclass(slots=True)
 class NoExpr(Expr):
     """
     Used when no expression given, e.g., for 'return'.
     """
     def __repr__(self):
         return "NoExpr"
+
+    def __reduce__(self):
+        # Pickle as a reference to the singleton below
+        return "NoExpr"
 NoExpr = NoExpr()
 
 
-@dataclass
+@dataclass(slots=True)
 class BlockStmt(Stmt):
     stmts: List[Stmt]
 
-@dataclass
+@dataclass(slots=True)
 class PassStmt(Stmt):
     pass
 
-@dataclass
+@dataclass(slots=True)
 class BreakStmt(Stmt):
     value: Expr
 
-@dataclass
+@dataclass(slots=True)
 class ContinueStmt(Stmt):
     value: Expr
 
-@dataclass
+@dataclass(slots=True)
 class ReturnStmt(Stmt):
     value: Expr
 
-@dataclass
+@dataclass(slots=True)
 class AssertStmt(Stmt):
     value: Expr
 
-@dataclass
+@dataclass(slots=True)
 class ExprStmt(Stmt):
     expr: Expr
 
-@dataclass
+@dataclass(slots=True)
 class AssignStmt(Stmt):
     lhs: Expr
     rhs: Expr
@@ -375,51 +391,51 @@ class AssignStmt(Stmt):
 
 
 
-@dataclass
+@dataclass(slots=True)
 class RENode:
     pass
 
-@dataclass
+@dataclass(slots=True)
 class RELiteral(RENode):
     value: str
 
-@dataclass
+@dataclass(slots=True)
 class REDot(RENode):
     """Match any value"""
 
-@dataclass
+@dataclass(slots=True)
 class RECharClass(RENode):
     inverted: bool
     ranges: List['(str, str)']
 
-@dataclass
+@dataclass(slots=True)
 class RECapturingGroup(RENode):
     expr: RENode
 
-@dataclass
+@dataclass(slots=True)
 class RENamedCapturingGroup(RENode):
     expr: RENode
     name: str
 
-@dataclass
+@dataclass(slots=True)
 class REPositiveLookahead(RENode):
     expr: RENode
 
-@dataclass
+@dataclass(slots=True)
 class REAlternation(RENode):
     left: RENode
     right: RENode
 
-@dataclass
+@dataclass(slots=True)
 class RESequence(RENode):
     factors: List[RENode]
 
-@dataclass
+@dataclass(slots=True)
 class REQuantifier(RENode):
     atom: RENode
     min: int
     max: Optional[int] = None
 
-@dataclass
+@dataclass(slots=True)
 class REAnchor(RENode):
     value: str  # '^', '$', 'b'
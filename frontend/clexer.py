@@ -1,3 +1,5 @@
+import re
+import sys
 from enum import Enum, auto
 from dataclasses import dataclass
 from frontend.astnodes import Location
@@ -74,7 +76,7 @@ class TokenType(Enum):
     IMAGINARY = auto()
 
 # Token data class
-@dataclass
+@dataclass(slots=True)
 class Token:
     type: TokenType
     value: str
@@ -83,7 +85,7 @@ class Token:
 # Lexer state class
 class LexerState:
     def __init__(self, filename, text, ignore_tokens):
-        self.filename = filename
+        self.filename = sys.intern(filename)
         self.text = text + '\n'
         self.ignore_tokens = ignore_tokens
         self.line = 1
@@ -119,20 +121,150 @@ delimiters = {'(': TokenType.LPAREN, ')': TokenType.RPAREN,
                '->': TokenType.ARROW, '?': TokenType.QUESTION,
                '!': TokenType.EXCLAMATION, '@': TokenType.AT}
 
+PAREN_REGEX = re.compile(r'[()]')
+
 def skip_until_matching_paren(state):
     matching = 1
     while matching > 0:
-        char = state.text[state.index]
-        print("skipping", char)
-        state.index += 1
-        if char == '(':
-            matching += 1
-        elif char == ')':
-            matching -= 1
-    print("done skipping", state.text[state.index:state.index+10])
+        match = PAREN_REGEX.search(state.text, state.index)
+        if match is None:
+            state.index = len(state.text)
+            return
+        state.index = match.end()
+        matching += 1 if match.group() == '(' else -1
+
+# The kinds of tokens lex dispatches on, in the order lex_by_char checks for them. Spaces
+# and tabs before a token are consumed by the same match, so most tokens take one match.
+TOKEN_REGEX = re.compile(r"""
+  [ \t]*
+  (?:
+    (?P<ESCAPED_NEWLINE>\\\n)
+  | (?P<SPACE>\s+)
+  | (?P<LINE_COMMENT>//[^\n]*)
+  | (?P<BLOCK_COMMENT>/\*)
+  | (?P<IDENTIFIER>[^\W\d]\w*)
+  | (?P<HEX>0[xX][0-9a-fA-F]*)
+  | (?P<NUMBER>\d+(?P<FRACTION>\.\d*)?)
+  | (?P<STRING>"(?:\\[\s\S]|[^"\\])*(?P<CLOSING_QUOTE>")?)
+  | (?P<CHAR>')
+  | (?P<OPERATOR>\+\+|--|&&|\|\||<=|>=|==|!=|<<|>>|[<>+\-*/%&|^!~=])
+  | (?P<ELLIPSIS>\.\.\.)
+  | (?P<DELIMITER>[()\[\]{},;:.?@])
+  | (?P<DIRECTIVE>\#)
+  | (?P<ERROR>[\s\S])
+  )
+""", re.VERBOSE)
 
-    
 def lex(state: LexerState) -> Token:
+    """
+    Returns the next token, like lex_by_char, but finds it with TOKEN_REGEX.
+    """
+    text = state.text
+    while True:
+        match = TOKEN_REGEX.match(text, state.index)
+        if match is None:
+            return Token(TokenType.EOF, "<end of file>", Location(state.filename, state.line, state.index - state.line_start + 1))
+        kind = match.lastgroup
+        start_index = match.start(kind)
+        state.index = match.end()
+
+        if kind == 'IDENTIFIER':
+            value = match.group(kind)
+            if value in state.ignore_tokens:
+                if text.startswith('(', state.index):
+                    state.index += 1
+                    skip_until_matching_paren(state)
+                continue
+            return Token(keywords.get(value, TokenType.IDENTIFIER), value, Location(state.filename, state.line, start_index - state.line_start + 1))
+
+        if kind == 'DELIMITER':
+            value = match.group(kind)
+            return Token(delimiters[value], value, Location(state.filename, state.line, start_index - state.line_start + 1))
+
+        if kind == 'SPACE':
+            newline = text.find('\n', start_index, state.index)
+            if newline < 0:
+                continue
+            if state.in_preprocessor_directive:
+                state.in_preprocessor_directive = False
+                state.index = newline + 1
+                state.line += 1
+                state.line_start = state.index
+                return Token(TokenType.PPDIRECTIVE_END, "\n", Location(state.filename, state.line, state.column))
+            state.line += text.count('\n', newline, state.index)
+            state.line_start = text.rfind('\n', newline, state.index) + 1
+            continue
+
+        if kind == 'OPERATOR':
+            return Token(TokenType.OPERATOR, match.group(kind), Location(state.filename, state.line, start_index - state.line_start + 1))
+
+        if kind == 'LINE_COMMENT':
+            continue
+
+        if kind == 'BLOCK_COMMENT':
+            end = text.find('*/', state.index)
+            end = len(text) if end < 0 else end
+            newlines = text.count('\n', state.index, end)
+            if newlines:
+                state.line += newlines
+                state.line_start = text.rfind('\n', state.index, end) + 1
+            state.index = end + 2
+            continue
+
+        if kind == 'ESCAPED_NEWLINE':
+            state.line += 1
+            state.line_start = state.index
+            continue
+
+        if kind == 'HEX':
+            return Token(TokenType.INT_LITERAL, match.group(kind), Location(state.filename, state.line, start_index - state.line_start + 1))
+
+        if kind == 'NUMBER':
+            suffix = text[state.index:state.index + 1]
+            if suffix == 'f':
+                token_type = TokenType.FLOAT_LITERAL
+            elif suffix == 'd' or match.group('FRACTION') is not None:
+                token_type = TokenType.DOUBLE_LITERAL
+            else:
+                token_type = TokenType.INT_LITERAL
+            return Token(token_type, match.group(kind), Location(state.filename, state.line, start_index - state.line_start + 1))
+
+        if kind == 'STRING':
+            if match.group('CLOSING_QUOTE'):
+                value = text[start_index + 1:state.index - 1]
+            else:
+                # Like lex_by_char, step over the missing closing quote
+                value = text[start_index + 1:state.index]
+                state.index += 1
+            return Token(TokenType.STRING_LITERAL, value, Location(state.filename, state.line, start_index - state.line_start + 1))
+
+        if kind == 'CHAR':
+            # Like lex_by_char, assume a single (possibly escaped) character and a closing quote
+            state.index += 3 if text.startswith('\\', state.index) else 2
+            return Token(TokenType.CHAR_LITERAL, text[start_index:state.index], Location(state.filename, state.line, start_index - state.line_start + 1))
+
+        if kind == 'ELLIPSIS':
+            return Token(TokenType.ELLIPSIS, '...', Location(state.filename, state.line, start_index - state.line_start + 1))
+
+        if kind == 'DIRECTIVE':
+            while text[state.index] in ' \t':
+                state.index += 1
+            start_index = state.index
+            state.index += 1
+            state.in_preprocessor_directive = True
+            match = NON_SPACE_REGEX.match(text, state.index)
+            state.index = match.end()
+            return Token(TokenType.PPDIRECTIVE, text[start_index:state.index], Location(state.filename, state.line, start_index - state.line_start + 1))
+
+        return Token(TokenType.ERROR, match.group(kind), Location(state.filename, state.line, start_index - state.line_start + 1))
+
+NON_SPACE_REGEX = re.compile(r'\S*')
+
+def lex_by_char(state: LexerState) -> Token:
+    """
+    The previous implementation of lex, which walks the text a character at a time. Kept
+    as the reference that benchmarks/clexer.py checks lex against.
+    """
     while state.index < len(state.text):
         char = state.text[state.index]
 
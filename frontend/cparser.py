@@ -1,6 +1,9 @@
 import os
+import hashlib
+import functools
 import frontend.clexer as lexer
 import frontend.astnodes as ast
+import frontend.picklecache as picklecache
 import copy
 
 class ParserState:
@@ -414,14 +417,49 @@ def parse_text(full_filename, filename, text, ignore_tokens, default_macros):
     assert parser.errors == [], parser.errors
     return module_ast
 
-def parse_file(full_filename, filename, ignore_tokens, default_macros):
-    ignore_tokens = ignore_tokens.copy()
-    ignore_tokens.add('inline')
-    ignore_tokens.add('extern')
-    ignore_tokens.add('static')
-    with open(full_filename) as f:
-        text = f.read()
-        return parse_text(full_filename, filename, text, ignore_tokens, default_macros)
+@functools.cache
+def parser_fingerprint():
+    h = hashlib.blake2b(digest_size=16)
+    for module in (lexer, ast):
+        with open(module.__file__, 'rb') as f:
+            h.update(f.read())
+    with open(__file__, 'rb') as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+def header_key(full_filename, filename, source_hash, ignore_tokens, default_macros):
+    """
+    Returns the key of a parsed header in a cache (see picklecache.PickleCache), which
+    covers everything the result depends on: the header's path and the hash of its
+    content, the ignored tokens, the predefined macros and the source of the parser
+    itself. Thus, stale entries are never used, they are just not found anymore.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for part in (parser_fingerprint(), os.path.abspath(full_filename), filename, source_hash, repr(sorted(ignore_tokens)), repr(sorted(default_macros.items()))):
+        h.update(part.encode('utf-8'))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def parse_file(full_filename, filename, ignore_tokens, default_macros, cache=None):
+    """
+    Parses a header, or loads it from the 'headers' entries of the cache, a
+    picklecache.PickleCache.
+    """
+    with open(full_filename, 'rb') as f:
+        data = f.read()
+    key = header_key(full_filename, filename, picklecache.source_hash(data), ignore_tokens, default_macros) if cache is not None else None
+    module_ast = cache.load('headers', key) if cache is not None else None
+    if module_ast is None:
+        ignore_tokens = ignore_tokens.copy()
+        ignore_tokens.add('inline')
+        ignore_tokens.add('extern')
+        ignore_tokens.add('static')
+        # Translate newlines like when reading the file in text mode
+        text = data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+        module_ast = parse_text(full_filename, filename, text, ignore_tokens, default_macros)
+        if cache is not None:
+            cache.store('headers', key, module_ast)
+    return module_ast
 
 if __name__ == '__main__':
     files = [
@@ -1,4 +1,8 @@
 import re
+import sys
+import bisect
+import collections
+from array import array
 from enum import Enum, auto
 from dataclasses import dataclass
 from frontend.astnodes import Location
@@ -54,21 +58,31 @@ class TokenType(Enum):
     ERROR = auto()
 
 
-@dataclass
+@dataclass(slots=True)
 class Token:
     type: TokenType
     value: str
     location: Location
 
 class LexerState:
-    def __init__(self, filename, text):
-        self.filename = filename
-        self.text = text + '\n'
-        self.line = 1
+    def __init__(self, filename, text, scan=None, index=0, line=1):
+        self.filename = sys.intern(filename)
+        # The text may also be a bytes-like buffer, such as a memory map of the file, which is
+        # lexed in place. Token values are decoded from UTF-8. Internally, columns count bytes;
+        # the locations handed out count characters, like for a str. Rather than appending a
+        # newline to the buffer, which would copy it, _lex acts as if there was one.
+        self.is_buffer = not isinstance(text, str)
+        self.text = text if self.is_buffer else text + '\n'
+        self.newline_at_end = not self.is_buffer
+        # How to find the next token, see scan_table, scan_table_bytes, scan_regex and scan_bytes
+        self.scan = scan or (scan_table_bytes if self.is_buffer else scan_table)
+        self.regex_regex = REGEX_REGEX_BYTES if self.is_buffer else REGEX_REGEX
+        # Lexing may start in the middle of the text, at the start of a top-level definition
+        self.line = line
         self.column = 1
-        self.index = 0
-        self.line_start = 0
-        self.emit_queue = []
+        self.index = index
+        self.line_start = text.rfind(b'\n' if self.is_buffer else '\n', 0, index) + 1
+        self.emit_queue = collections.deque()
         self.paren_stack = 0 # How many parenthesis we're inside
         self.insert_implicit_semicolon_if_newline_next = False
         self.regex_can_follow = False
@@ -86,54 +100,84 @@ def unescape_string(s: str) -> str:
     return codecs.decode(s, 'unicode_escape')
 
 def lex(state: LexerState) -> Token:
+    token_type, token_value, line, column, offset = _lex(state)
+    if state.is_buffer:
+        column = character_column(state.text, offset - column + 1, offset)
+    return Token(token_type, token_value, Location(state.filename, line, column))
+
+def character_column(buffer, line_start, offset):
+    """
+    Returns the column of offset in a UTF-8 buffer, counting characters rather than bytes.
+    """
+    return len(buffer[line_start:offset].decode('utf-8', errors='replace')) + 1
+
+def _synthesized(state, token_type, token_value):
+    return token_type, token_value, state.line, state.column, state.line_start + state.column - 1
+
+def _lex(state):
+    """
+    Returns the next token as a tuple (type, value, line, column, offset), where offset
+    is the position in the text that the line and column refer to.
+    """
     while True:
         if state.emit_queue:
-            return state.emit_queue.pop(0)
+            return state.emit_queue.popleft()
 
         insert_implicit_semicolon_if_newline_next = state.insert_implicit_semicolon_if_newline_next
         state.insert_implicit_semicolon_if_newline_next = False
         
         if len(state.text) == state.index:
+            if not state.newline_at_end:
+                state.newline_at_end = True
+                if insert_implicit_semicolon_if_newline_next:
+                    state.emit_queue.append(_synthesized(state, TokenType.SEMICOLON, ';'))
+                state.line += 1
+                state.line_start = state.index
+                continue
             if insert_implicit_semicolon_if_newline_next:
                 state.regex_can_follow = False
-                return Token(TokenType.SEMICOLON, ';', Location(state.filename, state.line, state.column))
-            return Token(TokenType.EOF, "<end of file>", Location(state.filename, state.line, state.column))
+                return _synthesized(state, TokenType.SEMICOLON, ';')
+            return _synthesized(state, TokenType.EOF, "<end of file>")
 
         match = None
         if state.regex_can_follow:
-            match = REGEX_REGEX.match(state.text, state.index)
+            match = state.regex_regex.match(state.text, state.index)
 
-        if not match:
-            match = TOKEN_REGEX.match(state.text, state.index)
-            assert match is not None, state.text[state.index:state.index + 10]
+        start = state.index
+        if match:
+            token_type, end = TokenType.REGEX, match.end()
+        else:
+            token_type, end = state.scan(state.text, start)
         
-        state.index = match.end()
-        token_type = match.lastgroup
-        token_value = match.group(token_type)
-        token_location = Location(state.filename, state.line, match.start() - state.line_start + 1)
+        state.index = end
+        token_value = state.text[start:end]
+        if state.is_buffer:
+            token_value = token_value.decode('utf-8')
+        token_line = state.line
+        token_column = start - state.line_start + 1
         
-        if token_type == 'IMPORT':
+        if token_type == TokenType.IMPORT:
             token_value = token_value[len('import '):]
 
-        if token_type == 'IGNORE':
+        if token_type == IGNORE:
             num_newlines = token_value.count("\n")
             state.line += num_newlines
             state.insert_implicit_semicolon_if_newline_next = insert_implicit_semicolon_if_newline_next
             continue
         
-        elif token_type == 'ERROR':
-            return Token(TokenType.ERROR, token_value, token_location)
+        elif token_type == TokenType.ERROR:
+            return TokenType.ERROR, token_value, token_line, token_column, start
         
-        elif token_type == 'NEWLINE':
+        elif token_type == NEWLINE:
             if insert_implicit_semicolon_if_newline_next:
-                state.emit_queue.append(Token(TokenType.SEMICOLON, ';', Location(state.filename, state.line, state.column)))
+                state.emit_queue.append(_synthesized(state, TokenType.SEMICOLON, ';'))
             state.line += token_value.count("\n")
             state.line_start = state.index
             continue
         
-        elif token_type == 'RBRACE' and insert_implicit_semicolon_if_newline_next:
-            state.emit_queue.append(Token(TokenType.SEMICOLON, ';', Location(state.filename, state.line, state.column)))
-            state.emit_queue.append(Token(TokenType.RBRACE, '}', Location(state.filename, state.line, state.column)))
+        elif token_type == TokenType.RBRACE and insert_implicit_semicolon_if_newline_next:
+            state.emit_queue.append(_synthesized(state, TokenType.SEMICOLON, ';'))
+            state.emit_queue.append(_synthesized(state, TokenType.RBRACE, '}'))
             state.insert_implicit_semicolon_if_newline_next = True
             continue
 
@@ -143,16 +187,123 @@ def lex(state: LexerState) -> Token:
             elif token_value in (')', ']') and state.paren_stack > 0:
                 state.paren_stack -= 1
             
-            token_type_enum = TokenType[token_type]
-            if token_type_enum == TokenType.STRING:
+            if token_type == TokenType.STRING:
                 token_value = unescape_string(token_value)
 
-            state.insert_implicit_semicolon_if_newline_next = token_type_enum in INSERT_IMPLICIT_SEMICOLON and state.paren_stack == 0
-            state.regex_can_follow = token_type_enum in REGEX_CAN_FOLLOW
-            return Token(token_type_enum, token_value, token_location)
+            state.insert_implicit_semicolon_if_newline_next = token_type in INSERT_IMPLICIT_SEMICOLON and state.paren_stack == 0
+            state.regex_can_follow = token_type in REGEX_CAN_FOLLOW
+            return token_type, token_value, token_line, token_column, start
         assert False, "should not reach here"
 
 
+
+class PackedToken:
+    """
+    A token of PackedTokens, which creates its location when asked for it.
+    """
+    __slots__ = ('type', 'value', '_tokens', '_index', '_location')
+
+    def __init__(self, token_type, value, tokens, index):
+        self.type = token_type
+        self.value = value
+        self._tokens = tokens
+        self._index = index
+        self._location = None
+
+    @property
+    def location(self):
+        if self._location is None:
+            self._location = self._tokens.location(self._index)
+        return self._location
+
+class PackedTokens:
+    """
+    The tokens of a file packed into arrays, as an alternative to a list of Token objects
+    which each have a Location. Indexing returns a PackedToken.
+
+    For each token, the arrays hold its type, the position in the text its location refers
+    to and the length of its value, which is the text at that position. The few values that
+    are not (e.g., unescaped strings) are kept separately. Locations are computed from a table
+    of the positions where lines start.
+    """
+    def __init__(self, filename, text):
+        self.filename = filename
+        self.text = text
+        self.is_buffer = not isinstance(text, str)
+        self.types = array('i')
+        self.offsets = array('i')
+        self.lengths = array('i')
+        self.values = {}
+        self.line_starts = array('i', [0])
+        self.line_numbers = array('i', [1])
+
+    def append(self, token_type, value, line, column, offset):
+        index = len(self.types)
+        self.types.append(token_type.value)
+        self.offsets.append(offset)
+        source = value.encode('utf-8') if self.is_buffer else value
+        if self.text[offset:offset + len(source)] == source:
+            self.lengths.append(len(source))
+        else:
+            self.lengths.append(0)
+            self.values[index] = value
+        if line != self.line_numbers[-1]:
+            self.line_starts.append(offset - column + 1)
+            self.line_numbers.append(line)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.types)
+        value = self.values.get(index)
+        if value is None:
+            offset = self.offsets[index]
+            value = self.text[offset:offset + self.lengths[index]]
+            if self.is_buffer:
+                value = value.decode('utf-8')
+        return PackedToken(TOKEN_TYPES[self.types[index]], value, self, index)
+
+    def location(self, index):
+        offset = self.offsets[index]
+        line = bisect.bisect_right(self.line_starts, offset) - 1
+        if self.is_buffer:
+            return Location(self.filename, self.line_numbers[line], character_column(self.text, self.line_starts[line], offset))
+        return Location(self.filename, self.line_numbers[line], offset - self.line_starts[line] + 1)
+
+def lex_packed(state: LexerState) -> PackedTokens:
+    """
+    Lexes all tokens up to and including EOF into PackedTokens.
+    """
+    tokens = PackedTokens(state.filename, state.text)
+    while True:
+        token = _lex(state)
+        tokens.append(*token)
+        if token[0] == TokenType.EOF:
+            return tokens
+
+def lex_range(state: LexerState, stop_offsets):
+    """
+    Lexes tokens until EOF or a token that starts at one of stop_offsets outside any
+    parenthesis, which is replaced by EOF. Returns the tokens, the offset of each and the
+    offset lexing stopped at, or None at the end of the text.
+    """
+    tokens = []
+    offsets = []
+    while True:
+        paren_stack = state.paren_stack
+        token_type, token_value, line, column, offset = _lex(state)
+        stop = offset in stop_offsets and paren_stack == 0 and token_type != TokenType.SEMICOLON
+        if stop:
+            token_type, token_value = TokenType.EOF, "<end of file>"
+        tokens.append(Token(token_type, token_value, Location(state.filename, line, column)))
+        offsets.append(offset)
+        if token_type == TokenType.EOF:
+            return tokens, offsets, offset if stop else None
+
+TOKEN_TYPES = {token_type.value: token_type for token_type in TokenType}
+
 INSERT_IMPLICIT_SEMICOLON = (TokenType.CONTINUE, TokenType.BREAK, TokenType.RETURN, TokenType.RPAREN,
                              TokenType.FLOAT, TokenType.INT, TokenType.STRING, TokenType.IDENTIFIER,
                              TokenType.PASS, TokenType.RBRACKET, TokenType.IMPORT, TokenType.BOOL,
@@ -161,59 +312,176 @@ INSERT_IMPLICIT_SEMICOLON = (TokenType.CONTINUE, TokenType.BREAK, TokenType.RETU
 REGEX_CAN_FOLLOW = (TokenType.ASSIGN, TokenType.CASE, TokenType.RETURN, TokenType.ASSERT, TokenType.BREAK, TokenType.CONTINUE,
                     TokenType.LPAREN, TokenType.LBRACKET, TokenType.LBRACE, TokenType.OPERATOR)
 
-def _make_token_regex():
-    token_patterns = [
-        (r'[ \t]+|//.*(?=\n)', 'IGNORE'),  # Ignore whitespace
-        (r'\btrue|false\b', TokenType.BOOL.name),
-        (r'\d+\.\d+', TokenType.FLOAT.name),
-        (r'\b0b[_01]+|0x[\d_0-9a-fA-F]+|[\d_]+\b', TokenType.INT.name),
-        (r'\'(?:\\.|[^\'])*\'|"(?:\\.|[^"])*"', TokenType.STRING.name),
-        (r'\[', TokenType.LBRACKET.name),
-        (r'\]', TokenType.RBRACKET.name),
-        (r'\{', TokenType.LBRACE.name),
-        (r'\}', TokenType.RBRACE.name),
-        (r',', TokenType.COMMA.name),
-        (r'#([a-zA-Z_][a-zA-Z0-9_]*|\'(?:\\.|[^\'])*\'|"(?:\\.|[^"])*")', TokenType.SYMBOL.name),
-        (r'\bif\b', TokenType.IF.name),
-        (r'\bnull\b', TokenType.NULL.name),
-        (r'\belse\b', TokenType.ELSE.name),
-        (r'\btype\b', TokenType.TYPE.name),
-        (r'\bmatch\b', TokenType.MATCH.name),
-        (r'\bcase\b', TokenType.CASE.name),
-        (r'\bcast\b', TokenType.CAST.name),
-        (r'\blet\b', TokenType.LET.name),
-        (r'\bunion\b', TokenType.UNION.name),
-        (r'\bon\b', TokenType.ON.name),
-        (r'\(', TokenType.LPAREN.name),
-        (r'\)', TokenType.RPAREN.name),
-        (r'\bassert\b', TokenType.ASSERT.name),
-        (r'\breturn\b', TokenType.RETURN.name),
-        (r'\bimplicit\b', TokenType.IMPLICIT.name),
-        (r'\bwhile\b', TokenType.WHILE.name),
-        (r'\bfor\b', TokenType.FOR.name),
-        (r'\bin\b', TokenType.IN.name),
-        (r'\bcontinue\b', TokenType.CONTINUE.name),
-        (r'\bbreak\b', TokenType.BREAK.name),
-        (r'\bpass\b', TokenType.PASS.name),
-        (r'\.\.|\+|-|\*|/|%|<<|>>|\||\^|&|<=|==|!=|>=|<|>|~|\bnot\b|\band\b|\bor\b', TokenType.OPERATOR.name),
-        (r'=', TokenType.ASSIGN.name),
-        (r':', TokenType.COLON.name),
-        (r';', TokenType.SEMICOLON.name),
-        (r'\.', TokenType.DOT.name),
-        (r'\?', TokenType.QUESTION.name),
-        (r'!', TokenType.EXCLAMATION.name),
-        (r'\bwhere\b', TokenType.WHERE.name),
-        (r'\bexport\b', TokenType.EXPORT.name),
-        (r'import[ \t]+[^\s]+', TokenType.IMPORT.name),
-        (r'[a-zA-Z_][a-zA-Z0-9_]*', TokenType.IDENTIFIER.name),
-        (r'\n([ \t]*\n)*', 'NEWLINE'),
-        (r'[^\s]+', 'ERROR'),
-    ]
-
-    return re.compile('|'.join('(?P<%s>%s)' % (pair[1], pair[0]) for pair in token_patterns))
-TOKEN_REGEX = _make_token_regex()
+# Token kinds that are not returned to the parser
+IGNORE = 'IGNORE'
+NEWLINE = 'NEWLINE'
+
+DIGITS = '0123456789'
+WORD_START = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_'
+
+# The token patterns in order of priority. The third element holds the characters a match
+# can start with (None if any), which is used to dispatch on the first character, see
+# scan_table. Patterns starting with a letter or underscore are handled by scan_word.
+TOKEN_PATTERNS = [
+    (r'[ \t\r]+|//.*(?=\n|\Z)', IGNORE, ' \t\r/'),  # Ignore whitespace
+    (r'\btrue|false\b', TokenType.BOOL, 'tf'),
+    (r'\d+\.\d+', TokenType.FLOAT, DIGITS),
+    (r'\b0b[_01]+|0x[\d_0-9a-fA-F]+|[\d_]+\b', TokenType.INT, DIGITS + '_'),
+    (r'\'(?:\\.|[^\'])*\'|"(?:\\.|[^"])*"', TokenType.STRING, '\'"'),
+    (r'\[', TokenType.LBRACKET, '['),
+    (r'\]', TokenType.RBRACKET, ']'),
+    (r'\{', TokenType.LBRACE, '{'),
+    (r'\}', TokenType.RBRACE, '}'),
+    (r',', TokenType.COMMA, ','),
+    (r'#([a-zA-Z_][a-zA-Z0-9_]*|\'(?:\\.|[^\'])*\'|"(?:\\.|[^"])*")', TokenType.SYMBOL, '#'),
+    (r'\bif\b', TokenType.IF, 'i'),
+    (r'\bnull\b', TokenType.NULL, 'n'),
+    (r'\belse\b', TokenType.ELSE, 'e'),
+    (r'\btype\b', TokenType.TYPE, 't'),
+    (r'\bmatch\b', TokenType.MATCH, 'm'),
+    (r'\bcase\b', TokenType.CASE, 'c'),
+    (r'\bcast\b', TokenType.CAST, 'c'),
+    (r'\blet\b', TokenType.LET, 'l'),
+    (r'\bunion\b', TokenType.UNION, 'u'),
+    (r'\bon\b', TokenType.ON, 'o'),
+    (r'\(', TokenType.LPAREN, '('),
+    (r'\)', TokenType.RPAREN, ')'),
+    (r'\bassert\b', TokenType.ASSERT, 'a'),
+    (r'\breturn\b', TokenType.RETURN, 'r'),
+    (r'\bimplicit\b', TokenType.IMPLICIT, 'i'),
+    (r'\bwhile\b', TokenType.WHILE, 'w'),
+    (r'\bfor\b', TokenType.FOR, 'f'),
+    (r'\bin\b', TokenType.IN, 'i'),
+    (r'\bcontinue\b', TokenType.CONTINUE, 'c'),
+    (r'\bbreak\b', TokenType.BREAK, 'b'),
+    (r'\bpass\b', TokenType.PASS, 'p'),
+    (r'\.\.|\+|-|\*|/|%|<<|>>|\||\^|&|<=|==|!=|>=|<|>|~|\bnot\b|\band\b|\bor\b', TokenType.OPERATOR, '.+-*/%<>|^&=!~nao'),
+    (r'=', TokenType.ASSIGN, '='),
+    (r':', TokenType.COLON, ':'),
+    (r';', TokenType.SEMICOLON, ';'),
+    (r'\.', TokenType.DOT, '.'),
+    (r'\?', TokenType.QUESTION, '?'),
+    (r'!', TokenType.EXCLAMATION, '!'),
+    (r'\bwhere\b', TokenType.WHERE, 'w'),
+    (r'\bexport\b', TokenType.EXPORT, 'e'),
+    (r'import[ \t]+[^\s]+', TokenType.IMPORT, 'i'),
+    (r'[a-zA-Z_][a-zA-Z0-9_]*', TokenType.IDENTIFIER, WORD_START),
+    (r'\n([ \t]*\n)*', NEWLINE, '\n'),
+    (r'[^\s]+', TokenType.ERROR, None),
+]
+
+def kind_name(kind):
+    return kind if type(kind) == str else kind.name
+
+TOKEN_REGEX = re.compile('|'.join('(?P<%s>%s)' % (kind_name(kind), pattern) for pattern, kind, _first in TOKEN_PATTERNS))
 REGEX_REGEX = re.compile(r'(?P<REGEX>/([^/\\]+(?:\\.[^/\\]*)*)/)')
+TOKEN_REGEX_BYTES = re.compile(TOKEN_REGEX.pattern.encode('ascii'))
+REGEX_REGEX_BYTES = re.compile(REGEX_REGEX.pattern.encode('ascii'))
+KINDS_BY_NAME = {kind_name(kind): kind for _pattern, kind, _first in TOKEN_PATTERNS}
+
+
+def scan_regex(text, index):
+    """
+    Finds the next token by trying every token pattern in turn, using one big
+    alternation. Returns the kind of token and where it ends.
+    """
+    match = TOKEN_REGEX.match(text, index)
+    assert match is not None, text[index:index + 10]
+    return KINDS_BY_NAME[match.lastgroup], match.end()
+
+
+def scan_bytes(text, index):
+    """
+    Like scan_regex, for text that is a bytes-like buffer.
+    """
+    match = TOKEN_REGEX_BYTES.match(text, index)
+    assert match is not None, text[index:index + 10]
+    return KINDS_BY_NAME[match.lastgroup], match.end()
+
+
+# Words that are tokens of their own when they are not part of a longer word
+KEYWORDS = {pattern[2:-2]: kind for pattern, kind, _first in TOKEN_PATTERNS if re.fullmatch(r'\\b[a-z]+\\b', pattern)}
+KEYWORDS.update({'not': TokenType.OPERATOR, 'and': TokenType.OPERATOR, 'or': TokenType.OPERATOR})
+
+def _make_scanner(is_buffer):
+    """
+    Returns the scan_word and scan_table functions for text that is a str, or for text
+    that is a bytes-like buffer (see LexerState), for which the patterns are bytes and
+    the table is indexed by byte values.
+    """
+    encode = (lambda s: s.encode('ascii')) if is_buffer else (lambda s: s)
+    key = ord if is_buffer else (lambda char: char)
+    # NOTE: \w only matches ASCII in bytes, thus any byte of a non-ASCII character counts
+    #       as part of a word, which is what str patterns do for letters.
+    word_char = re.compile(encode(r'[\w\x80-\xff]' if is_buffer else r'\w'))
+    word_regex = re.compile(encode(r'[a-zA-Z_][a-zA-Z0-9_]*'))
+    underscore_int_regex = re.compile(encode(r'[\d_]+\b'))
+    import_regex = re.compile(encode(r'import[ \t]+[^\s]+'))
+    keywords = {encode(word): kind for word, kind in KEYWORDS.items()}
+    word_start = set(key(char) for char in WORD_START)
+    underscore = key('_')
+    true, false, import_ = encode('true'), encode('false'), encode('import')
+    fallback = scan_bytes if is_buffer else scan_regex
+
+    def scan_word(text, index):
+        """
+        Finds the next token when it starts with a letter or underscore. Mirrors how the
+        alternation in TOKEN_REGEX treats words, including where it checks for word boundaries.
+        """
+        boundary_before = index == 0 or not word_char.match(text, index - 1)
+        if boundary_before and text[index:index + 4] == true:
+            return TokenType.BOOL, index + 4
+        if text[index:index + 5] == false and not word_char.match(text, index + 5):
+            return TokenType.BOOL, index + 5
+        if text[index] == underscore:
+            match = underscore_int_regex.match(text, index)
+            if match:
+                return TokenType.INT, match.end()
+
+        end = word_regex.match(text, index).end()
+        if boundary_before and not word_char.match(text, end):
+            kind = keywords.get(text[index:end])
+            if kind is not None:
+                return kind, end
+        if text[index:index + 6] == import_:
+            match = import_regex.match(text, index)
+            if match:
+                return TokenType.IMPORT, match.end()
+        return TokenType.IDENTIFIER, end
+
+    # For each character, either the kind of token it always is on its own, or the
+    # alternation of the token patterns that can start with it
+    chars = set(''.join(first for _pattern, _kind, first in TOKEN_PATTERNS if first is not None))
+    table = {}
+    for char in chars - set(WORD_START):
+        candidates = [(pattern, kind) for pattern, kind, first in TOKEN_PATTERNS if first is None or char in first]
+        if candidates[0][0] == re.escape(char):
+            table[key(char)] = candidates[0][1]
+        else:
+            table[key(char)] = re.compile(encode('|'.join('(?P<%s>%s)' % (kind_name(kind), pattern) for pattern, kind in candidates)))
+
+    def scan_table(text, index):
+        """
+        Like scan_regex, but dispatches on the first character of the token, such that only
+        the patterns that can match are tried. Keywords are found by scanning a word and
+        looking it up.
+        """
+        char = text[index]
+        if char in word_start:
+            return scan_word(text, index)
+        entry = table.get(char)
+        if entry is None:
+            return fallback(text, index)
+        if type(entry) == TokenType:
+            return entry, index + 1
+        match = entry.match(text, index)
+        assert match is not None, text[index:index + 10]
+        return KINDS_BY_NAME[match.lastgroup], match.end()
+
+    return scan_word, scan_table
 
+scan_word, scan_table = _make_scanner(False)
+scan_word_bytes, scan_table_bytes = _make_scanner(True)
 
 if __name__ == '__main__':
     code = """
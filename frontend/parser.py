@@ -1,33 +1,45 @@
 import os
+import mmap
+import hashlib
+import functools
 import frontend.lexer as lexer
 import frontend.astnodes as ast
-import copy
+import frontend.reparser as reparser
+import frontend.picklecache as picklecache
 from frontend.reparser import parse_regex
 
+def lex_all(lexer_state):
+    tokens = []
+    while True:
+        tokens.append(lexer.lex(lexer_state))
+        if tokens[-1].type == lexer.TokenType.EOF:
+            return tokens
+
 class ParserState:
-    def __init__(self, filename, text):
-        self.lexer = lexer.LexerState(filename, text)
-        self.token = lexer.lex(self.lexer)
-        self.queue = [lexer.lex(self.lexer)]
+    def __init__(self, filename, text, packed_tokens=False, tokens=None):
+        self.filename = filename
+        # All tokens of the file, ending with EOF, and the index of the current token. Packed
+        # tokens use less memory, see lexer.PackedTokens. Reparsing passes in the tokens of
+        # the part of the file to reparse.
+        if tokens is None:
+            lexer_state = lexer.LexerState(filename, text)
+            tokens = lexer.lex_packed(lexer_state) if packed_tokens else lex_all(lexer_state)
+        self.tokens = tokens
+        self.index = 0
+        self.token = self.tokens[0]
         self.errors = []
 
-def parser_copy(parser):
-    return copy.deepcopy(parser)
-
-def parser_commit(dst, src):
-    dst.lexer = src.lexer
-    dst.token = src.token
-    dst.queue = src.queue[:]
-    dst.errors = src.errors
-
-def enqueue_token(parser, token_type, token_value):
-    parser.queue.insert(0, parser.token)
-    parser.token = lexer.Token(token_type, token_value, parser.token.location)
+def peek(parser, offset=1):
+    """
+    Returns the token offset tokens after the current one.
+    """
+    return parser.tokens[min(parser.index + offset, len(parser.tokens) - 1)]
 
 def advance(parser):
-    parser.token = parser.queue.pop(0)
-    if len(parser.queue) == 0:
-        parser.queue.append(lexer.lex(parser.lexer))
+    # Past the end, keep returning EOF like the lexer does
+    if parser.index < len(parser.tokens) - 1:
+        parser.index += 1
+    parser.token = parser.tokens[parser.index]
 
 def error(parser, msg):
     parser.errors.append(ast.SyntaxError(parser.token.location, msg, parser.token.value))
@@ -49,7 +61,7 @@ def see(parser, tok0, tok1=None, *, value=None):
     elif tok1 == None and value != None:
         return parser.token.type == tok0 and parser.token.value == value
     else:
-        return parser.token.type == tok0 and parser.queue[0].type == tok1
+        return parser.token.type == tok0 and peek(parser).type == tok1
 
 
 
@@ -66,6 +78,9 @@ OPERATOR_PRECEDENCE_TABLE = {"..": 0,
                              "**": 10,
                              "else": 11}
 MAX_PRECEDENECE = max(OPERATOR_PRECEDENCE_TABLE.values())
+PREFIX_OPERATOR_PRECEDENCE_TABLE = {"not": 2,
+                                    "+": 12, "-": 12, "~": 12, "&": 12, "*": 12}
+BINARY_OPERATOR_TOKENS = (lexer.TokenType.OPERATOR, lexer.TokenType.ELSE)
 
 def parse_typeexpr_tupletype(parser):
     location = parser.token.location
@@ -75,7 +90,7 @@ def parse_typeexpr_tupletype(parser):
     named = []
     parse_positional = True
     error_emitted = False
-    while parser.token.type != lexer.TokenType.RPAREN:
+    while parser.token.type not in (lexer.TokenType.RPAREN, lexer.TokenType.EOF):
         if see(parser, lexer.TokenType.IDENTIFIER, lexer.TokenType.COLON):
             names.append(parser.token.value)
             advance(parser)
@@ -116,7 +131,7 @@ def parse_typeexpr_wo_union(parser):
         advance(parser)
         argtys = []
         argnames = []
-        while parser.token.type != lexer.TokenType.RPAREN:
+        while parser.token.type not in (lexer.TokenType.RPAREN, lexer.TokenType.EOF):
             argtys.append(parse_typeexpr(parser))
             argnames.append(parser.token.value)
             expect(parser, lexer.TokenType.IDENTIFIER, "Expected argument name")
@@ -164,7 +179,7 @@ def parse_expr_array(parser):
     location = parser.token.location
     expect(parser, lexer.TokenType.LBRACKET, "Expected '(' to begin tuple-type")
     elems = []
-    while parser.token.type != lexer.TokenType.RBRACKET:
+    while parser.token.type not in (lexer.TokenType.RBRACKET, lexer.TokenType.EOF):
         elems.append(parse_expr(parser, trailing_block_permitted=False))
         if see(parser, lexer.TokenType.COMMA):
             advance(parser)
@@ -182,7 +197,7 @@ def parse_expr_tuple(parser, only_named=False):
     named = []
     parse_positional = not only_named
     error_emitted = False
-    while parser.token.type != lexer.TokenType.RPAREN:
+    while parser.token.type not in (lexer.TokenType.RPAREN, lexer.TokenType.EOF):
         if see(parser, lexer.TokenType.IDENTIFIER, lexer.TokenType.COLON):
             names.append(parser.token.value)
             advance(parser)
@@ -342,22 +357,22 @@ def parse_expr_primary(parser, trailing_block_permitted):
     return expr
 
 def parse_expr_unary(parser, precedence, trailing_block_permitted):
-    location = parser.token.location
-    max_prec = 12
-    table = {2: ['not'], 12: ["+", "-", "~", '&', '*']}#, ':+', ':~', ':-', '.+', '.-', '.*', '.and', '.or', ':not']}
-
-    if parser.token.value in table.get(precedence, []):
-        op = parser.token.value
+    # A prefix operator is permitted if it binds at least as tightly as the surrounding
+    # binary operator, and its operand may only contain prefix operators that bind at
+    # least as tightly as itself.
+    operators = []
+    while PREFIX_OPERATOR_PRECEDENCE_TABLE.get(parser.token.value, -1) >= precedence:
+        operators.append((parser.token.value, parser.token.location))
+        precedence = PREFIX_OPERATOR_PRECEDENCE_TABLE[parser.token.value]
         advance(parser)
-        operand = parse_expr_unary(parser, precedence, trailing_block_permitted)
-        return ast.UnaryOpExpr(op, operand, location=location)
-    elif precedence < max_prec:
-        return parse_expr_unary(parser, precedence + 1, trailing_block_permitted)
-    return parse_expr_primary(parser, trailing_block_permitted)
+    expr = parse_expr_primary(parser, trailing_block_permitted)
+    for op, location in reversed(operators):
+        expr = ast.UnaryOpExpr(op, expr, location=location)
+    return expr
 
 def parse_expr_binary(parser, precedence, trailing_block_permitted):
     left = parse_expr_unary(parser, precedence, trailing_block_permitted)
-    while (see(parser, lexer.TokenType.OPERATOR) or see(parser, lexer.TokenType.ELSE)) and OPERATOR_PRECEDENCE_TABLE[parser.token.value] >= precedence:
+    while parser.token.type in BINARY_OPERATOR_TOKENS and OPERATOR_PRECEDENCE_TABLE[parser.token.value] >= precedence:
         location = parser.token.location
         op = parser.token.value
         advance(parser)
@@ -433,7 +448,7 @@ def parse_stmt_block(parser):
     location = parser.token.location
     expect(parser, lexer.TokenType.LBRACE, "Expected block statement")
     stmts = []
-    while parser.token.type != lexer.TokenType.RBRACE:
+    while parser.token.type not in (lexer.TokenType.RBRACE, lexer.TokenType.EOF):
         stmt = parse_stmt(parser)
         if type(stmt) != ast.PassStmt:
             stmts.append(stmt)
@@ -455,7 +470,7 @@ def parse_top_type_constructor(parser):
         expect(parser, lexer.TokenType.LPAREN, "Expected '('")
         field_types = []
         field_names = []
-        while parser.token.type != lexer.TokenType.RPAREN:
+        while parser.token.type not in (lexer.TokenType.RPAREN, lexer.TokenType.EOF):
             field_types.append(parse_typeexpr(parser))
             field_names.append(parser.token.value)
             expect(parser, lexer.TokenType.IDENTIFIER, "Expected field name")
@@ -517,12 +532,12 @@ def parse_top(parser):
         advance(parser)
 
         # General/long form
-        if parser.queue[0].type == lexer.TokenType.LBRACE:
+        if peek(parser).type == lexer.TokenType.LBRACE:
             tyname = parser.token.value
             ctors = []
             expect(parser, lexer.TokenType.IDENTIFIER, "Expected type name")
             expect(parser, lexer.TokenType.LBRACE, "Expected '{' to begin type definition")
-            while parser.token.type != lexer.TokenType.RBRACE:
+            while parser.token.type not in (lexer.TokenType.RBRACE, lexer.TokenType.EOF):
                 ctors.append(parse_top_type_constructor(parser))
             expect(parser, lexer.TokenType.RBRACE, "Expected '}' to end type definition")
             expect(parser, lexer.TokenType.SEMICOLON, "Expected ';' to end type definition")
@@ -553,7 +568,7 @@ def parse_top(parser):
             argtys = []
             argnames = []
             implicit_arg_permitted = True
-            while parser.token.type != lexer.TokenType.RPAREN:
+            while parser.token.type not in (lexer.TokenType.RPAREN, lexer.TokenType.EOF):
                 implicit = False
                 if implicit_arg_permitted:
                     if see(parser, lexer.TokenType.IMPLICIT):
@@ -578,17 +593,18 @@ def parse_top(parser):
             expect(parser, lexer.TokenType.SEMICOLON, "Expected ';' to end function definition")
             return ast.FunctionDef(export, ty, name, argtys_implicit, argnames_implicit, argtys, argnames, body, location=location)
 
-def parse_module(parser, filename, main_module):
-    defs = []
+IMPLICIT_IMPORTS = ["string", "symbol", "context", "range"]
 
-    if '__builtins__' not in filename:
-        implicit_imports = ["string", "symbol", "context", "range"]
-        for name in implicit_imports:
-            defs.append(ast.ImportDef("__builtins__/%s.ce" % name, 'implicit', None, location=None))
-    
+def implicit_imports(filename):
+    if '__builtins__' in filename:
+        return []
+    return [ast.ImportDef("__builtins__/%s.ce" % name, 'implicit', None, location=None) for name in IMPLICIT_IMPORTS]
+
+def parse_module(parser, filename, main_module):
+    defs = implicit_imports(filename)
     while not see(parser, lexer.TokenType.EOF):
         defs.append(parse_top(parser))
-    return ast.ModuleDef(parser.lexer.filename, defs, main_module=main_module)
+    return ast.ModuleDef(parser.filename, defs, main_module=main_module)
 
 
 def parse_text(full_filename, filename, text, main_module):
@@ -597,10 +613,204 @@ def parse_text(full_filename, filename, text, main_module):
     assert parser.errors == [], parser.errors
     return module_ast
 
-def parse_file(full_filename, filename, main_module):
-    with open(full_filename) as f:
-        text = f.read()
-        return parse_text(full_filename, filename, text, main_module)
+@functools.cache
+def parser_fingerprint():
+    h = hashlib.blake2b(digest_size=16)
+    for module in (lexer, ast, reparser):
+        with open(module.__file__, 'rb') as f:
+            h.update(f.read())
+    with open(__file__, 'rb') as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+def module_key(full_filename, filename, source_hash, main_module):
+    """
+    Returns the key of a parsed module in a cache (see picklecache.PickleCache), which
+    covers everything the result depends on: the module's path and the hash of its
+    content, whether it is the main module, the builtins it implicitly imports and the
+    source of the parser. Like cparser.header_key.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    imports = [node.filename for node in implicit_imports(filename)]
+    for part in (parser_fingerprint(), os.path.abspath(full_filename), filename, source_hash, repr(main_module), repr(imports)):
+        h.update(part.encode('utf-8'))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def parse_file(full_filename, filename, main_module, cache=None, mapped=False):
+    """
+    Parses a file, or loads it from the 'modules' entries of the cache, a
+    picklecache.PickleCache. A mapped file is lexed in place from a memory map into
+    packed tokens, rather than read into a string, which keeps the memory used for very
+    large (generated) files down. The result is the same either way.
+    """
+    with open(full_filename, 'rb') as f:
+        # NOTE: Empty files can't be mapped
+        if mapped and os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return parse_data(full_filename, filename, data, main_module, cache)
+        data = f.read()
+    return parse_data(full_filename, filename, data, main_module, cache)
+
+def parse_data(full_filename, filename, data, main_module, cache):
+    key = module_key(full_filename, filename, picklecache.source_hash(data), main_module) if cache is not None else None
+    module_ast = cache.load('modules', key) if cache is not None else None
+    if module_ast is None:
+        if isinstance(data, mmap.mmap):
+            parser = ParserState(filename, data, packed_tokens=True)
+            module_ast = parse_module(parser, filename, main_module)
+            assert parser.errors == [], parser.errors
+        else:
+            # Translate newlines like when reading the file in text mode
+            text = data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+            module_ast = parse_text(full_filename, filename, text, main_module)
+        if cache is not None:
+            cache.store('modules', key, module_ast)
+    return module_ast
+
+
+class ParsedModule:
+    """
+    A module parsed by parse_text_incremental, which remembers the source span of each of
+    its top-level definitions, such that reparse_text only reparses the definitions that
+    an edit touches.
+    """
+    def __init__(self, filename, text, module, spans):
+        self.filename = filename
+        self.text = text
+        self.module = module
+        # (start, end, hash) of each definition after the implicit imports, where end is
+        # the start of the next definition
+        self.spans = spans
+
+def definition_hash(text, start, end):
+    # Trailing whitespace (and the implicit semicolon it may end with) doesn't change the definition
+    return hashlib.sha1(text[start:end].rstrip().encode('utf-8')).digest()
+
+def parse_definitions(filename, text, start, line, stop_offsets):
+    """
+    Parses the top-level definitions from start, where a definition begins at line, until
+    the end of the text or a definition that begins at one of stop_offsets. Returns the
+    definitions, their spans, where parsing stopped (None at the end) and the errors.
+    """
+    lexer_state = lexer.LexerState(filename, text, index=start, line=line)
+    tokens, offsets, stop = lexer.lex_range(lexer_state, stop_offsets)
+    parser = ParserState(filename, text, tokens=tokens)
+    defs = []
+    starts = []
+    while not see(parser, lexer.TokenType.EOF):
+        starts.append(offsets[parser.index])
+        defs.append(parse_top(parser))
+    ends = starts[1:] + [len(text) if stop is None else stop]
+    spans = [(start, end, definition_hash(text, start, end)) for start, end in zip(starts, ends)]
+    return defs, spans, stop, parser.errors
+
+def parse_text_incremental(full_filename, filename, text, main_module):
+    defs, spans, _stop, errors = parse_definitions(filename, text, 0, 1, {})
+    assert errors == [], errors
+    module_ast = ast.ModuleDef(filename, implicit_imports(filename) + defs, main_module=main_module)
+    return ParsedModule(filename, text, module_ast, spans)
+
+def shift_lines(node, line_delta):
+    """
+    Moves the locations in the AST below node line_delta lines.
+    """
+    visited = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, ast.ASTNode) and id(node) not in visited:
+            visited.add(id(node))
+            if node.location is not None:
+                node.location = ast.Location(node.location.filename, node.location.line + line_delta, node.location.column)
+            stack.extend(getattr(node, name) for name in node.__match_args__)
+
+def common_prefix_length(a, b, chunk_size=4096):
+    # Compare chunks first, as comparing slices is much faster than comparing characters
+    length = 0
+    limit = min(len(a), len(b))
+    while length < limit and a[length:length + chunk_size] == b[length:length + chunk_size]:
+        length += chunk_size
+    length = min(length, limit)
+    while length < limit and a[length] == b[length]:
+        length += 1
+    return length
+
+def common_suffix_length(a, b, limit, chunk_size=4096):
+    length = 0
+    while length < limit and a[max(len(a) - length - chunk_size, 0):len(a) - length] == b[max(len(b) - length - chunk_size, 0):len(b) - length]:
+        length += chunk_size
+    length = min(length, limit)
+    while length < limit and a[-1 - length] == b[-1 - length]:
+        length += 1
+    return length
+
+def reparse_text(parsed, text):
+    """
+    Updates parsed, a ParsedModule, to the new text of the file. Only the definitions that
+    the change touches are reparsed and spliced into parsed.module.defs, the others keep
+    their identity (with locations moved if lines were added or removed before them).
+    Returns the reparsed definitions.
+    """
+    old_text = parsed.text
+    old_spans = parsed.spans
+    if text == old_text:
+        return []
+    prefix = common_prefix_length(old_text, text)
+    suffix = common_suffix_length(old_text, text, min(len(old_text), len(text)) - prefix)
+    offset_delta = len(text) - len(old_text)
+    line_delta = text.count('\n', prefix, len(text) - suffix) - old_text.count('\n', prefix, len(old_text) - suffix)
+
+    # Definitions that end before the change are kept. One that ends where the change starts
+    # is not, as what is inserted there becomes part of its span. The last definition ends
+    # at the end of the file, so what is appended to it may change how it is lexed.
+    first = 0
+    while first < len(old_spans) - 1 and old_spans[first][1] < prefix:
+        first += 1
+    start = old_spans[first - 1][1] if first > 0 else 0
+
+    # Definitions after the change are kept if reparsing gets to one of them. Their first
+    # line must be unchanged, as the columns of their locations would change otherwise.
+    unchanged_from = len(old_text) - suffix
+    stop_offsets = {}
+    for i in range(first, len(old_spans)):
+        old_start = old_spans[i][0]
+        if old_start >= unchanged_from and old_text.rfind('\n', 0, old_start) >= unchanged_from:
+            stop_offsets[old_start + offset_delta] = i
+
+    line = text.count('\n', 0, start) + 1
+    defs, spans, stop, errors = parse_definitions(parsed.filename, text, start, line, stop_offsets)
+    if errors and stop is not None:
+        # The change may have made the definition it is in continue into the next one
+        defs, spans, stop, errors = parse_definitions(parsed.filename, text, start, line, {})
+    assert errors == [], errors
+    last = len(old_spans) if stop is None else stop_offsets[stop]
+
+    # Reparsed definitions that are the same as before keep their identity as well
+    num_implicit = len(parsed.module.defs) - len(old_spans)
+    old_defs = parsed.module.defs[num_implicit:]
+    unchanged = {old_spans[i][2]: old_defs[i] for i in range(first, last)}
+    reparsed = []
+    for i, (definition, span) in enumerate(zip(defs, spans)):
+        old_definition = unchanged.get(span[2])
+        if old_definition is not None and old_definition.location == definition.location:
+            defs[i] = old_definition
+        else:
+            reparsed.append(definition)
+
+    kept_spans = []
+    for i in range(last, len(old_spans)):
+        old_start, old_end, digest = old_spans[i]
+        if line_delta != 0:
+            shift_lines(old_defs[i], line_delta)
+        kept_spans.append((old_start + offset_delta, old_end + offset_delta, digest))
+
+    parsed.module.defs[num_implicit + first:num_implicit + last] = defs
+    parsed.spans = old_spans[:first] + spans + kept_spans
+    parsed.text = text
+    return reparsed
 
 if __name__ == '__main__':
     def test(code, ast, fn):
@@ -0,0 +1,59 @@
+import os
+import io
+import pickle
+import hashlib
+
+
+def source_hash(data):
+    """
+    The hash of a source file's content, which cache keys are made of.
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class PickleCache:
+    """
+    Pickled values stored as one file per entry, in a directory per kind of entry. A
+    missing, truncated or otherwise unreadable entry is a cache miss. A directory of None
+    disables the cache.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, kind, key):
+        return os.path.join(self.directory, kind, key + '.pickle')
+
+    def load(self, kind, key, unpickler=pickle.Unpickler):
+        data = self.load_bytes(kind, key)
+        if data is None:
+            return None
+        # NOTE: A corrupt pickle can fail to load in about any way
+        try:
+            return unpickler(io.BytesIO(data)).load()
+        except Exception:
+            return None
+
+    def store(self, kind, key, value, pickler=pickle.Pickler):
+        f = io.BytesIO()
+        pickler(f, pickle.HIGHEST_PROTOCOL).dump(value)
+        self.store_bytes(kind, key, f.getvalue())
+
+    def load_bytes(self, kind, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self.path(kind, key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def store_bytes(self, kind, key, data):
+        if self.directory is None:
+            return
+        os.makedirs(os.path.join(self.directory, kind), exist_ok=True)
+        # Write to a temporary file first, such that an interrupted write never
+        # leaves a truncated entry behind.
+        tmp_filename = self.path(kind, key) + '.%d.tmp' % os.getpid()
+        with open(tmp_filename, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_filename, self.path(kind, key))
@@ -0,0 +1,113 @@
+"""
+Builds and runs programs that use the arrays of the generated C code (see BUILTINS in
+backend/ccodegen.py), and checks what they print:
+
+- An array that shares the data of an array literal, string literal or the string pool
+  is copied before it is appended to, even when it has room to spare after a pop, such
+  that the other array, and the read-only data, are left unchanged.
+- Appending to, reserving and shrinking arrays that own their data.
+- Reserving a negative capacity, or one that doesn't fit the array's capacity field,
+  aborts the program rather than making the array smaller than its capacity says.
+
+Usage: python3 test/check_arrays.py [--cc gcc] [--string-pool-format literal]
+"""
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TEST_DIR))
+import cedar
+
+RESERVE = """import stdio.h
+import stdlib.h
+
+int main(int argc, byte** argv) {
+    let a = [1]
+    a.reserve(cast(i64) stdlib.atol(cstring("%s")))
+    a.append(2)
+    stdio.printf("%%d\\n", a.length)
+    return 0
+}
+"""
+
+# The programs, with what they should print, or None if they should abort
+PROGRAMS = [
+    ("alias, pop and append", """import stdio.h
+
+int main(int argc, byte** argv) {
+    let a = [1, 2, 3]
+    let b = a
+    b.pop()
+    b.append(9)
+    stdio.printf("%d %d %d / %d %d %d\\n", a[0], a[1], a[2], b[0], b[1], b[2])
+    return 0
+}
+""", "1 2 3 / 1 2 9\n"),
+    ("string data", """import stdio.h
+
+int main(int argc, byte** argv) {
+    for i in 0..2 {
+        let s = "abc"
+        let data = s.data
+        data.pop()
+        data.append(char("x"))
+        stdio.printf("%c%c%c ", s.data[0], s.data[1], s.data[2])
+    }
+    stdio.printf("\\n")
+    return 0
+}
+""", "abc abc \n"),
+    ("owned arrays", """import stdio.h
+
+int main(int argc, byte** argv) {
+    let a = [0]
+    a.reserve(100)
+    for i in 1..50 {
+        a.append(i)
+    }
+    a.shrink_to_fit()
+    a.append(50)
+    let sum = 0
+    for i in 0..a.length {
+        sum = sum + a[i]
+    }
+    stdio.printf("%d %d\\n", a.length, sum)
+    return 0
+}
+""", "51 1275\n"),
+    ("negative capacity", RESERVE % "-1", None),
+    ("too large capacity", RESERVE % "2147483648", None),
+]
+
+
+def build_and_run(directory, cc, string_pool_format, code):
+    with open(os.path.join(directory, "main.ce"), "w") as f:
+        f.write(code)
+    executable = os.path.join(directory, "main")
+    args = cedar.build_argparser().parse_args([os.path.join(directory, "main.ce"), '--cc', cc, '--no-cache', '--string-pool-format', string_pool_format,
+                                               '--build-dir', os.path.join(directory, "build"), '-o', executable])
+    cedar.run(args)
+    process = subprocess.run([executable], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if process.returncode != 0:
+        return None
+    return process.stdout.decode('utf-8')
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--cc", default="gcc")
+    argparser.add_argument("--string-pool-format", default="literal")
+    args = argparser.parse_args()
+
+    for description, code, expected in PROGRAMS:
+        with tempfile.TemporaryDirectory() as directory:
+            output = build_and_run(directory, args.cc, args.string_pool_format, code)
+        assert output == expected, f"{description}: expected {expected!r}, got {output!r}"
+    print(f"OK: {len(PROGRAMS)} programs printed what they should")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Checks that the C header lexer of frontend/clexer.py, which finds tokens with a single
+regex, produces the same tokens as lex_by_char, the character-at-a-time lexer it
+replaced. Lexes the headers of test/ and lang-libs/cstdlib/, plus a snippet with the
+corner cases of C tokens, with and without skipping ignored tokens.
+
+Usage: python3 test/check_clexer.py [header ...]
+"""
+import os
+import sys
+import glob
+import argparse
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TEST_DIR)
+sys.path.insert(0, ROOT)
+import frontend.clexer as clexer
+
+# What cparser.parse_file ignores, plus attributes, to also skip their arguments
+IGNORE_TOKENS = {'inline', 'extern', 'static', '__attribute__', '__asm__', '__THROW'}
+
+SNIPPET = r'''
+#define MAX(a, b) ((a) > (b) ? (a) : (b))
+#define STR "a \"quoted\" string\\" /* comment */ 'c' '\''
+#define CONTINUED 1 + \
+    2
+extern int f(int x, ...) __attribute__((nonnull (1))) __THROW;
+static inline unsigned long long g(void) { return 0x1fULL + 1.5e-3f + .5 + 07; }
+struct s { int a : 3; char *p; } *ptr;
+int a = b->c >>= d <<= e != f && g || !h;
+// line comment
+'''
+
+
+def lex_all(filename, text, lex, ignore_tokens):
+    state = clexer.LexerState(filename, text, ignore_tokens)
+    tokens = []
+    while True:
+        token = lex(state)
+        tokens.append(token)
+        if token.type == clexer.TokenType.EOF:
+            return tokens
+
+
+def check(filename, text):
+    num_tokens = 0
+    for ignore_tokens in (set(), IGNORE_TOKENS):
+        expected = lex_all(filename, text, clexer.lex_by_char, ignore_tokens)
+        actual = lex_all(filename, text, clexer.lex, ignore_tokens)
+        for expected_token, actual_token in zip(expected, actual):
+            assert expected_token == actual_token, f"the lexers disagree on {filename}: expected {expected_token}, got {actual_token}"
+        assert len(expected) == len(actual), f"the lexers disagree on {filename}: expected {len(expected)} tokens, got {len(actual)}"
+        num_tokens += len(expected)
+    return num_tokens
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("headers", nargs="*")
+    args = argparser.parse_args()
+
+    headers = args.headers or sorted(glob.glob(os.path.join(TEST_DIR, '*.h')) + glob.glob(os.path.join(ROOT, 'lang-libs', 'cstdlib', '*.h')))
+    num_tokens = check('snippet.h', SNIPPET)
+    for filename in headers:
+        with open(filename, encoding='utf-8', errors='replace') as f:
+            num_tokens += check(filename, f.read())
+    print(f"OK: {len(headers) + 1} headers, {num_tokens} tokens")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Checks that the typechecked bodies of functions are reused from the cache only while
+what they looked up is unchanged (see Compilation.typecheck_functions in cedar.py). A
+program whose main module calls a function of and constructs a type of a library is
+built with a cache, then the library is edited without touching the main module:
+
+- Changing the body of the library function typechecks only that function again.
+- Changing the signature of the library function, or the fields of the type, also
+  typechecks the caller again, but not a function of the main module that looks up
+  neither. Each edit starts from the original library, whose body of the library
+  function is still cached.
+
+After every edit, the generated code is the same as that of a build without a cache.
+
+Usage: python3 test/check_function_cache.py
+"""
+import os
+import sys
+import argparse
+import tempfile
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TEST_DIR))
+import cedar
+from typecheck import typecheck
+
+MAIN = """import library.ce
+
+i32 caller(i32 a) {
+    let p = library.Point(a, 2)
+    return library.scale(p.x, p.y)
+}
+
+i32 bystander(i32 a) {
+    return a + 1
+}
+"""
+
+LIBRARY = """export type Point(i32 x, i32 y)
+
+export i32 scale(i32 a, i32 b) {
+    return a * b
+}
+"""
+
+# The edits of the library, with the functions that are typechecked again after each
+EDITS = [
+    ("unchanged", LIBRARY, set()),
+    ("body of scale", LIBRARY.replace("return a * b", "return a * b + 1"), {"scale"}),
+    ("signature of scale", LIBRARY.replace("i32 scale(i32 a, i32 b)", "i32 scale(i64 a, i32 b)"), {"scale", "caller"}),
+    ("fields of Point", LIBRARY.replace("Point(i32 x, i32 y)", "Point(i32 x, i16 y)"), {"caller"}),
+]
+
+
+def generate(directory, cache_directory):
+    session = cedar.Session(cedar.BuildCache(cache_directory))
+    compilation = cedar.Compilation("main.ce", [directory] + cedar.LANG_LIBS, {}, session)
+    compilation.parse(1)
+    machine_def = cedar.load_machine_def(os.path.join(cedar.ROOT, 'datatypes.json'))
+    return cedar.ccodegen.generate(compilation.declare_and_typecheck(machine_def, 1), machine_def)
+
+
+def write(directory, filename, text):
+    with open(os.path.join(directory, filename), "w") as f:
+        f.write(text)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.parse_args()
+
+    typechecked = set()
+    typecheck_function_body = typecheck.typecheck_function_body
+    def recording_typecheck_function_body(module_decls, ir_module, ir_function, fn):
+        typechecked.add(ir_function.name)
+        return typecheck_function_body(module_decls, ir_module, ir_function, fn)
+    typecheck.typecheck_function_body = recording_typecheck_function_body
+
+    with tempfile.TemporaryDirectory() as directory, tempfile.TemporaryDirectory() as cache_directory:
+        write(directory, "main.ce", MAIN)
+        write(directory, "library.ce", LIBRARY)
+        generate(directory, cache_directory)
+        assert {"caller", "bystander", "scale"} <= typechecked, "the functions weren't typechecked on a cold cache"
+        for description, library, expected in EDITS:
+            write(directory, "library.ce", library)
+            typechecked.clear()
+            code = generate(directory, cache_directory)
+            assert typechecked == expected, f"after changing the {description}, typechecked {sorted(typechecked)} rather than {sorted(expected)}"
+            assert code == generate(directory, None), f"after changing the {description}, the generated code differs from a build without a cache"
+    print(f"OK: {len(EDITS)} edits of the library, only the functions whose lookups changed typechecked again")
+
+
+if __name__ == '__main__':
+    main()
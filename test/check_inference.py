@@ -0,0 +1,93 @@
+"""
+Checks that the element types of arrays created from [] are inferred without changing
+the placeholder types they start as (see ir.InternedType): the typechecked functions
+refer only to interned types, also where an instruction was typechecked before the
+element type was inferred, and the placeholders keep their hashes.
+
+Usage: python3 test/check_inference.py
+"""
+import os
+import sys
+import argparse
+import tempfile
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TEST_DIR))
+import cedar
+import backend.ir as ir
+from typecheck import typecheck
+
+MAIN = """i32 aliases() {
+    let a = []
+    let b = a
+    a.append(1)
+    b.append(2)
+    return b[0]
+}
+
+i32 first(i32[] xs) {
+    return xs[0]
+}
+
+i32 argument() {
+    return first([])
+}
+
+i32 loop() {
+    let a = []
+    for i in 0..3 {
+        a.append(i)
+    }
+    let b = a
+    return b[2]
+}
+"""
+
+# The functions, with the array types they should refer to
+I32_ARRAY = ir.ArrayType(ir.IntegerType(32, True))
+EXPECTED = {"aliases": I32_ARRAY, "argument": I32_ARRAY, "loop": I32_ARRAY}
+
+
+def types_of(body):
+    types = []
+    def record(ty):
+        types.append(ty)
+        return ty
+    ir.substitute_types(body, record)
+    return types
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.parse_args()
+
+    placeholders = []
+    infer_element_type = typecheck.infer_element_type
+    def recording_infer_element_type(ty, elty):
+        placeholders.append((ty, hash(ty)))
+        infer_element_type(ty, elty)
+    typecheck.infer_element_type = recording_infer_element_type
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "main.ce"), "w") as f:
+            f.write(MAIN)
+        session = cedar.Session(cedar.BuildCache(None))
+        compilation = cedar.Compilation("main.ce", [directory] + cedar.LANG_LIBS, {}, session)
+        compilation.parse(1)
+        machine_def = cedar.load_machine_def(os.path.join(cedar.ROOT, 'datatypes.json'))
+        ir_modules = compilation.declare_and_typecheck(machine_def, 1)
+        cedar.ccodegen.generate(ir_modules, machine_def)
+
+    ir_module = ir_modules["main.ce"]
+    for name, array_type in EXPECTED.items():
+        types = types_of(ir_module.function_index[name][0].body)
+        assert not any(ty.placeholder for ty in types), f"{name}: a placeholder is left in the typechecked function"
+        assert any(ty is array_type for ty in types), f"{name}: the inferred array type isn't the interned one"
+    assert len(placeholders) == len(EXPECTED), f"inferred {len(placeholders)} placeholders rather than {len(EXPECTED)}"
+    for ty, placeholder_hash in placeholders:
+        assert ty == ir.ArrayType(ir.UninferredType()) and hash(ty) == placeholder_hash, f"the placeholder {ty} was changed"
+    print(f"OK: {len(placeholders)} array types inferred, no placeholder left or changed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Checks that the ways of lexing Cedar code in frontend/lexer.py agree on the tokens of the
+.ce files in test/ and lang-libs/, and of a snippet with strings that need unescaping:
+
+- lex, one Token at a time, with the default scan_table,
+- lex with scan_regex, which scan_table replaced,
+- lex_packed into PackedTokens, whose values and locations are computed from offsets
+  into the text when they are asked for,
+- lex_packed of the UTF-8 encoded file, as when lexing from a memory map, whose columns
+  also count characters rather than bytes.
+
+Usage: python3 test/check_lexer.py [file.ce ...]
+"""
+import os
+import sys
+import glob
+import argparse
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TEST_DIR)
+sys.path.insert(0, ROOT)
+import frontend.lexer as lexer
+
+SNIPPET = '''
+import core/io.ce
+
+i32 f(i32 x) {
+    let s = "tab\\there, quote \\" and newline\\n"
+    let t = 'single\\x41'
+    let u = ("naïve → ✓", 1) // ünïcode comment
+    let r = /ab+c/
+    if x > 2 { return x / 2 }
+    return x
+}
+'''
+
+
+def lex_tokens(filename, text, scan=None):
+    state = lexer.LexerState(filename, text, scan)
+    tokens = []
+    while True:
+        token = lexer.lex(state)
+        tokens.append((token.type, token.value, token.location))
+        if token.type == lexer.TokenType.EOF:
+            return tokens
+
+
+def lex_packed_tokens(filename, text):
+    packed = lexer.lex_packed(lexer.LexerState(filename, text))
+    # Ask for the locations back to front, as they are computed on demand
+    locations = [packed[i].location for i in reversed(range(len(packed)))][::-1]
+    return [(packed[i].type, packed[i].value, locations[i]) for i in range(len(packed))]
+
+
+def check(filename, text):
+    expected = lex_tokens(filename, text)
+    for name, tokens in [('scan_regex', lex_tokens(filename, text, lexer.scan_regex)),
+                         ('lex_packed', lex_packed_tokens(filename, text))]:
+        assert tokens == expected, f"{name} disagrees with lex on {filename}: {first_difference(expected, tokens)}"
+    tokens = lex_packed_tokens(filename, text.encode('utf-8'))
+    assert tokens == expected, f"lex_packed of bytes disagrees with lex on {filename}: {first_difference(expected, tokens)}"
+    return len(expected)
+
+
+def first_difference(expected, actual):
+    for expected_token, actual_token in zip(expected, actual):
+        if expected_token != actual_token:
+            return f"expected {expected_token}, got {actual_token}"
+    return f"expected {len(expected)} tokens, got {len(actual)}"
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("files", nargs="*")
+    args = argparser.parse_args()
+
+    files = args.files or sorted(glob.glob(os.path.join(TEST_DIR, '*.ce')) + glob.glob(os.path.join(ROOT, 'lang-libs', '**', '*.ce'), recursive=True))
+    num_tokens = check('snippet.ce', SNIPPET)
+    for filename in files:
+        with open(filename) as f:
+            num_tokens += check(filename, f.read())
+    print(f"OK: {len(files) + 1} files, {num_tokens} tokens")
+
+
+if __name__ == '__main__':
+    main()
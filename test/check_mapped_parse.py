@@ -0,0 +1,69 @@
+"""
+Checks that parsing a Cedar file from a memory map (see parser.parse_file) gives the same
+result as reading it into a string: the same definitions, with the same locations. Each
+.ce file of test/ and lang-libs/ is parsed as is, with CRLF line endings, and with
+non-ASCII strings and comments added, whose columns count characters either way. Then
+test/main.ce is compiled with every module mapped, which must generate the same code.
+
+Usage: python3 test/check_mapped_parse.py [file.ce ...]
+"""
+import os
+import re
+import sys
+import glob
+import argparse
+import tempfile
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TEST_DIR)
+sys.path.insert(0, ROOT)
+import cedar
+import frontend.parser as parser
+from check_reparse import locations
+
+NON_ASCII = 'let added_by_check_mapped_parse = ("naïve → ✓", 1) // ünïcode\n'
+
+
+def variants(text):
+    yield 'as is', text
+    yield 'CRLF', text.replace('\n', '\r\n')
+    # Start each function with a statement whose tokens follow non-ASCII characters
+    yield 'non-ASCII', re.sub(r'(^.*\)\s*\{[ \t]*\n)', lambda m: m.group(1) + '    ' + NON_ASCII, text, flags=re.MULTILINE)
+
+
+def check_file(filename, text, directory):
+    for description, variant in variants(text):
+        path = os.path.join(directory, os.path.basename(filename))
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(variant)
+        expected = parser.parse_file(path, filename, False, mapped=False)
+        actual = parser.parse_file(path, filename, False, mapped=True)
+        assert actual == expected, f"{filename} ({description}): the mapped file parses to other definitions"
+        assert locations(actual) == locations(expected), f"{filename} ({description}): the mapped file parses to other locations"
+
+
+def compile_program(mapped_parse_min_bytes):
+    cedar.MAPPED_PARSE_MIN_BYTES = mapped_parse_min_bytes
+    session = cedar.Session(cedar.BuildCache(None))
+    machine_def = cedar.load_machine_def(os.path.join(cedar.ROOT, 'datatypes.json'))
+    return cedar.compile_to_c('main.ce', [TEST_DIR] + cedar.LANG_LIBS, machine_def, {}, session, jobs=1)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("files", nargs="*")
+    args = argparser.parse_args()
+
+    files = args.files or sorted(glob.glob(os.path.join(TEST_DIR, '*.ce')) + glob.glob(os.path.join(ROOT, 'lang-libs', '**', '*.ce'), recursive=True))
+    with tempfile.TemporaryDirectory() as directory:
+        for filename in files:
+            with open(filename, encoding='utf-8') as f:
+                check_file(filename, f.read(), directory)
+
+    mapped_parse_min_bytes = cedar.MAPPED_PARSE_MIN_BYTES
+    assert compile_program(0) == compile_program(mapped_parse_min_bytes), "the generated code depends on whether modules are mapped"
+    print(f"OK: {len(files)} files parsed the same when mapped, also with CRLF and non-ASCII, and test/main.ce compiled mapped")
+
+
+if __name__ == '__main__':
+    main()
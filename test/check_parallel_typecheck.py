@@ -0,0 +1,54 @@
+"""
+Checks that typechecking the functions of a program in worker processes (see
+Compilation.typecheck_parallel in cedar.py) generates the same code as typechecking them
+one after the other. The threshold for typechecking in parallel is lowered, such that
+test/main.ce, which has far fewer functions, is typechecked in parallel.
+
+Usage: python3 test/check_parallel_typecheck.py [--cc gcc]
+"""
+import os
+import sys
+import argparse
+import tempfile
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TEST_DIR))
+import cedar
+
+
+def compile_program(cc, jobs, output):
+    args = cedar.build_argparser().parse_args([os.path.join(TEST_DIR, 'main.ce'), '--cc', cc, '--no-cache', '-j', str(jobs), '-o', output])
+    cedar.run(args)
+    with open(output) as f:
+        return f.read()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--cc", default="gcc", help="the C compiler whose predefined macros are used when parsing C headers")
+    args = argparser.parse_args()
+
+    if not cedar.can_fork_workers():
+        print("Skipped: worker processes can't be forked here, thus functions are always typechecked serially")
+        return
+
+    parallel_runs = []
+    typecheck_parallel = cedar.Compilation.typecheck_parallel
+    def counting_typecheck_parallel(self, ir_modules, functions, num_workers):
+        parallel_runs.append(len(functions))
+        return typecheck_parallel(self, ir_modules, functions, num_workers)
+    cedar.Compilation.typecheck_parallel = counting_typecheck_parallel
+    cedar.PARALLEL_TYPECHECK_MIN_FUNCTIONS = 1
+
+    with tempfile.TemporaryDirectory() as directory:
+        serial = compile_program(args.cc, 1, os.path.join(directory, 'serial.c'))
+        assert parallel_runs == [], "typechecked in parallel with a single job"
+        parallel = compile_program(args.cc, 2, os.path.join(directory, 'parallel.c'))
+        assert len(parallel_runs) == 1, "not typechecked in parallel"
+
+    assert serial == parallel, "the generated code depends on whether functions are typechecked in parallel"
+    print(f"OK: {parallel_runs[0]} functions typechecked by 2 processes, same code as typechecked serially")
+
+
+if __name__ == '__main__':
+    main()
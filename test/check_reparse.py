@@ -0,0 +1,116 @@
+"""
+Checks that reparsing a module after an edit (see parser.reparse_text) gives the same
+result as parsing the edited text from scratch: the same definitions, with the same
+locations, and the same spans. Each .ce file of test/ and lang-libs/ is edited a number
+of times in a row, with edits that add and remove blank lines, definitions and
+statements and change numbers. Edits that don't parse are skipped.
+
+Usage: python3 test/check_reparse.py [--edits 40] [--seed 1] [file.ce ...]
+"""
+import os
+import re
+import sys
+import glob
+import random
+import argparse
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TEST_DIR)
+sys.path.insert(0, ROOT)
+import frontend.parser as parser
+import frontend.astnodes as ast
+
+NEW_FUNCTION = "i32 added_by_check_reparse(i32 a) {\n    return a + 1\n}\n"
+
+
+def locations(node):
+    """
+    Returns the locations in the AST below node, which comparing ASTs leaves out.
+    """
+    result = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(reversed(node))
+        elif isinstance(node, ast.ASTNode):
+            result.append((type(node).__name__, node.location))
+            stack.extend(reversed([getattr(node, name) for name in node.__match_args__]))
+    return result
+
+
+def line_starts(text, pattern):
+    """
+    Returns the offsets of the lines following the lines that match pattern.
+    """
+    return [m.end() for m in re.finditer(pattern, text, re.MULTILINE)]
+
+
+def random_edit(rng, text, spans):
+    kind = rng.choice(['blank line', 'remove line', 'number', 'add function', 'remove definition', 'add statement'])
+    if kind == 'blank line':
+        offsets = line_starts(text, r'^.*[{}]\s*\n')
+        if offsets:
+            offset = rng.choice(offsets)
+            return text[:offset] + "\n" + text[offset:]
+    elif kind == 'remove line':
+        lines = [m for m in re.finditer(r'^[ \t]*\n', text, re.MULTILINE)]
+        if lines:
+            m = rng.choice(lines)
+            return text[:m.start()] + text[m.end():]
+    elif kind == 'number':
+        numbers = list(re.finditer(r'\b\d+\b', text))
+        if numbers:
+            m = rng.choice(numbers)
+            return text[:m.start()] + str(rng.randrange(1000)) + text[m.end():]
+    elif kind == 'add function':
+        offset = rng.choice([start for start, _end, _hash in spans] + [len(text)])
+        return text[:offset] + NEW_FUNCTION + text[offset:]
+    elif kind == 'remove definition' and spans:
+        start, end, _hash = rng.choice(spans)
+        return text[:start] + text[end:]
+    elif kind == 'add statement':
+        offsets = line_starts(text, r'^.*\)\s*\{[ \t]*\n')
+        if offsets:
+            offset = rng.choice(offsets)
+            return text[:offset] + "    let added_by_check_reparse = 1\n" + text[offset:]
+    return None
+
+
+def check_file(filename, text, rng, num_edits):
+    parsed = parser.parse_text_incremental(filename, filename, text, False)
+    num_checked = 0
+    for _ in range(num_edits):
+        new_text = random_edit(rng, parsed.text, parsed.spans)
+        if new_text is None:
+            continue
+        try:
+            expected = parser.parse_text_incremental(filename, filename, new_text, False)
+        except AssertionError:
+            continue
+        parser.reparse_text(parsed, new_text)
+        assert parsed.module == expected.module, f"{filename}: the reparsed definitions differ after an edit"
+        assert locations(parsed.module) == locations(expected.module), f"{filename}: the reparsed locations differ after an edit"
+        assert parsed.spans == expected.spans, f"{filename}: the reparsed spans differ after an edit"
+        num_checked += 1
+    return num_checked
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--edits", type=int, default=40, help="how many edits to try per file")
+    argparser.add_argument("--seed", type=int, default=1)
+    argparser.add_argument("files", nargs="*")
+    args = argparser.parse_args()
+
+    rng = random.Random(args.seed)
+    files = args.files or sorted(glob.glob(os.path.join(TEST_DIR, '*.ce')) + glob.glob(os.path.join(ROOT, 'lang-libs', '**', '*.ce'), recursive=True))
+    num_checked = 0
+    for filename in files:
+        with open(filename) as f:
+            num_checked += check_file(os.path.basename(filename), f.read(), rng, args.edits)
+    print(f"OK: {len(files)} files, {num_checked} edits reparsed")
+
+
+if __name__ == '__main__':
+    main()
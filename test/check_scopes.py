@@ -0,0 +1,116 @@
+"""
+Checks the scope chain that holds the locals of a function while it is typechecked (see
+ScopeChain in typecheck/typecheck.py):
+
+- Random sequences of entering scopes, defining and shadowing names and leaving scopes
+  give the same symbols as a list of dicts, one per scope, where the innermost wins.
+- Typechecking a function whose sibling loop bodies define locals of the same name but of
+  other types, and whose loop variable shadows a local of another type, gives no errors.
+  Using a local after the loop body that defined it is an error. (The bodies of ifs
+  aren't scopes of their own.)
+
+Usage: python3 test/check_scopes.py [--steps 20000] [--seed 1]
+"""
+import os
+import sys
+import random
+import argparse
+import tempfile
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TEST_DIR))
+import cedar
+from typecheck import typecheck
+
+SCOPES = """
+float scopes(i32 x) {
+    let s = 1.5
+    while x > 0 {
+        let y = 2.5
+        s = y * s
+        break
+    }
+    while x > 100 {
+        let y = (3, 4)
+        x = y[0]
+        break
+    }
+    for s in 0..3 {
+        x = x + s
+    }
+    return s
+}
+"""
+
+OUT_OF_SCOPE = """
+i32 out_of_scope(i32 x) {
+    while x > 0 {
+        let y = x
+        break
+    }
+    return y
+}
+"""
+
+
+def merged(scopes):
+    symbols = {}
+    for scope in scopes:
+        symbols.update(scope)
+    return symbols
+
+
+def check_chain(rng, num_steps):
+    names = ['a', 'b', 'c', 'd', 'e']
+    chain = typecheck.ScopeChain({'a': 'argument'})
+    scopes = [{'a': 'argument'}]
+    for step in range(num_steps):
+        action = rng.random()
+        if action < 0.2:
+            symbols = {name: ('pushed', step, name) for name in rng.sample(names, rng.randrange(3))}
+            typecheck.push_scope(chain, symbols)
+            scopes.append(dict(symbols))
+        elif action < 0.4 and len(scopes) > 1:
+            typecheck.pop_scope(chain)
+            scopes.pop()
+        else:
+            name = rng.choice(names)
+            typecheck.define(chain, name, ('defined', step))
+            scopes[-1][name] = ('defined', step)
+        assert chain.symbols == merged(scopes), f"the scope chain differs after {step + 1} steps"
+        assert len(chain.shadowed) == len(scopes)
+
+
+def compile_errors(code):
+    """
+    Returns the compile errors of typechecking code, which end up in the generated code.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "main.ce"), "w") as f:
+            f.write(code)
+        session = cedar.Session(cedar.BuildCache(None))
+        compilation = cedar.Compilation("main.ce", [directory] + cedar.LANG_LIBS, {}, session)
+        compilation.parse(1)
+        machine_def = cedar.load_machine_def(os.path.join(cedar.ROOT, 'datatypes.json'))
+        try:
+            ir_modules = compilation.declare_and_typecheck(machine_def, 1)
+        except AssertionError as e:
+            return [str(e)]
+        return [line.strip() for line in cedar.ccodegen.generate(ir_modules, machine_def).split("\n") if "Compile error" in line]
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--steps", type=int, default=20000)
+    argparser.add_argument("--seed", type=int, default=1)
+    args = argparser.parse_args()
+
+    check_chain(random.Random(args.seed), args.steps)
+    errors = compile_errors(SCOPES)
+    assert errors == [], errors
+    assert compile_errors(OUT_OF_SCOPE) != [], "a local was in scope after the loop body that defined it"
+    print(f"OK: {args.steps} steps of the scope chain, locals of nested scopes typechecked")
+
+
+if __name__ == '__main__':
+    main()
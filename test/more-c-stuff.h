@@ -5,7 +5,7 @@ typedef struct {
     int more_c_stuff;
 } more_c_stuff_t;
 
-int more_c_stuff() {
+static int more_c_stuff() {
     return 9999;
 }
 
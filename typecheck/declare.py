@@ -1,5 +1,6 @@
 import frontend.astnodes as ast
 import backend.ir as ir
+from backend.naming import stable_hash
 from dataclasses import dataclass
 import math
 
@@ -7,6 +8,10 @@ import math
 LAYOUT_CACHE = {}
 MACHINE_DEF = None
 
+# The lookups done while typechecking a function, as (kind, filename, name) tuples, or
+# None when they are not recorded (see typecheck.typecheck_function_body).
+CONSULTED = None
+
 def load_machine_def(machine_def):
     machine_def = machine_def.copy()
     for t in list(machine_def['types'].values()):
@@ -28,8 +33,8 @@ def make_ir_for_asttype(filename, astty):
             return ir.TypeDefinition(filename, astty.name, 'uninitialized', 'uninitialized', exported=astty.export, tagless=tagless)
         case ast.CStructDef():
             if astty.field_names is None:
-                return ir.CStructDefinition(filename, astty.name, None, None, None, None)
-            return ir.CStructDefinition(filename, astty.name, 'uninitialized', 'uninitialized', 'uninitialized', 'uninitialized')
+                return ir.CStructDefinition(filename, astty.name, None, None)
+            return ir.CStructDefinition(filename, astty.name, 'uninitialized', 'uninitialized')
         case ast.CUnionDef():
             return ir.CUnionDefinition(filename, astty.name, 'uninitialized', 'uninitialized')
         case ast.CEnumDef():
@@ -38,6 +43,56 @@ def make_ir_for_asttype(filename, astty):
             return ir.CTypedefDefinition(filename, astty.name, 'uninitialized')
     return None
 
+# The lookup functions use these per-module indexes, which map a name to the definitions
+# with that name in the order they are defined, rather than scanning every definition.
+def index_by_name(definitions):
+    index = {}
+    for definition in definitions:
+        index.setdefault(definition.name, []).append(definition)
+    return index
+
+def index_constructors(types):
+    index = {}
+    for ty in types:
+        if type(ty) == ir.TypeDefinition:
+            for ctor in ty.constructors:
+                index.setdefault(ctor.name, []).append((ty, ctor))
+        elif type(ty) in (ir.CStructDefinition, ir.CUnionDefinition):
+            index.setdefault(ty.name, []).append((ty, None))
+    return index
+
+def add_function(ir_module, fn):
+    ir_module.functions.append(fn)
+    ir_module.function_index.setdefault(fn.name, []).append(fn)
+
+def consult(kind, filename, name):
+    if CONSULTED is not None:
+        CONSULTED.add((kind, filename, name))
+
+def lookup_signature(ir_modules, kind, filename, name):
+    """
+    Returns a hash of everything a lookup of the name in the module's index of the given
+    kind ('type', 'function', 'variable' or 'constructor') finds, bodies of functions
+    excepted. Kind 'namespaces' hashes the module's imports instead. Hence, a function
+    that did the same lookups while being typechecked typechecks the same as long as
+    their signatures don't change.
+    """
+    ir_module = ir_modules.get(filename)
+    if ir_module is None:
+        return None
+    match kind:
+        case 'namespaces':
+            found = [(ns.name, [m.filename for m in ns.modules]) for ns in ir_module.namespaces]
+        case 'function':
+            found = [fn if type(fn) == ir.CFunctionDefinition else
+                     (fn.filename, fn.retty, fn.name, fn.argtys_implicit, fn.argnames_implicit, fn.argtys, fn.argnames, fn.exported)
+                     for fn in ir_module.function_index.get(name, ())]
+        case 'constructor':
+            found = [ty for ty, _ctor in ir_module.constructor_index.get(name, ())]
+        case _:
+            found = getattr(ir_module, kind + '_index').get(name, ())
+    return stable_hash(*(repr(d) for d in found))
+
 def declare_module_types(ast_module):
     types = []
     for node in ast_module.defs:
@@ -45,23 +100,26 @@ def declare_module_types(ast_module):
         if res is not None:
             types.append(res)
     main_module = ast_module.main_module if type(ast_module) == ast.ModuleDef else False
-    return ir.ModuleDefinition(ast_module.filename, 'uninitialized', 'uninitialized', types, 'uninitialized', main_module)
+    ir_module = ir.ModuleDefinition(ast_module.filename, 'uninitialized', 'uninitialized', types, 'uninitialized', main_module)
+    # Ugly hack
+    ir_module.__dict__['type_index'] = index_by_name(types)
+    return ir_module
 
 def lookup_type(ir_modules, filenames, tyname, current_module, on_failure=None):
     found = None
     found_non_exported = None
     for filename in filenames:
+        consult('type', filename, tyname)
         mod = ir_modules[filename]
-        for ty in mod.types:
-            if ty.name == tyname:
-                if type(found) == ir.CStructDefinition and found.field_names is None:
-                    found = ty
-                elif found is not None:
-                    assert False, "ambigious typename '%s'" % tyname
-                elif type(ty) in (ir.CStructDefinition, ir.CUnionDefinition, ir.CEnumDefinition, ir.CTypedefDefinition) or ty.exported or current_module == ty.filename:
-                    found = ty
-                else:
-                    found_non_exported = (filename, tyname)
+        for ty in mod.type_index.get(tyname, ()):
+            if type(found) == ir.CStructDefinition and found.field_names is None:
+                found = ty
+            elif found is not None:
+                assert False, "ambigious typename '%s'" % tyname
+            elif type(ty) in (ir.CStructDefinition, ir.CUnionDefinition, ir.CEnumDefinition, ir.CTypedefDefinition) or ty.exported or current_module == ty.filename:
+                found = ty
+            else:
+                found_non_exported = (filename, tyname)
     if not found and on_failure:
         return on_failure
     if not found and found_non_exported:
@@ -121,7 +179,7 @@ def resolve_type(ast_type, ir_modules, namespaces, current_module):
         case ast.TupleType(positional, named, names):
             positional = tuple(resolve_type(p, ir_modules, namespaces, current_module) for p in positional)
             named = tuple(resolve_type(p, ir_modules, namespaces, current_module) for p in named)
-            return ir.TupleType(positional, named, tuple(names), 'uninitialized', 'uninitialized')
+            return ir.TupleType(positional, named, tuple(names))
         case ast.UnionType(types):
             def order(ty):
                 return repr(ty)
@@ -227,6 +285,9 @@ def declare_module_rest(ast_module, ir_modules):
     ir_modules[ast_module.filename].__dict__['variables'] = global_vars
     ir_modules[ast_module.filename].__dict__['functions'] = funcs
     ir_modules[ast_module.filename].__dict__['namespaces'] = list(imported_namespaces.values())
+    ir_modules[ast_module.filename].__dict__['function_index'] = index_by_name(funcs)
+    ir_modules[ast_module.filename].__dict__['variable_index'] = index_by_name(global_vars)
+    ir_modules[ast_module.filename].__dict__['constructor_index'] = index_constructors(ir_modules[ast_module.filename].types)
 
 
 
@@ -299,15 +360,13 @@ def optimize_datatype_layout(tydef):
     if type(tydef) == ir.TupleType:
         all_fields = [(fty, fname) for fname, fty in enumerate(tydef.positional)] + [(fty, fname) for fname, fty in zip(tydef.names, tydef.named)]
         fieldtypes_w_padding, fieldnames_w_padding, align, size = struct_alignment_and_padding(all_fields)
-        tydef.__dict__['layout_types'] = tuple(fieldtypes_w_padding)
-        tydef.__dict__['layout_names'] = tuple(fieldnames_w_padding)
+        ir.define_tuple_layout(tydef, (tuple(fieldtypes_w_padding), tuple(fieldnames_w_padding)))
         LAYOUT_CACHE[key] = (align, size)
         return align, size
     elif type(tydef) == ir.CStructDefinition:
+        # The C compiler lays out the fields, thus only the alignment and size are kept
         all_fields = zip(tydef.field_types, tydef.field_names)
-        fieldtypes_w_padding, fieldnames_w_padding, align, size = struct_alignment_and_padding(all_fields)
-        tydef.__dict__['layout_types'] = tuple(fieldtypes_w_padding)
-        tydef.__dict__['layout_names'] = tuple(fieldnames_w_padding)
+        _fieldtypes_w_padding, _fieldnames_w_padding, align, size = struct_alignment_and_padding(all_fields)
         LAYOUT_CACHE[key] = (align, size)
         return align, size
     elif type(tydef) == ir.CTypedefDefinition:
@@ -367,7 +426,7 @@ def optimize_datatype_layout(tydef):
 
             # Split up large padding (32 bit ints) into smaller, such that the tag take the last 8 bits only
             while fieldtypes_w_padding[-1].bits > 8:
-                new_bits = fieldtypes_w_padding[-1].bits / 2
+                new_bits = fieldtypes_w_padding[-1].bits // 2
                 fieldtypes_w_padding[-1] = ir.IntegerType(new_bits, False)
                 fieldtypes_w_padding.append(ir.IntegerType(new_bits, False))
                 fieldnames_w_padding.append('__pad%d__' % len(fieldtypes_w_padding))
@@ -2,8 +2,9 @@ import os
 import frontend.astnodes as ast
 import backend.ir as ir
 from typecheck import declare
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typecheck.recompiler import compile_regex
+from backend.naming import stable_hash
 
 @dataclass
 class LoopContext:
@@ -13,14 +14,52 @@ class LoopContext:
     dest_variable: str
     dest_type: ir.Type
 
+# Marks a name that wasn't defined before a scope defined it.
+UNDEFINED = object()
+
+# The array types inferred for the placeholder array types (see ir.InternedType) of the
+# function being typechecked, by the id of the placeholder, with the placeholder such that
+# the id isn't reused.
+INFERRED = {}
+
+@dataclass
+class ScopeChain:
+    # The symbols of all the enclosing scopes in one dict, where the innermost definition
+    # of a name wins. For each scope, the definitions it shadowed are kept such that they
+    # can be restored when the scope is left.
+    symbols: dict = field(default_factory=dict)
+    shadowed: 'List[dict]' = field(default_factory=lambda: [{}])
+
+def push_scope(chain, symbols=None):
+    chain.shadowed.append({})
+    for name, value in (symbols or {}).items():
+        define(chain, name, value)
+
+def pop_scope(chain):
+    for name, previous in chain.shadowed.pop().items():
+        if previous is UNDEFINED:
+            del chain.symbols[name]
+        else:
+            chain.symbols[name] = previous
+
+def define(chain, name, value):
+    shadowed = chain.shadowed[-1]
+    if name not in shadowed:
+        shadowed[name] = chain.symbols.get(name, UNDEFINED)
+    chain.symbols[name] = value
+
 @dataclass
 class FunctionState:
     retty: ir.Type
-    local_symbols: 'List[dict]'
-    access_locals: 'List[dict]'
-    implicit_symbols: 'List[dict]'
+    local_symbols: ScopeChain
+    access_locals: ScopeChain
+    implicit_symbols: ScopeChain
     loops: 'List[LoopContext]'
     regexs: 'List[fndef]'
+    # Counter for generating function-unique label and variable names.
+    num_unique_ids: int = 0
+    # Counter for generating the names of temporaries.
+    num_temps: int = 0
 
 def describe(irty):
     match irty:
@@ -67,24 +106,61 @@ def is_error(ir_instr):
     return type(ir_instr) == ir.CompileError
 
 def lookup_local(function_state, name):
-    for d in reversed(function_state.local_symbols):
-        if name in d:
-            for acc in reversed(function_state.access_locals):
-                if name in acc:
-                    return acc[name]
-            return ir.LoadLocal(d[name], name)
-    return None
+    ty = function_state.local_symbols.symbols.get(name)
+    if ty is None:
+        return None
+    access = function_state.access_locals.symbols.get(name)
+    if access is not None:
+        return access
+    return ir.LoadLocal(resolve_inferred(ty), name)
+
+def infer_element_type(ty, elty):
+    INFERRED[id(ty)] = (ty, ir.ArrayType(elty))
+
+def resolve_inferred(ty):
+    """
+    Returns the type with the placeholders in it replaced by the types inferred for them
+    so far. That is an interned type when all of them are inferred, otherwise a placeholder
+    that contains the same uninferred placeholders.
+    """
+    if not ty.placeholder:
+        return ty
+    if id(ty) in INFERRED:
+        return resolve_inferred(INFERRED[id(ty)][1])
+    identity = ty.identity()
+    resolved = resolve_inferred_fields(identity)
+    if resolved == identity:
+        return ty
+    ty = type(ty)(*resolved)
+    if type(ty) == ir.TupleType:
+        declare.optimize_datatype_layout(ty)
+    return ty
+
+def resolve_inferred_fields(values):
+    resolved = []
+    for value in values:
+        if type(value) == tuple:
+            value = resolve_inferred_fields(value)
+        elif isinstance(value, (ir.Type, ir.CType)):
+            value = resolve_inferred(value)
+        resolved.append(value)
+    return tuple(resolved)
 
 def lookup_implicit(function_state, ty):
-    for d in reversed(function_state.implicit_symbols):
-        if ty in d:
-            return d[ty]
-    return None
+    return function_state.implicit_symbols.symbols.get(ty)
+
+def new_unique_id(function_state):
+    # NOTE: Don't use id(node) for this, as it makes the generated code differ between runs.
+    function_state.num_unique_ids += 1
+    return function_state.num_unique_ids
+
+def new_temp_id(function_state):
+    function_state.num_temps += 1
+    return function_state.num_temps
 
 def new_local_temp(function_state, ty):
-    num = sum(len(d) for d in function_state.local_symbols)
-    name = "__temp%s__" % num
-    function_state.local_symbols[-1][name] = ty
+    name = "__temp%s__" % new_temp_id(function_state)
+    define(function_state.local_symbols, name, ty)
     return name
 
 
@@ -117,9 +193,13 @@ def typecheck_instr(ty, instr, return_none=False):
             return ir.MakeOptional(ty, instr)
         case (ir.CTypedefDefinition(name='size_t'), _) if type(instr.ty) == ir.IntegerType:
             return instr
-        case (ir.ArrayType(), _) if instr.ty == ir.ArrayType(ir.UninferredType()):
-            instr.__dict__['ty'].__dict__['elty'] = ty.elty
-            return instr
+        case (ir.ArrayType(), _) if type(instr.ty) == ir.ArrayType and instr.ty.placeholder:
+            inferred = resolve_inferred(instr.ty)
+            if inferred == ir.ArrayType(ir.UninferredType()):
+                infer_element_type(instr.ty, ty.elty)
+                return instr
+            if inferred == ty:
+                return instr
         case (ir.CNamedType('int'), _) if type(instr.ty) == ir.IntegerType:
             return instr
         case (ir.IntegerType(bits, signed), _) if type(instr.ty) == ir.IntegerType and instr.ty.bits <= bits:
@@ -194,8 +274,9 @@ def dereference_pointer(module_decls, ir_expr):
     match ir_expr.ty:
         case ir.PointerType(ir.TypeDefinition(filename=filename)):
             module = module_decls[filename]
-            for fn in module.functions:
-                if fn.name == '__unpack__' and fn.retty == ir_expr.ty.target:
+            declare.consult('function', filename, '__unpack__')
+            for fn in module.function_index.get('__unpack__', ()):
+                if fn.retty == ir_expr.ty.target:
                     return ir.CallFunction(fn.retty, fn, (ir_expr,))
     return ir.DereferencePointer(ir_expr.ty.target, ir_expr, location=ir_expr.location)
 
@@ -319,7 +400,7 @@ def typecheck_pattern_match(module_decls, ir_module, function_state, local_decls
             # Let-Binding Case (New Identifier)
             case ast.NewIdentifierExpr(name):
                 # Let-binding: declare and store the value from rhs
-                function_state.local_symbols[-1][name] = rhs_type
+                define(function_state.local_symbols, name, rhs_type)
                 decl_list.append(ir.DeclareLocal(rhs_type, name, location=lhs_expr.location))
                 store_list.append(ir.StoreLocal(name, rhs_ir, location=lhs_expr.location))
 
@@ -338,18 +419,18 @@ def typecheck_pattern_match(module_decls, ir_module, function_state, local_decls
                 if function.retty == ir.BoolType():
                     eq_list.append(ir_call)
                 else:
-                    temp_name = "__match_%d" % sum(len(d) for d in function_state.local_symbols)
+                    temp_name = "__match_%d" % new_temp_id(function_state)
                     local_decls.append(ir.DeclareLocal(function.retty, temp_name))
                     eq_list.append(ir.UnaryOp(ir.BoolType(), '!', ir.OptionalIsEmpty(ir.BoolType(), ir.StoreLocalExpr(function.retty, temp_name, ir_call))))
                     for name, ty in zip(function.retty.target.names, function.retty.target.named):
                         decl_list.append(ir.DeclareLocal(ty, name))
                         store_list.append(ir.StoreLocal(name, ir.LoadMember(rhs_type, ir.OptionalGetValue(function.retty.target, ir.LoadLocal(function.retty, temp_name)), name)))
-                        function_state.local_symbols[-1][name] = rhs_type
+                        define(function_state.local_symbols, name, rhs_type)
                     for idx, ty in enumerate(function.retty.target.positional):
                         name = "_%d" % idx
                         decl_list.append(ir.DeclareLocal(ty, name))
                         store_list.append(ir.StoreLocal(name, ir.LoadTupleIndex(rhs_type, ir.OptionalGetValue(function.retty.target, ir.LoadLocal(function.retty, temp_name)), idx)))
-                        function_state.local_symbols[-1][name] = rhs_type
+                        define(function_state.local_symbols, name, rhs_type)
             # Fallback Case for Other BinaryOps (Equality Checks)
             case _:
                 eq_list.append(ir.BinaryOp(ir.BoolType(), typecheck_expr(module_decls, ir_module, function_state, local_decls, lhs_expr), '==', rhs_ir, location=lhs_expr.location))
@@ -487,14 +568,14 @@ def typecheck_expr(module_decls, ir_module, function_state, local_decls, node):
 
         case ast.RegexExpr(reast):
             bytecode, num_capturing_groups, capturing_group_mappings = compile_regex(reast)
-            str_ty = lookup(module_decls['__builtins__/string.ce'].types, 'String')
+            str_ty = lookup_builtin_type(module_decls, '__builtins__/string.ce', 'String')
             function = compile_regex_function(ir_module, bytecode, num_capturing_groups, capturing_group_mappings, str_ty)
             function_state.regexs.append(function)
             ty = ir.FunctionType(function.retty, function.argtys, function.argnames)
             return ir.LoadGlobal(ty, function.filename, function.name)
 
         case ast.SymbolExpr(s):
-            ty = lookup(module_decls['__builtins__/symbol.ce'].types, 'Symbol')
+            ty = lookup_builtin_type(module_decls, '__builtins__/symbol.ce', 'Symbol')
             ctor = ty.constructors[0]
             temp_name = new_local_temp(function_state, ty)
             local_decls.append(ir.DeclareLocal(ty, temp_name, location=location))
@@ -503,7 +584,7 @@ def typecheck_expr(module_decls, ir_module, function_state, local_decls, node):
             return ir.ExprWithStmt(ty, [stmt], ir.LoadLocal(ty, temp_name, location=location))
 
         case ast.StringExpr(s):
-            str_ty = lookup(module_decls['__builtins__/string.ce'].types, 'String')
+            str_ty = lookup_builtin_type(module_decls, '__builtins__/string.ce', 'String')
             ctor = str_ty.constructors[0]
             temp_name = new_local_temp(function_state, str_ty)
             arr_ty = ir.ArrayType(ir.IntegerType(8, False))
@@ -544,7 +625,7 @@ def typecheck_expr(module_decls, ir_module, function_state, local_decls, node):
             ir_upper = typecheck_expr(module_decls, ir_module, function_state, local_decls, upper)
             if type(ir_lower.ty) != ir.IntegerType or type(ir_upper.ty) != ir.IntegerType:
                 return ir.CompileError(f"Lower and upper limits of range must be integer values, got '{describe(ir_lower.ty)}' and '{describe(ir_upper.ty)}'", location=node.location)
-            ty = lookup(module_decls['__builtins__/range.ce'].types, 'Range')
+            ty = lookup_builtin_type(module_decls, '__builtins__/range.ce', 'Range')
             ctor = ty.constructors[0]
             temp_name = new_local_temp(function_state, ty)
             local_decls.append(ir.DeclareLocal(ty, temp_name, location=location))
@@ -554,8 +635,9 @@ def typecheck_expr(module_decls, ir_module, function_state, local_decls, node):
         
         # x else y
         case ast.BinaryElseExpr(lhs, rhs):
-            temp_name = "__tempelse_%d" % id(node)
-            result_name = "__resultelse_%d" % id(node)
+            h = new_unique_id(function_state)
+            temp_name = "__tempelse_%d" % h
+            result_name = "__resultelse_%d" % h
 
             ir_lhs = typecheck_expr(module_decls, ir_module, function_state, local_decls, lhs)
             if is_error(ir_lhs):
@@ -564,9 +646,9 @@ def typecheck_expr(module_decls, ir_module, function_state, local_decls, node):
                 return ir.CompileError(f"Can't apply operator 'else' to type '{describe(ir_lhs.ty)}'")
 
             rhs_decls = []
-            function_state.local_symbols.append({})
+            push_scope(function_state.local_symbols)
             ir_rhs_body = typecheck_stmt_block(module_decls, ir_module, function_state, rhs_decls, rhs.stmts)
-            function_state.local_symbols.pop()
+            pop_scope(function_state.local_symbols)
 
             if len(ir_rhs_body) > 0 and type(ir_rhs_body[-1]) == ir.IgnoreValue:
                 rhs_ty = ir_rhs_body[-1].value.ty
@@ -649,14 +731,14 @@ def typecheck_expr(module_decls, ir_module, function_state, local_decls, node):
         
         # <expr> where { <stmts> }
         case ast.WhereExpr(expr, body):
-            function_state.local_symbols.append({})
+            push_scope(function_state.local_symbols)
             
             ir_stmts = []
             for stmt in body:
                 ir_stmts.extend(typecheck_stmt(module_decls, ir_module, function_state, local_decls, stmt))
             
             ir_expr = typecheck_expr(module_decls, ir_module, function_state, local_decls, expr)
-            function_state.local_symbols.pop()
+            pop_scope(function_state.local_symbols)
             temp_name = new_local_temp(function_state, ir_expr.ty)
             
 
@@ -668,7 +750,7 @@ def typecheck_expr(module_decls, ir_module, function_state, local_decls, node):
         case ast.TupleExpr(positional, named, names):
             ir_positional = [typecheck_expr(module_decls, ir_module, function_state, local_decls, p) for p in positional]
             ir_named = [typecheck_expr(module_decls, ir_module, function_state, local_decls, p) for p in named]
-            ty = ir.TupleType(tuple(i.ty for i in ir_positional), tuple(i.ty for i in ir_named), tuple(names), 'uninitialized', 'uninitialized')
+            ty = ir.TupleType(tuple(i.ty for i in ir_positional), tuple(i.ty for i in ir_named), tuple(names))
             declare.optimize_datatype_layout(ty)
 
             temp_name = new_local_temp(function_state, ty)
@@ -723,11 +805,22 @@ def typecheck_expr(module_decls, ir_module, function_state, local_decls, node):
                 if fnname == 'append':
                     if len(ir_positional) != 1:
                         return ir.CompileError("Array.append expects one argument")
-                    if ir_target.ty.elty == ir.UninferredType():
-                        ir_target.ty.__dict__['elty'] = ir_positional[0].ty
-                    elif ir_positional[0].ty != ir_target.ty.elty:
-                        return ir.CompileError(f"Array.append expects argument of type {describe(ir_target.ty.elty)}; got {describe(ir_positional[0].ty)}")
+                    elty = resolve_inferred(ir_target.ty).elty
+                    if elty == ir.UninferredType():
+                        infer_element_type(ir_target.ty, ir_positional[0].ty)
+                    elif ir_positional[0].ty != elty:
+                        return ir.CompileError(f"Array.append expects argument of type {describe(elty)}; got {describe(ir_positional[0].ty)}")
                     return ir.ArrayAppend(ir.VoidType(), ir_target, ir_positional[0])
+                elif fnname == 'reserve':
+                    if len(ir_positional) != 1:
+                        return ir.CompileError("Array.reserve expects one argument")
+                    if type(ir_positional[0].ty) != ir.IntegerType:
+                        return ir.CompileError(f"Array.reserve expects an integer argument; got {describe(ir_positional[0].ty)}")
+                    return ir.ArrayReserve(ir.VoidType(), ir_target, ir_positional[0])
+                elif fnname == 'shrink_to_fit':
+                    if len(ir_positional) != 0:
+                        return ir.CompileError("Array.shrink_to_fit expects no arguments")
+                    return ir.ArrayShrinkToFit(ir.VoidType(), ir_target)
                 elif fnname == 'pop':
                     if len(ir_positional) != 0:
                         return ir.CompileError("Array.pop expects no arguments")
@@ -824,12 +917,13 @@ def typecheck_expr(module_decls, ir_module, function_state, local_decls, node):
             if ir_cond.ty != ir.BoolType():
                 assert False, ir.CompileError(f"Expected 'bool' for condition to if", location=location)
             true_decls = []
-            function_state.local_symbols.append({})
+            push_scope(function_state.local_symbols)
             ir_true_body = typecheck_stmt_block(module_decls, ir_module, function_state, true_decls, true_body.stmts)
-            function_state.local_symbols[-1] = {}
+            pop_scope(function_state.local_symbols)
+            push_scope(function_state.local_symbols)
             false_decls = []
             ir_false_body = typecheck_stmt_block(module_decls, ir_module, function_state, false_decls, false_body.stmts)
-            function_state.local_symbols.pop()
+            pop_scope(function_state.local_symbols)
             true_type = type_of_stmt_block(ir_true_body)
             false_type = type_of_stmt_block(ir_false_body)
             ty = unify_types_from_branches(true_type, false_type)
@@ -856,18 +950,18 @@ def typecheck_expr(module_decls, ir_module, function_state, local_decls, node):
             idx = ir_iterable.ty.constructors[0].field_names.index('lower')
             itty = ir_iterable.ty.constructors[0].field_types[idx]
             
-            h = id(node)
+            h = new_unique_id(function_state)
             exit_lbl = "_exitloop_lbl_%d" % h
             enter_lbl = "_enterloop_lbl_%d" % h
             reenter_lbl = "_reenterloop_lbl_%d" % h
 
             result_var = "_loopresult_%d" % h
             context = LoopContext(exit_lbl, reenter_lbl, True, result_var, None)
-            function_state.local_symbols.append({name: itty})
+            push_scope(function_state.local_symbols, {name: itty})
             function_state.loops.append(context)
             body_decls = []
             ir_body = typecheck_stmt_block(module_decls, ir_module, function_state, body_decls, body.stmts)
-            function_state.local_symbols.pop()
+            pop_scope(function_state.local_symbols)
             function_state.loops.pop()
 
             if context.dest_type is None:
@@ -897,17 +991,17 @@ def typecheck_expr(module_decls, ir_module, function_state, local_decls, node):
         case ast.WhileExpr(cond, body):
             ir_cond = typecheck_expr(module_decls, ir_module, function_state, local_decls, cond)
 
-            h = id(node)
+            h = new_unique_id(function_state)
             exit_lbl = "_exitloop_lbl_%d" % h
             enter_lbl = "_enterloop_lbl_%d" % h
 
             result_var = "_loopresult_%d" % h
             context = LoopContext(exit_lbl, enter_lbl, True, result_var, None)
-            function_state.local_symbols.append({})
+            push_scope(function_state.local_symbols)
             function_state.loops.append(context)
             body_decls = []
             ir_body = typecheck_stmt_block(module_decls, ir_module, function_state, body_decls, body.stmts)
-            function_state.local_symbols.pop()
+            pop_scope(function_state.local_symbols)
             function_state.loops.pop()
 
             if context.dest_type is None:
@@ -973,9 +1067,9 @@ def typecheck_stmt(module_decls, ir_module, function_state, local_decls, node):
                 return [ir_expr]
             if type(ir_expr) == ir.UntypedNull:
                 return [ir.CompileError("Can't assign untyped 'null' to fresh variable '%s' without type declaration" % name, location=location)]                
-            function_state.local_symbols[-1][name] = ir_expr.ty
+            define(function_state.local_symbols, name, ir_expr.ty)
             if is_implicit:
-                function_state.implicit_symbols[-1][ir_expr.ty] = name
+                define(function_state.implicit_symbols, ir_expr.ty, name)
 
             local_decls.append(ir.DeclareLocal(ir_expr.ty, name))
             return [ir.StoreLocal(name, ir_expr)]
@@ -1050,10 +1144,10 @@ def typecheck_stmt(module_decls, ir_module, function_state, local_decls, node):
                 return [ir.CompileError(f"Expected 'bool' for condition to if", location=location)]
             true_decls = []
             if unwrap_optional:
-                function_state.access_locals.append({unwrap_optional: ir.OptionalGetValue(unwrap_type.target, ir.LoadLocal(unwrap_type, unwrap_optional))})
+                push_scope(function_state.access_locals, {unwrap_optional: ir.OptionalGetValue(unwrap_type.target, ir.LoadLocal(unwrap_type, unwrap_optional))})
             ir_true_body = typecheck_stmt_block(module_decls, ir_module, function_state, true_decls, true_body.stmts)
             if unwrap_optional:
-                function_state.access_locals.pop()
+                pop_scope(function_state.access_locals)
             false_decls = []
             ir_false_body = typecheck_stmt_block(module_decls, ir_module, function_state, false_decls, false_body.stmts)
             return [ir.IfElse(ir_cond, true_decls + ir_true_body, false_decls + ir_false_body)]
@@ -1066,16 +1160,16 @@ def typecheck_stmt(module_decls, ir_module, function_state, local_decls, node):
             idx = ir_iterable.ty.constructors[0].field_names.index('lower')
             itty = ir_iterable.ty.constructors[0].field_types[idx]
             
-            h = id(node)
+            h = new_unique_id(function_state)
             exit_lbl = "_exitloop_lbl_%d" % h
             enter_lbl = "_enterloop_lbl_%d" % h
             reenter_lbl = "_reenterloop_lbl_%d" % h
 
-            function_state.local_symbols.append({name: itty})
+            push_scope(function_state.local_symbols, {name: itty})
             function_state.loops.append(LoopContext(exit_lbl, reenter_lbl, False, None, None))
             body_decls = []
             ir_body = typecheck_stmt_block(module_decls, ir_module, function_state, body_decls, body.stmts)
-            function_state.local_symbols.pop()
+            pop_scope(function_state.local_symbols)
             function_state.loops.pop()
 
 
@@ -1098,15 +1192,15 @@ def typecheck_stmt(module_decls, ir_module, function_state, local_decls, node):
         case ast.ExprStmt(ast.WhileExpr(cond, body)):
             ir_cond = typecheck_expr(module_decls, ir_module, function_state, local_decls, cond)
 
-            h = id(node)
+            h = new_unique_id(function_state)
             exit_lbl = "_exitloop_lbl_%d" % h
             enter_lbl = "_enterloop_lbl_%d" % h
 
-            function_state.local_symbols.append({})
+            push_scope(function_state.local_symbols)
             function_state.loops.append(LoopContext(exit_lbl, enter_lbl, False, None, None))
             body_decls = []
             ir_body = typecheck_stmt_block(module_decls, ir_module, function_state, body_decls, body.stmts)
-            function_state.local_symbols.pop()
+            pop_scope(function_state.local_symbols)
             function_state.loops.pop()
 
 
@@ -1169,11 +1263,11 @@ def compile_regex_function(ir_module, bytecode, num_groups, group_mappings, stri
         names = tuple(sorted(group_mappings.keys()))
         named = tuple([string_ty] * len(group_mappings))
         positional = tuple([string_ty] * (num_groups - len(group_mappings)))
-        retty = ir.OptionType(ir.TupleType(positional, named, names, 'uninitialized', 'uninitialized'))
+        retty = ir.OptionType(ir.TupleType(positional, named, names))
         declare.optimize_datatype_layout(retty)
     else:
         retty = ir.BoolType()
-    fnname = "regex_%d" % (abs(hash(tuple(bytecode))))
+    fnname = "regex_%s" % stable_hash(*bytecode)
 
     argtys = (string_ty,)
     argnames = ('string',)
@@ -1181,19 +1275,47 @@ def compile_regex_function(ir_module, bytecode, num_groups, group_mappings, stri
     body = [ir.ReturnValue(ir.RegexMatch(retty, ir.LoadLocal(string_ty, 'string'), bytecode, num_groups, gmappings))]
     return ir.FunctionDefinition(ir_module.filename, retty, fnname, (), (), argtys, argnames, body, True)
 
-def typecheck_function(module_decls, ir_module, ir_function, fn):
+def typecheck_function_body(module_decls, ir_module, ir_function, fn):
+    """
+    Returns the typechecked body of the function and the regex functions it uses,
+    without adding them to the declarations. Thus, the functions of a module can be
+    typechecked in any order, or by different processes (see cedar.py).
+
+    Also returns the lookups it did (see declare.lookup_signature), which include the
+    function's own declaration and the imports of its module.
+    """
+    declare.CONSULTED = {('function', ir_module.filename, ir_function.name), ('namespaces', ir_module.filename, None)}
+    try:
+        body, regexs = typecheck_function_statements(module_decls, ir_module, ir_function, fn)
+        return body, regexs, sorted(declare.CONSULTED, key=repr)
+    finally:
+        declare.CONSULTED = None
+
+def typecheck_function_statements(module_decls, ir_module, ir_function, fn):
     args = dict(zip(ir_function.argnames, ir_function.argtys))
     args.update(dict(zip(ir_function.argnames_implicit, ir_function.argtys_implicit)))
-    function_state = FunctionState(ir_function.retty, [args], [{}], [dict(zip(ir_function.argtys_implicit, ir_function.argnames_implicit))], [], [])
+    function_state = FunctionState(ir_function.retty, ScopeChain(args), ScopeChain(), ScopeChain(dict(zip(ir_function.argtys_implicit, ir_function.argnames_implicit))), [], [])
     body = []
     local_decls = []
+    INFERRED.clear()
     for stmt in fn.body:
         body.extend(typecheck_stmt(module_decls, ir_module, function_state, local_decls, stmt))
-    ir_function.__dict__['body'] = tuple(local_decls + body)
+    body = tuple(local_decls + body)
+    # The instructions typechecked before a placeholder was inferred still have it
+    if INFERRED:
+        body = ir.substitute_types(body, resolve_inferred)
+        INFERRED.clear()
+    return body, function_state.regexs
+
+def define_function_body(ir_module, ir_function, body, regexs):
+    # Ugly hack
+    ir_function.__dict__['body'] = body
+    for fndef in regexs:
+        declare.add_function(ir_module, fndef)
 
-    str_ty = lookup(module_decls['__builtins__/string.ce'].types, 'String')
-    for fndef in function_state.regexs:
-        ir_module.functions.append(fndef)
+def typecheck_function(module_decls, ir_module, ir_function, fn):
+    body, regexs, _consulted = typecheck_function_body(module_decls, ir_module, ir_function, fn)
+    define_function_body(ir_module, ir_function, body, regexs)
 
 def lookup(lst, name):
     for l in lst:
@@ -1201,25 +1323,21 @@ def lookup(lst, name):
             return l
     return None
 
+def lookup_builtin_type(module_decls, filename, name):
+    declare.consult('type', filename, name)
+    return module_decls[filename].type_index[name][0]
+
 def lookup_constructor(ir_modules, name, current_module):
     found = None
     found_is_exported = False
     for ir_module in ir_modules:
-        for ty in ir_module.types:
-            if type(ty) == ir.TypeDefinition:
-                for ctor in ty.constructors:
-                    if ctor.name == name:
-                        if found is None:
-                            found = ty, ctor
-                            found_is_exported = getattr(ty, 'exported', True) or current_module == ty.filename
-                        else:
-                            assert False, "ambigious constructor: %s.%s vs %s.%s" % (found[0].name, found[1], ty.name, ctor)
-            elif ty.name == name and type(ty) in (ir.CStructDefinition, ir.CUnionDefinition):
-                if found is None:
-                    found = ty, None
-                    found_is_exported = True
-                else:
-                    assert False, "ambigious constructor: %s.%s vs %s.%s" % (found[0].name, found[1], ty.name, ctor)
+        declare.consult('constructor', ir_module.filename, name)
+        for ty, ctor in ir_module.constructor_index.get(name, ()):
+            if found is None:
+                found = ty, ctor
+                found_is_exported = ctor is None or getattr(ty, 'exported', True) or current_module == ty.filename
+            else:
+                assert False, "ambigious constructor: %s.%s vs %s.%s" % (found[0].name, found[1], ty.name, ctor)
     if found is None:
         return None, None
     assert found_is_exported, "%s:%s (%s) is not exported" % (found[0].filename, found[0].name, found[1].name)
@@ -1229,13 +1347,13 @@ def lookup_function(ir_modules, name, current_module):
     found = None
     found_is_exported = False
     for ir_module in ir_modules:
-        for fn in ir_module.functions:
-            if fn.name == name:
-                if found is None:
-                    found_is_exported = getattr(fn, 'exported', True) or current_module == fn.filename
-                    found = ir_module, fn
-                else:
-                    assert False, "ambigious function: %s/%s vs %s/%s" % (found[0].filename, found[1].name, ir_module.filename, fn.name)
+        declare.consult('function', ir_module.filename, name)
+        for fn in ir_module.function_index.get(name, ()):
+            if found is None:
+                found_is_exported = getattr(fn, 'exported', True) or current_module == fn.filename
+                found = ir_module, fn
+            else:
+                assert False, "ambigious function: %s/%s vs %s/%s" % (found[0].filename, found[1].name, ir_module.filename, fn.name)
     if found is None:
         return None, None
     assert found_is_exported, "%s:%s is not exported" % (found[0].filename, found[1].name)
@@ -1244,12 +1362,12 @@ def lookup_function(ir_modules, name, current_module):
 def lookup_variable(ir_modules, name, return_none_if_not_found=False):
     found = None
     for ir_module in ir_modules:
-        for var in ir_module.variables:
-            if var.name == name:
-                if found is None:
-                    found = ir_module, var
-                else:
-                    assert False, "Ambigious %s/%s vs %s/%s" % (found[0].filename, found[1].name, ir_module.filename, var.name)
+        declare.consult('variable', ir_module.filename, name)
+        for var in ir_module.variable_index.get(name, ()):
+            if found is None:
+                found = ir_module, var
+            else:
+                assert False, "Ambigious %s/%s vs %s/%s" % (found[0].filename, found[1].name, ir_module.filename, var.name)
     if return_none_if_not_found and found is None:
         return None, None
     assert found, "Not found: %s" % name
@@ -1261,7 +1379,7 @@ def typecheck_module(module_decls, ast_module):
         match d:
             case ast.FunctionDef():
                 #print("typechecking function: ", d.name)
-                ir_function = lookup(ir_module.functions, d.name)
+                ir_function = ir_module.function_index[d.name][0]
                 typecheck_function(module_decls, ir_module, ir_function, d)
 
 